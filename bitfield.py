@@ -0,0 +1,193 @@
+import base64
+import binascii
+
+
+class Bitfield:
+    """Packed bitfield with one bit per piece.
+
+    Bits are stored most significant bit first, as in the BitTorrent wire
+    protocol, so piece 0 is the high bit of the first byte. The padding bits
+    of the last byte are always zero. Bulk operations go through Python ints,
+    which keeps popcount and AND/ANDNOT cheap even for 100k+ pieces.
+    """
+
+    ENCODINGS = ("ascii", "hex", "b64")
+
+    def __init__(self, length, data=None):
+        if length < 0:
+            raise ValueError(f"Invalid bitfield length: {length}")
+        self.length = length
+        size = (length + 7) // 8
+        if data is None:
+            self.data = bytearray(size)
+        else:
+            if len(data) != size:
+                raise ValueError(
+                    f"Expected {size} bytes for {length} pieces, got {len(data)}"
+                )
+            self.data = bytearray(data)
+            if length % 8:
+                self.data[-1] &= (0xFF << (8 - length % 8)) & 0xFF
+
+    @classmethod
+    def from_string(cls, text):
+        """Build a bitfield from an ASCII string like "010110"."""
+        if text.strip("01"):
+            raise ValueError(f"Invalid bitfield: {text}")
+        return cls.from_int(len(text), int(text, 2) if text else 0)
+
+    @classmethod
+    def from_int(cls, length, value):
+        """Build a bitfield whose piece 0 is the highest of `length` bits."""
+        size = (length + 7) // 8
+        value <<= size * 8 - length
+        return cls(length, value.to_bytes(size, "big"))
+
+    @classmethod
+    def from_hex(cls, length, text):
+        return cls(length, bytes.fromhex(text))
+
+    @classmethod
+    def from_base64(cls, length, text):
+        text += "=" * (-len(text) % 4)
+        return cls(length, base64.urlsafe_b64decode(text))
+
+    @classmethod
+    def decode(cls, text, length=None, encoding="ascii"):
+        """Decode a bitfield sent on the wire.
+
+        Hex and base64 bitfields do not carry their length, so it has to be
+        given. Raises ValueError for malformed input.
+        """
+        try:
+            if encoding == "ascii":
+                bitfield = cls.from_string(text)
+                if length is not None and len(bitfield) != length:
+                    raise ValueError(
+                        f"Expected {length} pieces, got {len(bitfield)}"
+                    )
+                return bitfield
+            if length is None:
+                raise ValueError(f"A {encoding} bitfield needs its length")
+            if encoding == "hex":
+                return cls.from_hex(length, text)
+            if encoding == "b64":
+                return cls.from_base64(length, text)
+        except binascii.Error as e:
+            raise ValueError(f"Invalid {encoding} bitfield: {e}")
+        raise ValueError(f"Unknown bitfield encoding: {encoding}")
+
+    def encode(self, encoding="ascii"):
+        if encoding == "ascii":
+            return self.to_string()
+        if encoding == "hex":
+            return self.to_hex()
+        if encoding == "b64":
+            return self.to_base64()
+        raise ValueError(f"Unknown bitfield encoding: {encoding}")
+
+    def to_string(self):
+        if not self.length:
+            return ""
+        return format(self.to_int(), f"0{self.length}b")
+
+    def to_hex(self):
+        return self.data.hex()
+
+    def to_base64(self):
+        """Encode as unpadded URL-safe base64, which is safe in a query string."""
+        return base64.urlsafe_b64encode(self.data).rstrip(b"=").decode()
+
+    def to_int(self):
+        """Return the bits as an int whose lowest bit is the last piece."""
+        return int.from_bytes(self.data, "big") >> (
+            len(self.data) * 8 - self.length
+        )
+
+    def to_bytes(self):
+        return bytes(self.data)
+
+    def copy(self):
+        return Bitfield(self.length, self.data)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.length:
+            raise IndexError("bitfield index out of range")
+        return bool(self.data[index >> 3] & (0x80 >> (index & 7)))
+
+    def __setitem__(self, index, value):
+        if not 0 <= index < self.length:
+            raise IndexError("bitfield index out of range")
+        if value:
+            self.data[index >> 3] |= 0x80 >> (index & 7)
+        else:
+            self.data[index >> 3] &= ~(0x80 >> (index & 7)) & 0xFF
+
+    def __eq__(self, other):
+        if not isinstance(other, Bitfield):
+            return NotImplemented
+        return self.length == other.length and self.data == other.data
+
+    __hash__ = None
+
+    def __str__(self):
+        return self.to_string()
+
+    def __repr__(self):
+        return f"Bitfield({self.count()}/{self.length})"
+
+    def count(self):
+        """Return the number of pieces present."""
+        return int.from_bytes(self.data, "big").bit_count()
+
+    def missing(self):
+        """Return the number of pieces not present."""
+        return self.length - self.count()
+
+    def complete(self):
+        return self.count() == self.length
+
+    def _combine(self, other, value):
+        if self.length != other.length:
+            raise ValueError(
+                f"Bitfield lengths differ: {self.length} != {other.length}"
+            )
+        return Bitfield(self.length, value.to_bytes(len(self.data), "big"))
+
+    def __and__(self, other):
+        return self._combine(
+            other,
+            int.from_bytes(self.data, "big") & int.from_bytes(other.data, "big"),
+        )
+
+    def __or__(self, other):
+        return self._combine(
+            other,
+            int.from_bytes(self.data, "big") | int.from_bytes(other.data, "big"),
+        )
+
+    def andnot(self, other):
+        """Return the pieces present here but not in `other`.
+
+        `theirs.andnot(mine)` is the set of pieces a peer can give us.
+        """
+        return self._combine(
+            other,
+            int.from_bytes(self.data, "big")
+            & ~int.from_bytes(other.data, "big"),
+        )
+
+    def any(self):
+        return any(self.data)
+
+    def iter_set(self):
+        """Yield the indexes of the pieces present, skipping empty bytes."""
+        for byte_index, byte in enumerate(self.data):
+            if byte:
+                base = byte_index << 3
+                for bit in range(8):
+                    if byte & (0x80 >> bit):
+                        yield base + bit
@@ -1,8 +1,63 @@
 CONFIGS = {
     "TRACKER_HOST": "localhost",
     "TRACKER_PORT": 8080,
+    # "host:port" of every node of the tracker ring; empty for just the one above
+    "TRACKER_NODES": [],
+    "RING_VNODES": 64,  # Points of each tracker node on the hash ring
     "BUFFER_SIZE": 1024,
     "MAX_CONNECTIONS": 5,
+    "MAX_REQUEST_HEAD": 64 * 1024,  # Bytes of request line and headers
+    "MAX_REQUEST_BODY": 1024 * 1024,  # Bytes of request body
+    "TRACKER_MODE": "thread",  # "thread" or "async"
+    "ASYNC_BACKLOG": 4096,  # Listen backlog of the asyncio tracker
+    "TRACKER_WORKERS": 1,  # Processes sharing the port via SO_REUSEPORT
+    "MAX_TORRENTS": 10000,  # Torrents with peers a tracker node keeps
+    "ANNOUNCE_INTERVAL": 30,  # Seconds between re-announces, told to peers
+    "TRACKER_FAILBACK_INTERVAL": 60,  # Seconds before a failed-over peer retries its own node
+    "PEER_TTL": 90,  # Seconds without a request before a peer expires
+    "TOMBSTONE_TTL": 300,  # Seconds expired peers stay listed in deltas
+    "REGISTRY_HISTORY": 65536,  # Latest registry changes deltas can be served from
+    "EXPIRY_SWEEP_INTERVAL": 5,  # Seconds between sweeps for expired peers
+    "DEFAULT_NUMWANT": 50,  # Peers per list when the request has no numwant
+    "MAX_NUMWANT": 200,  # Most peers the tracker sends in one list
+    "TRACKER_STATE_DIR": "tracker_state",  # Registry snapshot and log
+    "SNAPSHOT_INTERVAL": 60,  # Max seconds between registry snapshots
+    "WAL_MAX_ENTRIES": 10000,  # Log entries that trigger a snapshot
+    "WAL_OPEN_FILES": 64,  # Torrent logs the tracker keeps open at once
+    "PIECE_CHUNK_SIZE": 64 * 1024,  # Bytes per read/write when moving pieces
+    "BLOCK_SIZE": 16 * 1024,  # Bytes per block request, pieces are cut into blocks
+    "PIECE_CACHE_SIZE": 0,  # Bytes of hot pieces kept in memory without USE_MMAP, 0 for none
+    "PIECE_CACHE_POLICY": "lru",  # Cache eviction: "lru" or "lfu"
+    "USE_MMAP": True,  # Serve pieces from memory-mapped shared files
+    "USE_SENDFILE": True,  # Otherwise serve them with zero-copy loop.sendfile
+    "MAX_PIPELINE": 4,  # Outstanding piece requests per peer connection
+    "KEEP_ALIVE_TIMEOUT": 30,  # Seconds an idle peer connection stays open
+    "REPORT_DELAY": 0.2,  # Seconds to gather bitfield updates into one PUT
+    "UPLOAD_RATE": 0,  # Bytes per second sent to all peers together, 0 for no limit
+    "PEER_UPLOAD_RATE": 0,  # Bytes per second sent to each peer, 0 for no limit
+    "DOWNLOAD_RATE": 0,  # Bytes per second received from all peers together
+    "PEER_DOWNLOAD_RATE": 0,  # Bytes per second received from each peer
+    "RATE_LIMIT_BURST": 0.1,  # Seconds of traffic a limiter lets through at once
+    "RATE_LIMIT_SLICES": 20,  # Slices per second throttled transfers are cut into
+    "RATE_LIMIT_MAX_PEERS": 256,  # Per-peer limiters kept before idle ones go
+    "RATE_LIMIT_FILE": "rate_limits.json",  # Limits read at runtime, in the peer directory
+    "RATE_LIMIT_RELOAD_INTERVAL": 1,  # Seconds between checks of the limits file
+    "PIECE_PICKER": "rarest",  # "rarest", "random" or "sequential"
+    "RANDOM_FIRST_PIECES": 4,  # Random picks before "random" turns rarest-first
+    "MAX_REQUESTS_PER_PEER": 4,  # Piece requests in flight per peer
+    "ENDGAME_PIECES": 4,  # Missing pieces left when endgame mode starts
+    "ENDGAME_SOURCES": 3,  # Peers asked for the same piece in endgame mode
+    "REQUEST_TIMEOUT": 30,  # Seconds before a piece request counts as failed
+    "RETRY_BACKOFF": 1,  # Seconds a peer is skipped after its first failure
+    "MAX_RETRY_BACKOFF": 60,  # Upper bound of the doubling backoff
+    "NUMWANT": 50,  # Peers a peer asks the tracker for
+    "COMPACT_PEER_LIST": True,  # Ask for binary peer lists instead of text
+    "TRACKER_REFRESH_INTERVAL": 30,  # Seconds between peer list refreshes
+    "STARVED_REFRESH_DELAY": 2,  # Refresh delay when no peer has what we want
+    "HASH_WORKERS": 2,  # Threads verifying piece hashes off the event loop
+    "RESUME_FILE": ".resume.json",  # Fast-resume state, in the peer directory
+    "RESUME_SAVE_DELAY": 2,  # Seconds to gather pieces before saving resume
+    "MANIFEST": "torrent.json",  # Files, piece size and piece hashes to share
     "PEER_BASE_DIR": "./peers",  # Base folder for peer simulation folders
     "ACTIONS": {
         "REGISTER": "register",
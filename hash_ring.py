@@ -0,0 +1,87 @@
+import bisect
+import hashlib
+
+from config import CONFIGS
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], "big")
+
+
+def split_node(node):
+    """Split a "host:port" node name into (host, port)."""
+    host, _, port = node.rpartition(":")
+    return host, int(port)
+
+
+class HashRing:
+    """Consistent hash ring assigning torrents to tracker nodes.
+
+    Every node sits at RING_VNODES points of the ring, and a torrent belongs
+    to the node of the first point at or after the hash of its info hash.
+    Adding or removing a node only moves the torrents next to its points,
+    and every peer computes the same owner without asking anyone.
+    """
+
+    def __init__(self, nodes=(), vnodes=None):
+        self.vnodes = vnodes or CONFIGS["RING_VNODES"]
+        self.nodes = []
+        # Sorted ring points, and the node at each of them
+        self.points = []
+        self.owners = []
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for replica in range(self.vnodes):
+            point = ring_hash(f"{node}#{replica}")
+            index = bisect.bisect(self.points, point)
+            self.points.insert(index, point)
+            self.owners.insert(index, node)
+
+    def remove(self, node):
+        self.nodes.remove(node)
+        kept = [
+            (point, owner)
+            for point, owner in zip(self.points, self.owners)
+            if owner != node
+        ]
+        self.points = [point for point, _ in kept]
+        self.owners = [owner for _, owner in kept]
+
+    def owner(self, key):
+        """Return the node owning `key`, or None on an empty ring."""
+        nodes = self.nodes_for(key)
+        return nodes[0] if nodes else None
+
+    def nodes_for(self, key):
+        """Return every node, in the order to try them for `key`.
+
+        The owner comes first, then the next distinct nodes clockwise, so
+        all peers of a torrent fail over to the same node.
+        """
+        if not self.points:
+            return []
+        start = bisect.bisect_left(self.points, ring_hash(key))
+        order = []
+        for step in range(len(self.points)):
+            node = self.owners[(start + step) % len(self.points)]
+            if node not in order:
+                order.append(node)
+                if len(order) == len(self.nodes):
+                    break
+        return order
+
+
+def tracker_ring():
+    """Return the ring of the configured tracker nodes."""
+    nodes = CONFIGS["TRACKER_NODES"] or [
+        f"{CONFIGS['TRACKER_HOST']}:{CONFIGS['TRACKER_PORT']}"
+    ]
+    return HashRing(nodes)
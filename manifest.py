@@ -0,0 +1,209 @@
+import argparse
+import base64
+import bisect
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+
+FileEntry = namedtuple("FileEntry", ["path", "length", "offset"])
+
+# Part of a piece that falls inside one file: `length` bytes found at
+# `file_offset` in the file and at `piece_offset` in the piece.
+PieceSpan = namedtuple(
+    "PieceSpan", ["file_index", "file_offset", "piece_offset", "length"]
+)
+
+
+class Manifest:
+    """Torrent metadata: the shared files, the piece size and piece hashes.
+
+    The files are treated as one byte stream cut into pieces of `piece_size`
+    bytes, so a piece can span the end of one file and the start of the
+    next. Piece hashes are stored as a single blob of concatenated digests,
+    base64 encoded in the JSON file, so a manifest with a million pieces
+    loads with one decode instead of a million strings.
+    """
+
+    def __init__(self, name, files, piece_size, hashes, algorithm="sha1"):
+        if piece_size <= 0:
+            raise ValueError(f"Invalid piece size: {piece_size}")
+        self.name = name
+        self.piece_size = piece_size
+        self.algorithm = algorithm
+        self.digest_size = hashlib.new(algorithm).digest_size
+        self.files = []
+        self.offsets = []
+        offset = 0
+        for path, length in files:
+            self.files.append(FileEntry(path, length, offset))
+            self.offsets.append(offset)
+            offset += length
+        self.total_size = offset
+        self.piece_count = (offset + piece_size - 1) // piece_size
+        if len(hashes) != self.piece_count * self.digest_size:
+            raise ValueError(
+                f"Expected {self.piece_count} {algorithm} hashes, got {len(hashes) / self.digest_size:g}"
+            )
+        self.hashes = bytes(hashes)
+        self._hash_index = None
+        self._info_hash = None
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as infile:
+            data = json.load(infile)
+        return cls(
+            data["name"],
+            [(entry["path"], entry["length"]) for entry in data["files"]],
+            data["piece_size"],
+            base64.b64decode(data["pieces"]),
+            data.get("hash", "sha1"),
+        )
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "piece_size": self.piece_size,
+            "hash": self.algorithm,
+            "files": [
+                {"path": entry.path, "length": entry.length}
+                for entry in self.files
+            ],
+            "pieces": base64.b64encode(self.hashes).decode(),
+        }
+
+    def save(self, path):
+        with open(path, "w") as outfile:
+            json.dump(self.to_dict(), outfile, indent=4)
+            outfile.write("\n")
+
+    @classmethod
+    def create(cls, name, paths, piece_size, algorithm="sha1", root="."):
+        """Build a manifest by hashing files on disk, in the given order.
+
+        `paths` are relative to `root` and are stored as given.
+        """
+        hashes = bytearray()
+        files = []
+        piece = hashlib.new(algorithm)
+        filled = 0
+        for path in paths:
+            files.append((path, os.path.getsize(os.path.join(root, path))))
+            with open(os.path.join(root, path), "rb") as infile:
+                while True:
+                    data = infile.read(piece_size - filled)
+                    if not data:
+                        break
+                    piece.update(data)
+                    filled += len(data)
+                    if filled == piece_size:
+                        hashes += piece.digest()
+                        piece = hashlib.new(algorithm)
+                        filled = 0
+        if filled:
+            hashes += piece.digest()
+        return cls(name, files, piece_size, hashes, algorithm)
+
+    @property
+    def info_hash(self):
+        """Hex SHA-1 of the manifest contents, identifying the torrent."""
+        if self._info_hash is None:
+            data = json.dumps(self.to_dict(), sort_keys=True).encode()
+            self._info_hash = hashlib.sha1(data).hexdigest()
+        return self._info_hash
+
+    def piece_hash(self, index):
+        start = index * self.digest_size
+        return self.hashes[start : start + self.digest_size]
+
+    def piece_length(self, index):
+        if index == self.piece_count - 1:
+            return self.total_size - index * self.piece_size
+        return self.piece_size
+
+    def piece_spans(self, index):
+        """Return the parts of the files that make up a piece."""
+        start = index * self.piece_size
+        end = start + self.piece_length(index)
+        file_index = bisect.bisect_right(self.offsets, start) - 1
+        spans = []
+        position = start
+        while position < end:
+            entry = self.files[file_index]
+            length = min(end, entry.offset + entry.length) - position
+            if length > 0:
+                spans.append(
+                    PieceSpan(
+                        file_index,
+                        position - entry.offset,
+                        position - start,
+                        length,
+                    )
+                )
+                position += length
+            file_index += 1
+        return spans
+
+    def block_spans(self, index, begin, length):
+        """Return the parts of the files holding `length` bytes at `begin` in a piece."""
+        end = begin + length
+        spans = []
+        for span in self.piece_spans(index):
+            start = max(begin, span.piece_offset)
+            stop = min(end, span.piece_offset + span.length)
+            if start < stop:
+                spans.append(
+                    PieceSpan(
+                        span.file_index,
+                        span.file_offset + start - span.piece_offset,
+                        start,
+                        stop - start,
+                    )
+                )
+        return spans
+
+    def file_pieces(self, file_index):
+        """Return the range of pieces holding any byte of a file."""
+        entry = self.files[file_index]
+        first = entry.offset // self.piece_size
+        if entry.length == 0:
+            return range(first, first)
+        last = (entry.offset + entry.length - 1) // self.piece_size
+        return range(first, last + 1)
+
+    def find_piece(self, digest):
+        """Return the index of the piece with this hash, or None."""
+        if self._hash_index is None:
+            size = self.digest_size
+            self._hash_index = {
+                self.hashes[i : i + size]: i // size
+                for i in range(len(self.hashes) - size, -1, -size)
+            }
+        return self._hash_index.get(digest)
+
+    def hash_data(self, data):
+        return hashlib.new(self.algorithm, data).digest()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Create a manifest for a set of files."
+    )
+    parser.add_argument("output", help="Path of the manifest to write")
+    parser.add_argument("files", nargs="+", help="Files to share, in order")
+    parser.add_argument("--name", default="torrent")
+    parser.add_argument("--piece-size", type=int, default=256 * 1024)
+    parser.add_argument("--hash", default="sha1", choices=["sha1", "sha256"])
+    parser.add_argument(
+        "--root", default=".", help="Directory the file paths are relative to"
+    )
+    args = parser.parse_args()
+    manifest = Manifest.create(
+        args.name, args.files, args.piece_size, args.hash, args.root
+    )
+    manifest.save(args.output)
+    print(
+        f"Wrote {args.output}: {len(manifest.files)} files, {manifest.piece_count} pieces of {manifest.piece_size} bytes"
+    )
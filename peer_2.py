@@ -1,8 +1,29 @@
 import asyncio
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 
+from bitfield import Bitfield
 from config import CONFIGS
+from hash_ring import split_node, tracker_ring
+from manifest import Manifest
+from peer_connection import ConnectionPool
+from peer_list import decode_compact
+from piece_cache import create_cache
+from piece_download import PieceDownload
+from piece_picker import create_picker
+from protocol import (
+    HttpError,
+    read_request_head,
+    response_head,
+    send_file,
+    send_view,
+)
+from rate_limit import RateLimits
+from resume import ResumeFile
+from scheduler import DownloadScheduler, PieceCorrupted
+from storage import Storage
+from tracker_client import TrackerSession
 
 
 class Peer:
@@ -11,61 +32,100 @@ class Peer:
         self.id = "456"
         self.port = 61000
         self.address = self.ip_address + ":" + str(self.port)
-        self.bitfield = ["1", "1", "0", "0", "1", "0"]
-        self.filename = [
-            "piece_1.txt",
-            "piece_2.txt",
-            "",
-            "",
-            "piece_3.txt",
-            "",
-        ]
-        self.file = [False, False]
-        self.downloaded_num = 0
-        self.request_pieces = set()
+        self.manifest = Manifest.load(CONFIGS["MANIFEST"])
+        self.bitfield = Bitfield(self.manifest.piece_count)
         self.directory = f"files_{self.id}"
+        self.storage = Storage(self.manifest, self.directory)
+        self.resume = ResumeFile(
+            os.path.join(self.directory, CONFIGS["RESUME_FILE"]),
+            self.manifest,
+            self.directory,
+        )
+        # Number of pieces each file still lacks
+        self.missing = [
+            len(self.manifest.file_pieces(index))
+            for index in range(len(self.manifest.files))
+        ]
         # self.peer_list = [
         #    {"peer id": "123", "ip": "127.0.0.1", "port": 60000, "bitfield": "001100"},
         #    {"peer id": "456", "ip": "127.0.0.1", "port": 61000, "bitfield": "110010"},
         #    {"peer id": "789", "ip": "127.0.0.1", "port": 62000, "bitfield": "101001"}
         # ]
         self.peer_list = []
-
-    async def connect_tracker(self, announce):
-        start_time = time.time()
-        print(f"[{self.address}] [{start_time}] Open connection to tracker")
-        reader, writer = await asyncio.open_connection(
-            CONFIGS["TRACKER_HOST"], CONFIGS["TRACKER_PORT"]
+        self.tracker_version = None
+        # Seconds between re-announces, as told by the tracker
+        self.announce_interval = CONFIGS["ANNOUNCE_INTERVAL"]
+        self.picker = create_picker(
+            CONFIGS["PIECE_PICKER"], len(self.bitfield)
         )
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        print(f"[{self.address}] [{end_time}] Connected to tracker in {elapsed_time:.2f}")
-        request = None
-        if announce is True:
-            request = (
-                f"GET /announce?peer_id={self.id}&peer_ip_address={self.ip_address}&peer_port={self.port}&bitfield={''.join(self.bitfield)} HTTP/1.1\r\n"
-                f'Host: {CONFIGS["TRACKER_HOST"]}:{CONFIGS["TRACKER_PORT"]}\r\n'
-                "Connection: close\r\n"
-                "\r\n"
-            )
-        else:
-            request = (
-                f"GET /peer?peer_id={self.id}&peer_ip_address={self.ip_address}&peer_port={self.port}&bitfield={''.join(self.bitfield)} HTTP/1.1\r\n"
-                f'Host: {CONFIGS["TRACKER_HOST"]}:{CONFIGS["TRACKER_PORT"]}\r\n'
-                "Connection: close\r\n"
-                "\r\n"
+        # Hot pieces kept in memory, only without USE_MMAP: the mapped
+        # files are already served from the page cache
+        self.cache = None
+        if CONFIGS["PIECE_CACHE_SIZE"] and not CONFIGS["USE_MMAP"]:
+            self.cache = create_cache(
+                CONFIGS["PIECE_CACHE_POLICY"], CONFIGS["PIECE_CACHE_SIZE"]
             )
+        # Upload and download rate limits, reloaded from RATE_LIMIT_FILE
+        self.rate_limits = RateLimits()
+        self.pool = ConnectionPool(limiter=self.rate_limits.download)
+        # Pieces being downloaded block by block, shared by the peers
+        # sending them
+        self.downloads = {}
+        # Pieces are hashed in threads so large pieces don't stall the loop
+        self.hasher = ThreadPoolExecutor(CONFIGS["HASH_WORKERS"])
+        # The tracker node owning our torrent on the ring, then the nodes
+        # to fail over to
+        nodes = [
+            split_node(node)
+            for node in tracker_ring().nodes_for(self.manifest.info_hash)
+        ]
+        self.tracker = TrackerSession(*nodes[0], fallbacks=nodes[1:])
+        self.tracker.on_fail_over = self.tracker_failed_over
+        self.serving = {}
+        self.stopping = asyncio.Event()
+        # Tracker updates of saved pieces, sent in the background
+        self.seeding_tasks = set()
+
+    def tracker_query(self):
+        query = f"info_hash={self.manifest.info_hash}&peer_id={self.id}&peer_ip_address={self.ip_address}&peer_port={self.port}&bitfield={self.bitfield.to_base64()}&pieces={len(self.bitfield)}&encoding=b64&numwant={CONFIGS['NUMWANT']}"
+        if CONFIGS["COMPACT_PEER_LIST"]:
+            query += "&compact=1"
+        if self.tracker_version is not None:
+            # Only ask for the peers that changed since the last list we got
+            query += f"&since={self.tracker_version}"
+        return query
+
+    def tracker_failed_over(self):
+        # Versions of the old node mean nothing to the new one
+        self.tracker_version = None
+
+    async def connect_tracker(self, announce):
+        def build_path():
+            # A node we have no list from yet has never seen us announce
+            if announce is True or self.tracker_version is None:
+                return f"/announce?{self.tracker_query()}"
+            return f"/peer?{self.tracker_query()}"
+
         print(f"[{self.address}] [{time.time()}] Start sending GET request to tracker")
-        writer.write(request.encode())
-        await writer.drain()
-        response = await reader.read(1500)
+        status, response = await self.tracker.request("GET", build_path)
         print(f"[{self.address}] [{time.time()}] Received peer list from tracker")
-        writer.close()
-        await writer.wait_closed()
-        self.peer_list = self.parse_response(response.decode())
+        if status == 200:
+            self.update_peer_list(response)
+        elif status == 400 and announce is not True:
+            # The tracker forgot us or our torrent, its versions may be
+            # from a torrent it has since dropped
+            self.tracker_version = None
+            await self.connect_tracker(True)
 
     def parse_response(self, response):
+        if isinstance(response, bytes):
+            version, interval, since, peers, removed = decode_compact(response)
+            self.announce_interval = interval
+            return peers, version, since is not None, removed
         peers = []
+        removed = []
+        version = None
+        delta = False
         lines = response.strip().split("\n")
         for line in lines:
             if line.startswith("peer id:"):
@@ -74,59 +134,305 @@ class Peer:
                 for part in parts:
                     key, value = part.split(": ", 1)
                     peer_info[key.strip()] = value.strip()
+                try:
+                    # Older trackers leave out the number of pieces
+                    peer_info["bitfield"] = Bitfield.decode(
+                        peer_info["bitfield"],
+                        int(peer_info.get("pieces", len(self.bitfield))),
+                        "b64",
+                    )
+                except ValueError as e:
+                    # Left out like a peer the tracker removed
+                    print(f"[{self.address}] [{time.time()}] Ignoring peer {peer_info['peer id']}: {e}")
+                    removed.append(peer_info["peer id"])
+                    continue
                 peers.append(peer_info)
-        return peers
+            elif line.startswith("version: "):
+                version = int(line.split(": ", 1)[1])
+            elif line.startswith("delta: "):
+                delta = True
+            elif line.startswith("removed: "):
+                removed.append(line.split(": ", 1)[1])
+            elif line.startswith("interval: "):
+                self.announce_interval = int(line.split(": ", 1)[1])
+        return peers, version, delta, removed
+
+    def update_peer_list(self, response):
+        peers, version, delta, removed = self.parse_response(response)
+        # A bitfield of another length is not about our torrent, such
+        # peers are left out as if the tracker had removed them
+        wrong = [
+            peer
+            for peer in peers
+            if len(peer["bitfield"]) != self.manifest.piece_count
+        ]
+        if wrong:
+            print(
+                f"[{self.address}] [{time.time()}] Ignoring peers with a bitfield of the wrong length: {[peer['peer id'] for peer in wrong]}"
+            )
+            peers = [peer for peer in peers if peer not in wrong]
+            removed = removed + [peer["peer id"] for peer in wrong]
+        if (
+            delta
+            and self.tracker_version is not None
+            and version < self.tracker_version
+        ):
+            # Already merged a newer list
+            return
+        if delta:
+            # Merge the changed peers into the list we already have
+            merged = {peer["peer id"]: peer for peer in self.peer_list}
+            for peer in peers:
+                merged[peer["peer id"]] = peer
+            # Peers the tracker expired
+            for peer_id in removed:
+                merged.pop(peer_id, None)
+                self.picker.remove_peer(peer_id)
+            self.peer_list = list(merged.values())
+        else:
+            self.peer_list = peers
+            listed = {peer["peer id"] for peer in peers}
+            for peer_id in list(self.picker.peers):
+                if peer_id not in listed:
+                    self.picker.remove_peer(peer_id)
+        # Keep piece availability in step with the changed bitfields
+        for peer in peers:
+            if peer["peer id"] != self.id:
+                self.picker.update_peer(peer["peer id"], peer["bitfield"])
+        self.tracker_version = version
+
+    def find_local_pieces(self):
+        self.storage.open()
+        resumed, changed = self.resume.load()
+        if resumed is not None:
+            # Trust the pieces verified before the last save, unless their
+            # file is gone since
+            for piece in resumed.iter_set():
+                if not changed or self.storage.piece_on_disk(piece):
+                    self.mark_piece(piece)
+        if changed:
+            # Pieces written into the shared files by an earlier run after
+            # its last save
+            pieces = [
+                piece
+                for piece in range(self.manifest.piece_count)
+                if not self.bitfield[piece]
+                and self.storage.piece_on_disk(piece)
+            ]
+            for piece, ok in zip(
+                pieces, self.hasher.map(self.storage.verify, pieces)
+            ):
+                if ok:
+                    self.mark_piece(piece)
+        # Loose piece files are recognised by their hash, whatever their
+        # name, and copied into place
+        for filename in sorted(os.listdir(self.directory)):
+            filepath = os.path.join(self.directory, filename)
+            if (
+                not os.path.isfile(filepath)
+                or os.path.getsize(filepath) > self.manifest.piece_size
+            ):
+                continue
+            with open(filepath, "rb") as infile:
+                data = infile.read()
+            piece = self.manifest.find_piece(self.manifest.hash_data(data))
+            if piece is not None and not self.bitfield[piece]:
+                self.storage.write(piece, data)
+                self.mark_piece(piece)
+        print(
+            f"[{self.address}] [{time.time()}] Found {self.bitfield.count()} of {len(self.bitfield)} pieces in {self.directory}"
+            + (" (resumed)" if resumed is not None else "")
+        )
+        self.resume.save(self.bitfield)
+
+    def mark_piece(self, piece):
+        self.bitfield[piece] = True
+        # A shared download beaten by an endgame copy holds a piece-sized
+        # buffer nobody needs any more
+        self.downloads.pop(piece, None)
+        for span in self.manifest.piece_spans(piece):
+            self.missing[span.file_index] -= 1
+            if self.missing[span.file_index] == 0:
+                entry = self.manifest.files[span.file_index]
+                print(f"[{self.address}] [{time.time()}] File {entry.path} is complete")
 
     async def handle_connection(self):
+        self.find_local_pieces()
         await self.connect_tracker(True)
+        announcer = asyncio.create_task(self.keep_announcing())
+        limits_watcher = asyncio.create_task(
+            self.rate_limits.watch(
+                os.path.join(self.directory, CONFIGS["RATE_LIMIT_FILE"])
+            )
+        )
         task = asyncio.create_task(self.listen_peers())
         await asyncio.sleep(10)
         await self.connect_peers()
         await asyncio.sleep(60)
         print(f"[{self.address}] [{time.time()}] Shutting down...")
+        if self.cache is not None:
+            print(f"[{self.address}] [{time.time()}] Piece cache: {self.cache.stats()}")
+        # Let a re-announce in flight finish before closing the session
+        self.stopping.set()
+        await announcer
+        limits_watcher.cancel()
+        # Stop uploads first, throttled ones may still be running
         task.cancel()
+        await self.close_peer_connections()
+        await self.pool.close()
+        await asyncio.gather(*self.seeding_tasks, return_exceptions=True)
+        self.tracker.close()
+        self.hasher.shutdown()
+        self.resume.close(self.bitfield)
+        self.storage.close()
         print(f"[{self.address}] [{time.time()}] Peer closed.")
 
+    async def keep_announcing(self):
+        """Re-announce on the tracker's interval so it doesn't expire us."""
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self.stopping.wait(), self.announce_interval
+                )
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.connect_tracker(True)
+            except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                # ValueError: a peer list we can't parse
+                print(f"[{self.address}] [{time.time()}] Re-announce failed: {e!r}")
+
+    async def close_peer_connections(self):
+        tasks = list(self.serving.values())
+        for writer in list(self.serving):
+            writer.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
     async def listen_peer(self, reader, writer):
         source_address = writer.get_extra_info("peername")
-        start_time = time.time()
-        print(f"[{self.address}] [{start_time}] Waiting for request from {source_address}")
-        request = await reader.read(1500)
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        print(f"[{self.address}] [{end_time}] Request received from {source_address} in {elapsed_time} seconds")
-        request = request.decode()
-        lines = request.split("\r\n")
-        for line in lines:
-            if line.startswith("GET"):
-                parse_1 = line.split(" ")
-                for raw_info in parse_1:
-                    if raw_info.startswith("/download"):
-                        infos = raw_info.split("&")
-                        for info in infos:
-                            if info.startswith("piece="):
-                                idx = info.index("=")
-                                piece_num = int(info[(idx + 1) :])
-                                filepath = os.path.join(
-                                    self.directory, self.filename[piece_num]
-                                )
-                                with open(filepath, "r") as infile:
-                                    data = infile.read()
-                                    response = (
-                                        "HTTP/1.1 200 OK\r\n"
-                                        "Content-Type: text/plain; charset=utf-8\r\n"
-                                        f"Content-Length: {len(data)}\r\n"
-                                        "Connection: close\r\n"
-                                        "\r\n"
-                                        f"{data}"
-                                    )
-                                    print(
-                                        f"[{self.address}] [{time.time()}] Sending response to {source_address}"
-                                    )
-                                    writer.write(response.encode())
-                                    await writer.drain()
-
-        writer.close()
+        self.serving[writer] = asyncio.current_task()
+        try:
+            await self.serve_requests(reader, writer, source_address)
+        except ConnectionError:
+            # The peer went away in the middle of a response
+            pass
+        finally:
+            del self.serving[writer]
+            writer.close()
+
+    async def serve_requests(self, reader, writer, source_address):
+        # Serve requests on this connection until the peer closes it
+        while True:
+            start_time = time.time()
+            print(f"[{self.address}] [{start_time}] Waiting for request from {source_address}")
+            try:
+                method, path, params, headers = await asyncio.wait_for(
+                    read_request_head(reader), CONFIGS["KEEP_ALIVE_TIMEOUT"]
+                )
+            except (
+                asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError,
+                asyncio.TimeoutError,
+                ConnectionError,
+            ):
+                break
+            except HttpError as e:
+                writer.write(response_head(e.status, 0))
+                await writer.drain()
+                break
+            end_time = time.time()
+            elapsed_time = end_time - start_time
+            print(f"[{self.address}] [{end_time}] Request received from {source_address} in {elapsed_time} seconds")
+            keep_alive = headers.get("connection", "").lower() != "close"
+            # Upload limits apply per requesting host, known by the address
+            # it connects from, since the query's peer_port could be
+            # changed on every request to get a fresh limit
+            remote = source_address[0]
+            piece = params.get("piece", "")
+            # Optional range of bytes inside the piece
+            begin = params.get("begin", "0")
+            length = params.get("length", "")
+            if (
+                method == "GET"
+                and path == "/download"
+                and piece.isdigit()
+                and begin.isdigit()
+                and (not length or length.isdigit())
+            ):
+                await self.send_piece(
+                    writer,
+                    int(piece),
+                    keep_alive,
+                    source_address,
+                    int(begin),
+                    int(length) if length else None,
+                    remote,
+                )
+            else:
+                writer.write(response_head(400, 0, keep_alive))
+                await writer.drain()
+            if not keep_alive:
+                break
+
+    async def send_piece(
+        self,
+        writer,
+        piece,
+        keep_alive,
+        source_address,
+        begin=0,
+        length=None,
+        remote=None,
+    ):
+        """Send a piece, or `length` bytes of it starting at `begin`.
+
+        The upload is paced to the rate limits of the `remote` peer.
+        """
+        limiter = self.rate_limits.upload
+        if piece >= len(self.bitfield) or not self.bitfield[piece]:
+            writer.write(response_head(404, 0, keep_alive))
+            await writer.drain()
+            return
+        size = self.manifest.piece_length(piece)
+        if length is None:
+            length = size - begin
+        if length <= 0 or begin + length > size:
+            writer.write(response_head(416, 0, keep_alive))
+            await writer.drain()
+            return
+        print(
+            f"[{self.address}] [{time.time()}] Sending response to {source_address}"
+        )
+        writer.write(
+            response_head(200, length, keep_alive, "application/octet-stream")
+        )
+        if CONFIGS["USE_MMAP"]:
+            # The mapped files are served from the page cache without
+            # copying, a cache of our own would only hold a second copy
+            with self.storage.piece_views(piece, begin, length) as views:
+                for view in views:
+                    await send_view(writer, view, limiter, remote)
+            return
+        if self.cache is not None and size <= self.cache.budget:
+            data = self.cache.get(piece)
+            if data is None:
+                data = self.storage.read(piece)
+                self.cache.put(piece, data)
+            await send_view(
+                writer, memoryview(data)[begin : begin + length], limiter, remote
+            )
+            return
+        # Serve straight from the shared files
+        for span in self.manifest.block_spans(piece, begin, length):
+            await send_file(
+                writer,
+                self.storage.files[span.file_index],
+                span.length,
+                span.file_offset,
+                limiter,
+                remote,
+            )
 
     async def listen_peers(self):
         server = await asyncio.start_server(
@@ -140,149 +446,153 @@ class Peer:
             await server.serve_forever()
 
     async def connect_peers(self):
-        tasks = []
-        left = self.bitfield.count("0")
-        while left > 0:
-            await self.connect_tracker(False)
-            for peer in self.peer_list:
-                if peer["peer id"] != self.id:
-                    for index in range(len(peer["bitfield"])):
-                        if (
-                            (index not in self.request_pieces)
-                            and peer["bitfield"][index] == "1"
-                            and self.bitfield[index] == "0"
-                        ):
-                            self.request_pieces.add(index)
-                            task = asyncio.create_task(
-                                self.connect_peer(
-                                    peer["ip"], peer["port"], index
-                                )
-                            )
-                            left -= 1
-                            tasks.append(task)
-
-        await asyncio.gather(*tasks)
-
-    async def connect_peer(self, ip, port, piece):
-        destination_address = f"{ip}:{port}"
-        start_time = time.time()
-        print(
-            f"[{self.address}] [{start_time}] Open connection to {destination_address}"
-        )
-        reader, writer = await asyncio.open_connection(ip, port)
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        print(
-            f"[{self.address}] [{end_time}] Connected to {destination_address} in {elapsed_time} seconds"
-        )
-        request = (
-            f"GET /download?peer_id={self.id}&peer_ip_address={self.ip_address}&peer_port={self.port}&piece={piece} HTTP/1.1\r\n"
-            f"Host: {destination_address}\r\n"
-            "Connection: close\r\n"
-            "\r\n"
-        )
-        start_time = time.time()
-        print(f"[{self.address}] [{start_time}] Start sending a request to {destination_address}")
-        writer.write(request.encode())
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        print(f"[{self.address}] [{end_time}] Sent a request to {destination_address} in {elapsed_time} seconds")
-        await writer.drain()
-        response = await reader.read(1500)
-        print(
-            f"[{self.address}] [{time.time()}] Received data of piece {piece} from {destination_address}"
+        scheduler = DownloadScheduler(
+            self.picker,
+            self.bitfield,
+            self.connect_peer,
+            lambda: self.connect_tracker(False),
+            self.other_peers,
+            shareable=self.shareable,
         )
-        res = response.decode()
-        data = res.split("\r\n")[-1]
-        if data:
-            filename = f"downloaded_piece_{self.downloaded_num}.txt"
-            filepath = os.path.join(self.directory, filename)
-            self.downloaded_num += 1
-            with open(filepath, "w") as outfile:
-                outfile.write(data)
-            print(f"[{self.address}] [{time.time()}] Written piece {piece} into file {filename}")
-            self.bitfield[piece] = "1"
-            self.filename[piece] = filename
-            await self.seeding()
-            self.check_and_combine()
-
-        writer.close()
-
-    def check_and_combine(self):
-        if (
-            self.bitfield[0] == "1"
-            and self.bitfield[1] == "1"
-            and self.bitfield[2] == "1"
-            and not self.file[0]
-        ):
-            filename = "file_1.txt"
-            filepath = os.path.join(self.directory, filename)
-            start_time = time.time()
-            print(f"[{self.address}] [{start_time}] Combining pieces of file 1")
-            with open(filepath, "w") as outfile:
-                for index in range(3):
-                    infilepath = os.path.join(
-                        self.directory, self.filename[index]
-                    )
-                    with open(infilepath, "r") as infile:
-                        data = infile.read()
-                        outfile.write(data)
+        await scheduler.run()
 
-            self.file[0] = True
-            end_time = time.time()
-            elapsed_time = end_time - start_time
-            print(f"[{self.address}] [{end_time}] Combined pieces of file 1 into file_1.txt in {elapsed_time} seconds")
+    def shareable(self, piece):
+        # Another peer can help while some blocks are still unrequested
+        download = self.downloads.get(piece)
+        return download is not None and download.has_open_blocks()
 
-        if (
-            self.bitfield[3] == "1"
-            and self.bitfield[4] == "1"
-            and self.bitfield[5] == "1"
-            and not self.file[1]
-        ):
-            filename = "file_2.txt"
-            filepath = os.path.join(self.directory, filename)
-            start_time = time.time()
-            print(f"[{self.address}] [{start_time}] Combining pieces of file 2")
-            with open(filepath, "w") as outfile:
-                for index in range(3, 6):
-                    infilepath = os.path.join(
-                        self.directory, self.filename[index]
-                    )
-                    with open(infilepath, "r") as infile:
-                        data = infile.read()
-                        outfile.write(data)
+    def other_peers(self):
+        return [peer for peer in self.peer_list if peer["peer id"] != self.id]
 
-            self.file[1] = True
-            end_time = time.time()
-            elapsed_time = end_time - start_time
-            print(f"[{self.address}] [{end_time}] Combined pieces of file 2 into file_2.txt in {elapsed_time} seconds")
+    async def connect_peer(self, ip, port, piece, endgame=False):
+        """Fetch the blocks of a piece from one peer until the piece is done.
 
-    async def seeding(self):
-        start_time = time.time()
-        print(
-            f"[{self.address}] [{start_time}] Open connection to tracker"
-        )
-        reader, writer = await asyncio.open_connection(
-            CONFIGS["TRACKER_HOST"], CONFIGS["TRACKER_PORT"]
+        Other peers may be fetching blocks of the same piece at the same
+        time. In endgame mode the peer downloads a separate copy instead.
+        Returns True once the piece is verified and saved.
+        """
+        destination_address = f"{ip}:{port}"
+        if endgame:
+            # Cancelling the copy closes this connection, so the slow peer
+            # stops sending it without failing our other requests to it
+            connection = self.pool.separate(ip, port)
+        else:
+            # Reuse the open connection to this peer, requests are pipelined
+            connection = self.pool.get(ip, port)
+        download = self.downloads.get(piece)
+        if endgame or download is None:
+            download = PieceDownload(
+                piece, self.manifest.piece_length(piece), CONFIGS["BLOCK_SIZE"]
+            )
+            if not endgame:
+                self.downloads[piece] = download
+        print(f"[{self.address}] [{time.time()}] Start sending a request to {destination_address}")
+        # Several block requests at once, so the pipeline stays full
+        lanes = [
+            asyncio.create_task(self.fetch_blocks(connection, download))
+            for _ in range(CONFIGS["MAX_PIPELINE"])
+        ]
+        try:
+            await asyncio.gather(*lanes)
+        finally:
+            # One lane failing stops the others
+            for lane in lanes:
+                lane.cancel()
+            if endgame:
+                await connection.close()
+        if download.check is None:
+            download.check = asyncio.ensure_future(self.save_piece(download))
+        if not await asyncio.shield(download.check):
+            if set(download.sources.values()) == {connection.address}:
+                raise PieceCorrupted(
+                    f"Piece {piece} from {destination_address} does not match its hash"
+                )
+            # Blocks came from several peers, we can't tell which one lied
+            print(f"[{self.address}] [{time.time()}] Piece {piece} does not match its hash")
+            return False
+        return True
+
+    async def fetch_blocks(self, connection, download):
+        """Fetch open blocks of a piece from one peer until none are missing."""
+        while not download.complete():
+            block = download.next_block()
+            if block is None:
+                # Other peers have the last blocks, they may hand some back
+                await download.wait()
+                continue
+            begin, length = download.block_range(block)
+            path = f"/download?peer_id={self.id}&peer_ip_address={self.ip_address}&peer_port={self.port}&piece={download.piece}&begin={begin}&length={length}"
+            try:
+                status, headers = await connection.request(
+                    path, download.block_writer(block)
+                )
+            except BaseException:
+                download.give_back(block)
+                raise
+            if status != 200 or int(headers.get("content-length", 0)) != length:
+                download.give_back(block)
+                raise ConnectionError(
+                    f"{connection.address} answered {status} for {length} bytes at {begin} of piece {download.piece}"
+                )
+            download.finish(block, connection.address)
+
+    async def save_piece(self, download):
+        """Verify a complete piece and write it to the shared files.
+
+        Returns False if the piece does not match its hash.
+        """
+        piece = download.piece
+        if self.downloads.get(piece) is download:
+            del self.downloads[piece]
+        digest = await asyncio.get_running_loop().run_in_executor(
+            self.hasher, self.manifest.hash_data, download.buffer
         )
+        if digest != self.manifest.piece_hash(piece):
+            return False
+        if self.bitfield[piece]:
+            # Another copy got here first
+            return True
+        self.storage.write(piece, download.buffer)
         end_time = time.time()
-        elapsed_time = end_time - start_time
-        print(f"[{self.address}] [{end_time}] Connected to tracker in {elapsed_time} seconds")
-        request = (
-            f"PUT /seeding?peer_id={self.id}&peer_ip_address={self.ip_address}&peer_port={self.port}&bitfield={''.join(self.bitfield)} HTTP/1.1\r\n"
-            f'Host: {CONFIGS["TRACKER_HOST"]}:{CONFIGS["TRACKER_PORT"]}\r\n'
-            "Connection: close\r\n"
-            "\r\n"
+        elapsed_time = end_time - download.started
+        sources = ", ".join(sorted(set(download.sources.values())))
+        print(
+            f"[{self.address}] [{end_time}] Received data of piece {piece} from {sources} in {elapsed_time} seconds"
         )
+        self.mark_piece(piece)
+        self.resume.request_save(self.bitfield)
+        # The piece is ours already, don't make the download wait for the
+        # tracker to hear about it
+        task = asyncio.create_task(self.seeding())
+        self.seeding_tasks.add(task)
+        task.add_done_callback(self.seeding_done)
+        return True
+
+    def seeding_done(self, task):
+        self.seeding_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[{self.address}] [{time.time()}] Seeding update failed: {task.exception()!r}")
+
+    async def seeding(self):
         print(f"[{self.address}] [{time.time()}] Start sending a PUT request to tracker")
-        writer.write(request.encode())
-        print(f"[{self.address}] [{time.time()}] Sent a PUT request to tracker")
-        await writer.drain()
-        response = await reader.read(1500)
-        print(f"[{self.address}] [{time.time()}] Received a peer list from tracker")
-        writer.close()
-        await writer.wait_closed()
-        self.peer_list = self.parse_response(response.decode())
+        try:
+            # Updates from pieces that finish close together share one
+            # request
+            status, response = await self.tracker.report(
+                lambda: f"/seeding?{self.tracker_query()}"
+            )
+            print(f"[{self.address}] [{time.time()}] Received a peer list from tracker")
+            if status == 200:
+                self.update_peer_list(response)
+            elif status == 400:
+                # The tracker expired us, or dropped our torrent, in the
+                # meantime
+                self.tracker_version = None
+                await self.connect_tracker(True)
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            # The piece is saved all the same, the next announce tells the
+            # tracker about it
+            print(f"[{self.address}] [{time.time()}] Seeding update failed: {e!r}")
 
 
 if __name__ == "__main__":
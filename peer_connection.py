@@ -0,0 +1,141 @@
+import asyncio
+from collections import deque
+
+from config import CONFIGS
+from protocol import read_body, read_response_head
+
+
+class PeerConnection:
+    """Keep-alive connection to one remote peer with pipelined requests.
+
+    Up to `max_pipeline` requests are written without waiting for earlier
+    responses. The remote peer answers in request order, so a single reader
+    task hands each response to the oldest pending request.
+    """
+
+    def __init__(self, ip, port, max_pipeline, limiter=None):
+        self.ip = ip
+        self.port = port
+        # Paces reading the responses, see rate_limit.py
+        self.limiter = limiter
+        self.reader = None
+        self.writer = None
+        self.reader_task = None
+        self.pending = deque()
+        self.slots = asyncio.Semaphore(max_pipeline)
+        self.connect_lock = asyncio.Lock()
+
+    @property
+    def address(self):
+        return f"{self.ip}:{self.port}"
+
+    def is_open(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def connect(self):
+        async with self.connect_lock:
+            if not self.is_open():
+                self.reader, self.writer = await asyncio.open_connection(
+                    self.ip, self.port
+                )
+                self.reader_task = asyncio.create_task(
+                    self.read_responses(self.reader, self.writer)
+                )
+
+    async def request(self, path, write):
+        """Send a GET request and stream the response body into `write`.
+
+        Returns the status code and headers of the response. Raises
+        ConnectionError if the connection drops before the response arrives.
+        A cancelled request's response is read and dropped.
+        """
+        async with self.slots:
+            await self.connect()
+            future = asyncio.get_running_loop().create_future()
+            self.pending.append((future, write))
+            request = (
+                f"GET {path} HTTP/1.1\r\n"
+                f"Host: {self.address}\r\n"
+                "Connection: keep-alive\r\n"
+                "\r\n"
+            )
+            self.writer.write(request.encode())
+            await self.writer.drain()
+            return await future
+
+    async def read_responses(self, reader, writer):
+        error = None
+        try:
+            while True:
+                status, headers = await read_response_head(reader)
+                future, write = self.pending.popleft()
+                length = int(headers.get("content-length", 0))
+
+                def sink(chunk, future=future, write=write):
+                    # Drop the rest of the body if the caller gave up on it
+                    if not future.done():
+                        write(chunk)
+
+                await read_body(
+                    reader, length, sink, self.limiter, self.address
+                )
+                if not future.done():
+                    future.set_result((status, headers))
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except asyncio.IncompleteReadError:
+            error = ConnectionError(f"Connection to {self.address} closed")
+        except Exception as e:
+            error = e
+        finally:
+            writer.close()
+            self.fail_pending(
+                error or ConnectionError(f"Connection to {self.address} closed")
+            )
+
+    def fail_pending(self, error):
+        while self.pending:
+            future, _ = self.pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+            try:
+                await self.reader_task
+            except asyncio.CancelledError:
+                pass
+
+
+class ConnectionPool:
+    """One persistent connection per remote peer.
+
+    `separate` opens a connection that isn't shared, for requests that may
+    be given up by closing it; the caller closes it when done.
+    """
+
+    def __init__(self, max_pipeline=CONFIGS["MAX_PIPELINE"], limiter=None):
+        self.max_pipeline = max_pipeline
+        self.limiter = limiter
+        self.connections = {}
+
+    def get(self, ip, port):
+        key = (ip, str(port))
+        connection = self.connections.get(key)
+        if connection is None:
+            connection = PeerConnection(
+                ip, port, self.max_pipeline, self.limiter
+            )
+            self.connections[key] = connection
+        return connection
+
+    def separate(self, ip, port):
+        return PeerConnection(ip, port, self.max_pipeline, self.limiter)
+
+    async def close(self):
+        for connection in self.connections.values():
+            await connection.close()
+        self.connections.clear()
@@ -0,0 +1,110 @@
+import socket
+import struct
+
+from bitfield import Bitfield
+
+
+# Compact peer list, all integers big-endian:
+#   header   B format, Q version, I interval, B flags, Q delta base,
+#            I peer count, I removed count
+#   peer     B id length, id, 4 bytes IPv4 address, H port,
+#            I bitfield length in pieces, packed bitfield
+#   removed  B id length, id
+# The delta base is only meaningful when bit 0 of the flags is set.
+COMPACT_FORMAT = 1
+HEADER = struct.Struct(">BQIBQII")
+ADDRESS = struct.Struct(">4sHI")
+DELTA_FLAG = 1
+
+
+def encode_compact(version, interval, since, peers, removed=()):
+    """Pack a peer list into the compact binary format.
+
+    `peers` holds (peer id, record) pairs and `since` is the version the
+    list is a delta from, or None for a full list. Peers without an IPv4
+    address or a valid port, and ids longer than 255 bytes, can't be packed
+    and are left out.
+    """
+    body = bytearray()
+    count = 0
+    for peer_id, record in peers:
+        peer_id = peer_id.encode()
+        if len(peer_id) > 255:
+            continue
+        try:
+            address = socket.inet_aton(record.ip)
+            packed = ADDRESS.pack(
+                address, int(record.port), len(record.bitfield)
+            )
+        except (OSError, ValueError, struct.error):
+            continue
+        body.append(len(peer_id))
+        body += peer_id
+        body += packed
+        body += record.bitfield.to_bytes()
+        count += 1
+    removed_count = 0
+    for peer_id in removed:
+        peer_id = peer_id.encode()
+        if len(peer_id) > 255:
+            continue
+        body.append(len(peer_id))
+        body += peer_id
+        removed_count += 1
+    header = HEADER.pack(
+        COMPACT_FORMAT,
+        version,
+        interval,
+        DELTA_FLAG if since is not None else 0,
+        since or 0,
+        count,
+        removed_count,
+    )
+    return header + bytes(body)
+
+
+def decode_compact(data):
+    """Unpack a compact peer list.
+
+    Returns (version, interval, since, peers, removed), where `since` is
+    None for a full list and every peer is a dict like the text format.
+    """
+    try:
+        return _decode_compact(memoryview(data))
+    except (IndexError, struct.error) as e:
+        raise ValueError(f"Truncated compact peer list: {e}") from None
+
+
+def _decode_compact(view):
+    fmt, version, interval, flags, since, count, removed_count = (
+        HEADER.unpack_from(view)
+    )
+    if fmt != COMPACT_FORMAT:
+        raise ValueError(f"Unknown peer list format: {fmt}")
+    offset = HEADER.size
+    peers = []
+    for _ in range(count):
+        length = view[offset]
+        peer_id = bytes(view[offset + 1 : offset + 1 + length]).decode()
+        offset += 1 + length
+        address, port, pieces = ADDRESS.unpack_from(view, offset)
+        offset += ADDRESS.size
+        size = (pieces + 7) // 8
+        bitfield = Bitfield(pieces, bytes(view[offset : offset + size]))
+        offset += size
+        peers.append(
+            {
+                "peer id": peer_id,
+                "ip": socket.inet_ntoa(address),
+                "port": str(port),
+                "bitfield": bitfield,
+            }
+        )
+    removed = []
+    for _ in range(removed_count):
+        length = view[offset]
+        removed.append(bytes(view[offset + 1 : offset + 1 + length]).decode())
+        offset += 1 + length
+    if offset != len(view):
+        raise ValueError("Compact peer list length does not match its contents")
+    return version, interval, since if flags & DELTA_FLAG else None, peers, removed
@@ -0,0 +1,375 @@
+import heapq
+import random
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+from bitfield import Bitfield
+from config import CONFIGS
+
+
+# `version` is the registry version at which the record last changed.
+PeerRecord = namedtuple(
+    "PeerRecord", ["ip", "port", "bitfield", "online", "version"]
+)
+
+# A copy of the registry at one version, made by `snapshot`. `peers` is
+# ordered by record version, oldest change first. Deltas can only be
+# served for versions from `floor` on.
+RegistrySnapshot = namedtuple("RegistrySnapshot", ["version", "peers", "floor"])
+
+
+def ordered_snapshot(version, peers, floor):
+    """Make a snapshot from (peer id, record) pairs in any order."""
+    peers.sort(key=lambda item: item[1].version)
+    return RegistrySnapshot(version, dict(peers), floor)
+
+
+class PeerRegistry:
+    """Peer table shared by the tracker's request handlers.
+
+    Records are immutable and writers update the tables in place under a
+    lock, so a write costs as much as the pieces it changes, whatever the
+    size of the swarm. Reads take the lock only for the peers they return.
+    `snapshot` copies the whole table, for the rare callers that need all
+    of it at one version, like the store.
+
+    Every change bumps the registry version and is appended to a changelog
+    of the last `history` changes, so the changes since a recent version
+    are found by walking the log backwards.
+
+    With a `ttl`, a peer that is not seen for `ttl` seconds is expired by
+    `expire`: its record becomes an offline tombstone, so deltas tell other
+    peers it is gone. Tombstones are dropped after `tombstone_ttl` seconds
+    and the delta floor is raised past them, so the table stays proportional
+    to the live swarm.
+    """
+
+    def __init__(self, ttl=None, tombstone_ttl=None, history=None):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._floor = 0
+        # Latest record of every peer
+        self._peers = {}
+        # Ids of the peers holding each piece
+        self._holders = {}
+        # Ids of the live peers, and the position of each in the list, so
+        # peers are added, removed and sampled in constant time
+        self._live = []
+        self._live_index = {}
+        # (version, peer id) of the latest changes, oldest first. Changes
+        # up to `_log_floor` have been dropped from it
+        self.history = (
+            history if history is not None else CONFIGS["REGISTRY_HISTORY"]
+        )
+        self._log = deque()
+        self._log_floor = 0
+        self.ttl = ttl
+        self.tombstone_ttl = tombstone_ttl if tombstone_ttl is not None else ttl
+        # Expiry time of every live peer, and a heap of (time, peer id) that
+        # may hold stale times; a stale entry is pushed back when it pops
+        self._deadlines = {}
+        self._expiry = []
+        # (drop time, peer id, version) of tombstones, oldest first
+        self._tombstones = deque()
+        # Called as on_change(peer_id, record) after every published change,
+        # still under the lock so listeners see changes in version order
+        self.on_change = None
+        # Called as on_purge(peer_ids, floor) when tombstones are dropped
+        self.on_purge = None
+
+    def __len__(self):
+        return len(self._peers)
+
+    def __contains__(self, peer_id):
+        record = self._peers.get(peer_id)
+        return record is not None and record.online
+
+    def snapshot(self):
+        """Return a copy of the whole registry, taken at one version."""
+        with self._lock:
+            version, floor = self._version, self._floor
+            peers = list(self._peers.items())
+        # Ordered outside the lock, so writers only wait for the copy
+        return ordered_snapshot(version, peers, floor)
+
+    @contextmanager
+    def locked_snapshot(self):
+        """Hold writers off while the caller uses a fresh snapshot.
+
+        Every change published after the block is newer than the snapshot.
+        """
+        with self._lock:
+            yield ordered_snapshot(
+                self._version, list(self._peers.items()), self._floor
+            )
+
+    @property
+    def version(self):
+        return self._version
+
+    def changes_since(self, version, limit=None):
+        """Return the (peer id, record) pairs changed after `version`.
+
+        Returns None when the version is not one this registry has handed
+        out or is older than its changelog, or when there are more than
+        `limit` changes; the caller should then fall back to the full list.
+        """
+        with self._lock:
+            if (
+                version < max(self._floor, self._log_floor)
+                or version > self._version
+            ):
+                return None
+            changes = []
+            seen = set()
+            for change_version, peer_id in reversed(self._log):
+                if change_version <= version:
+                    break
+                if peer_id in seen:
+                    continue
+                seen.add(peer_id)
+                record = self._peers.get(peer_id)
+                if record is None:
+                    # A tombstone dropped since
+                    continue
+                changes.append((peer_id, record))
+                if limit is not None and len(changes) > limit:
+                    return None
+        changes.reverse()
+        return changes
+
+    def get(self, peer_id):
+        """Return the record of a peer, or None if it is not registered."""
+        return self._peers.get(peer_id)
+
+    def holders(self, piece):
+        """Return the ids of the peers that have the given piece."""
+        with self._lock:
+            return frozenset(self._holders.get(piece, ()))
+
+    def sample(self, count, exclude=None, have=None):
+        """Return up to `count` random live (peer id, record) pairs.
+
+        `exclude` is left out, typically the requesting peer. Given the
+        requester's bitfield `have`, peers holding pieces it lacks come
+        first. Only a few times `count` peers are looked at, so the cost
+        does not grow with the swarm.
+        """
+        with self._lock:
+            drawn = [
+                (peer_id, self._peers[peer_id])
+                for peer_id in random.sample(
+                    self._live, min(len(self._live), count * 4 + 1)
+                )
+            ]
+        useful, others = [], []
+        for peer_id, record in drawn:
+            if peer_id == exclude:
+                continue
+            if have is None or len(have) != len(record.bitfield):
+                useful.append((peer_id, record))
+            elif record.bitfield.andnot(have).any():
+                useful.append((peer_id, record))
+            else:
+                others.append((peer_id, record))
+        return (useful + others)[:count]
+
+    def register(self, peer_id, ip, port, bitfield, now=None):
+        """Add a peer, or replace its address and Bitfield if already known."""
+        with self._lock:
+            self._schedule(peer_id, now)
+            old = self._peers.get(peer_id)
+            if (
+                old
+                and old.online
+                and (old.ip, old.port, old.bitfield) == (ip, port, bitfield)
+            ):
+                return
+            record = PeerRecord(ip, port, bitfield, True, self._version + 1)
+            self._publish(peer_id, record, old)
+
+    def touch(self, peer_id, now=None):
+        """Record that a peer is alive. Returns False if it is not registered."""
+        with self._lock:
+            if peer_id not in self:
+                return False
+            self._schedule(peer_id, now)
+            return True
+
+    def _schedule(self, peer_id, now=None):
+        """Push back the expiry of a peer. Must be called with the lock held."""
+        if self.ttl is None:
+            return
+        deadline = (now if now is not None else time.monotonic()) + self.ttl
+        if peer_id not in self._deadlines:
+            heapq.heappush(self._expiry, (deadline, peer_id))
+        self._deadlines[peer_id] = deadline
+
+    def expire(self, now=None):
+        """Tombstone the peers not seen for `ttl` seconds and drop old
+        tombstones. Returns the ids of the expired peers.
+        """
+        if now is None:
+            now = time.monotonic()
+        expired = []
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                deadline, peer_id = heapq.heappop(self._expiry)
+                current = self._deadlines[peer_id]
+                if current > deadline:
+                    # Seen again since this entry was pushed
+                    heapq.heappush(self._expiry, (current, peer_id))
+                    continue
+                del self._deadlines[peer_id]
+                old = self._peers[peer_id]
+                record = old._replace(
+                    bitfield=Bitfield(len(old.bitfield)),
+                    online=False,
+                    version=self._version + 1,
+                )
+                self._publish(peer_id, record, old)
+                self._tombstones.append(
+                    (now + self.tombstone_ttl, peer_id, record.version)
+                )
+                expired.append(peer_id)
+            purged = []
+            floor = self._floor
+            while self._tombstones and self._tombstones[0][0] <= now:
+                _, peer_id, tombstone_version = self._tombstones.popleft()
+                record = self._peers.get(peer_id)
+                if record is not None and record.version == tombstone_version:
+                    del self._peers[peer_id]
+                    purged.append(peer_id)
+                # A delta from before this version would miss the removal
+                floor = max(floor, tombstone_version)
+            if floor != self._floor:
+                self._floor = floor
+                if self.on_purge is not None:
+                    self.on_purge(purged, floor)
+        return expired
+
+    def apply(self, peer_id, record):
+        """Publish a record made by another registry, keeping its version.
+
+        Used by replicas following a primary registry. Records at or below
+        the current version are already applied and are skipped.
+        """
+        with self._lock:
+            if record.version <= self._version:
+                return
+            self._publish(peer_id, record, self._peers.get(peer_id))
+
+    def purge(self, peer_ids, floor):
+        """Drop tombstones dropped by a primary registry and raise the floor."""
+        with self._lock:
+            for peer_id in peer_ids:
+                record = self._peers.get(peer_id)
+                if record is not None and not record.online:
+                    del self._peers[peer_id]
+            self._floor = max(floor, self._floor)
+
+    def update_bitfield(self, peer_id, bitfield, now=None):
+        """Replace the bitfield of a registered peer.
+
+        Returns False if the peer is not registered.
+        """
+        with self._lock:
+            old = self._peers.get(peer_id)
+            if old is None or not old.online:
+                return False
+            self._schedule(peer_id, now)
+            if old.bitfield == bitfield:
+                return True
+            record = old._replace(bitfield=bitfield, version=self._version + 1)
+            self._publish(peer_id, record, old)
+            return True
+
+    def _publish(self, peer_id, record, old):
+        """Replace a peer's record, `old` if it had one.
+
+        Must be called with the lock held.
+        """
+        self._reindex(
+            peer_id, old.bitfield if old else None, record.bitfield
+        )
+        # Replaced in one step, so lock-free readers always find the peer
+        self._peers[peer_id] = record
+        self._set_live(peer_id, record.online)
+        self._version = record.version
+        self._log.append((record.version, peer_id))
+        if len(self._log) > self.history:
+            self._log_floor = self._log.popleft()[0]
+        if self.on_change is not None:
+            self.on_change(peer_id, record)
+
+    def _set_live(self, peer_id, online):
+        index = self._live_index.get(peer_id)
+        if online and index is None:
+            self._live_index[peer_id] = len(self._live)
+            self._live.append(peer_id)
+        elif not online and index is not None:
+            # Move the last live peer into the freed slot
+            last = self._live.pop()
+            if last != peer_id:
+                self._live[index] = last
+                self._live_index[last] = index
+            del self._live_index[peer_id]
+
+    def restore(self, version, peers, floor=0, now=None):
+        """Replace the whole registry, e.g. with state recovered from disk.
+
+        `peers` maps peer ids to records and must be ordered by record
+        version, like the peers of a snapshot. Every live peer gets a full
+        `ttl` to show up again.
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            self._version = version
+            self._floor = floor
+            self._peers = dict(peers)
+            self._holders = {}
+            self._live = []
+            self._live_index = {}
+            self._log = deque()
+            self._log_floor = 0
+            self._deadlines = {}
+            self._expiry = []
+            self._tombstones = deque()
+            for peer_id, record in peers.items():
+                self._reindex(peer_id, None, record.bitfield)
+                self._set_live(peer_id, record.online)
+                self._log.append((record.version, peer_id))
+                if len(self._log) > self.history:
+                    self._log_floor = self._log.popleft()[0]
+                if record.online:
+                    self._schedule(peer_id, now)
+                elif self.ttl is not None:
+                    self._tombstones.append(
+                        (now + self.tombstone_ttl, peer_id, record.version)
+                    )
+
+    def _reindex(self, peer_id, old_bitfield, new_bitfield):
+        """Move a peer between the holder sets of the pieces that changed.
+
+        Must be called with the lock held.
+        """
+        if old_bitfield is None:
+            gained, lost = new_bitfield.iter_set(), []
+        elif len(old_bitfield) == len(new_bitfield):
+            gained = new_bitfield.andnot(old_bitfield).iter_set()
+            lost = old_bitfield.andnot(new_bitfield).iter_set()
+        else:
+            old_pieces = set(old_bitfield.iter_set())
+            new_pieces = set(new_bitfield.iter_set())
+            gained, lost = new_pieces - old_pieces, old_pieces - new_pieces
+        for piece in gained:
+            self._holders.setdefault(piece, set()).add(peer_id)
+        for piece in lost:
+            holders = self._holders.get(piece)
+            if holders is not None:
+                holders.discard(peer_id)
+                if not holders:
+                    del self._holders[piece]
@@ -0,0 +1,131 @@
+from collections import OrderedDict, defaultdict
+
+
+class PieceCache:
+    """Keeps recently served pieces in memory, up to `budget` bytes.
+
+    A piece larger than the whole budget is never cached. Subclasses decide
+    which piece is evicted when a new one does not fit.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def get(self, piece):
+        """Return the cached data of a piece, or None."""
+        data = self.lookup(piece)
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    def put(self, piece, data):
+        if len(data) > self.budget or self.lookup(piece) is not None:
+            return
+        while self.size + len(data) > self.budget:
+            self.size -= len(self.evict())
+            self.evictions += 1
+        self.insert(piece, data)
+        self.size += len(data)
+
+    def stats(self):
+        return f"{self.hits} hits, {self.misses} misses, {self.evictions} evictions, {self.size} bytes in {len(self)} pieces"
+
+    def lookup(self, piece):
+        raise NotImplementedError
+
+    def insert(self, piece, data):
+        raise NotImplementedError
+
+    def evict(self):
+        """Remove a piece and return its data."""
+        raise NotImplementedError
+
+
+class LRUCache(PieceCache):
+    """Evict the piece that was served least recently."""
+
+    def __init__(self, budget):
+        super().__init__(budget)
+        self.pieces = OrderedDict()
+
+    def __len__(self):
+        return len(self.pieces)
+
+    def lookup(self, piece):
+        data = self.pieces.get(piece)
+        if data is not None:
+            self.pieces.move_to_end(piece)
+        return data
+
+    def insert(self, piece, data):
+        self.pieces[piece] = data
+
+    def evict(self):
+        return self.pieces.popitem(last=False)[1]
+
+
+class LFUCache(PieceCache):
+    """Evict the piece served the fewest times, the oldest among equals.
+
+    Pieces are grouped by use count, so every operation is O(1). Suits
+    swarms where a few pieces get most of the requests for a long time.
+    """
+
+    def __init__(self, budget):
+        super().__init__(budget)
+        self.pieces = {}
+        self.counts = {}
+        self.by_count = defaultdict(OrderedDict)
+        self.min_count = 0
+
+    def __len__(self):
+        return len(self.pieces)
+
+    def lookup(self, piece):
+        data = self.pieces.get(piece)
+        if data is not None:
+            count = self.counts[piece]
+            del self.by_count[count][piece]
+            if not self.by_count[count]:
+                del self.by_count[count]
+                if self.min_count == count:
+                    self.min_count = count + 1
+            self.counts[piece] = count + 1
+            self.by_count[count + 1][piece] = None
+        return data
+
+    def insert(self, piece, data):
+        self.pieces[piece] = data
+        self.counts[piece] = 1
+        self.by_count[1][piece] = None
+        self.min_count = 1
+
+    def evict(self):
+        pieces = self.by_count[self.min_count]
+        piece, _ = pieces.popitem(last=False)
+        if not pieces:
+            del self.by_count[self.min_count]
+            self.min_count = min(self.by_count, default=0)
+        del self.counts[piece]
+        return self.pieces.pop(piece)
+
+
+CACHES = {
+    "lru": LRUCache,
+    "lfu": LFUCache,
+}
+
+
+def create_cache(name, budget):
+    if name not in CACHES:
+        raise ValueError(f"Unknown cache policy: {name}")
+    return CACHES[name](budget)
@@ -0,0 +1,80 @@
+import asyncio
+import time
+from collections import deque
+
+
+class PieceDownload:
+    """A piece being downloaded block by block into a preallocated buffer.
+
+    The piece is cut into blocks of `block_size` bytes. Every peer helping
+    with the piece takes the next block nobody has asked for yet, and each
+    block is written at its offset in the buffer as it arrives, so blocks
+    can come from several peers at once and in any order. A block whose
+    request failed is handed back for another peer to fetch.
+    """
+
+    def __init__(self, piece, length, block_size):
+        self.piece = piece
+        self.length = length
+        self.block_size = block_size
+        self.buffer = bytearray(length)
+        self.view = memoryview(self.buffer)
+        count = max(1, (length + block_size - 1) // block_size)
+        # Blocks nobody is fetching
+        self.open = deque(range(count))
+        self.missing = count
+        # Peer that sent each block
+        self.sources = {}
+        # Verification of the whole piece, once every block is in
+        self.check = None
+        self.changed = asyncio.Event()
+        self.started = time.time()
+
+    def block_range(self, block):
+        """Return the offset and length of a block inside the piece."""
+        begin = block * self.block_size
+        return begin, min(self.block_size, self.length - begin)
+
+    def has_open_blocks(self):
+        return bool(self.open)
+
+    def complete(self):
+        return self.missing == 0
+
+    def next_block(self):
+        """Take the next block to fetch, or None if all are taken."""
+        return self.open.popleft() if self.open else None
+
+    def block_writer(self, block):
+        """Return a function writing consecutive chunks of a block."""
+        position, end = self.block_range(block)
+        end += position
+
+        def write(chunk):
+            nonlocal position
+            size = min(len(chunk), end - position)
+            self.view[position : position + size] = chunk[:size]
+            position += size
+
+        return write
+
+    def finish(self, block, source):
+        """Record that a block arrived whole from `source`."""
+        self.sources[block] = source
+        self.missing -= 1
+        if self.missing == 0:
+            self.notify()
+
+    def give_back(self, block):
+        """Put back a block whose request failed, for another peer."""
+        self.open.appendleft(block)
+        self.notify()
+
+    def notify(self):
+        # Wake every peer waiting on the piece
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def wait(self):
+        """Wait until a block is given back or the piece is complete."""
+        await self.changed.wait()
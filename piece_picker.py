@@ -0,0 +1,144 @@
+import random
+
+from config import CONFIGS
+
+
+class PiecePicker:
+    """Decides which missing piece to request from a peer next.
+
+    Keeps the availability of every piece, that is how many known peers have
+    it. Counts are updated incrementally from the pieces that changed in each
+    peer bitfield. The pieces we still want are also grouped by their
+    availability, so a pick looks at the rarest wanted pieces first instead
+    of walking the whole torrent; pieces we have are dropped from the groups
+    as picks come across them. Subclasses decide which candidate piece is
+    chosen.
+    """
+
+    def __init__(self, piece_count):
+        self.availability = [0] * piece_count
+        self.peers = {}
+        # Wanted pieces by availability
+        self.wanted = {0: set(range(piece_count))} if piece_count else {}
+
+    def update_peer(self, peer_id, bitfield):
+        """Record the latest bitfield of a peer.
+
+        Pieces past the end of the torrent are not counted.
+        """
+        old = self.peers.get(peer_id)
+        if old is not None and len(old) == len(bitfield):
+            for piece in bitfield.andnot(old).iter_set():
+                self.count(piece, 1)
+            for piece in old.andnot(bitfield).iter_set():
+                self.count(piece, -1)
+        else:
+            if old is not None:
+                self.remove_peer(peer_id)
+            for piece in bitfield.iter_set():
+                self.count(piece, 1)
+        self.peers[peer_id] = bitfield.copy()
+
+    def remove_peer(self, peer_id):
+        old = self.peers.pop(peer_id, None)
+        if old is not None:
+            for piece in old.iter_set():
+                self.count(piece, -1)
+
+    def count(self, piece, change):
+        if piece >= len(self.availability):
+            return
+        old = self.availability[piece]
+        self.availability[piece] = old + change
+        group = self.wanted.get(old)
+        if group is not None and piece in group:
+            group.remove(piece)
+            if not group:
+                del self.wanted[old]
+            self.wanted.setdefault(old + change, set()).add(piece)
+
+    def pick(self, bitfield, have, exclude=()):
+        """Return the next piece to request from a peer, or None."""
+        if len(bitfield) != len(have):
+            return None
+        useful = bitfield.andnot(have)
+        if not useful.any():
+            return None
+        return self.choose(useful, have, exclude)
+
+    def choose(self, useful, have, exclude):
+        """Return one of the `useful` pieces not in `exclude`, or None."""
+        raise NotImplementedError
+
+    def rarest(self, useful, have, exclude):
+        """Return the rarest pieces a peer can give us, or an empty list."""
+        for availability in sorted(self.wanted):
+            if not availability:
+                # Nobody has these, so neither does this peer
+                continue
+            group = self.wanted[availability]
+            candidates = []
+            for piece in list(group):
+                if have[piece]:
+                    group.discard(piece)
+                elif useful[piece] and piece not in exclude:
+                    candidates.append(piece)
+            if not group:
+                del self.wanted[availability]
+            if candidates:
+                return candidates
+        return []
+
+
+class RarestFirstPicker(PiecePicker):
+    """Request the piece the fewest peers have, breaking ties at random."""
+
+    def choose(self, useful, have, exclude):
+        candidates = self.rarest(useful, have, exclude)
+        return random.choice(candidates) if candidates else None
+
+
+class RandomFirstPicker(RarestFirstPicker):
+    """Request random pieces until a few are complete, then the rarest.
+
+    A new peer has nothing to share, and a random piece is the quickest to
+    get since it is usually well replicated. Random pieces are found by
+    probing, and if a few probes miss, the rarest piece is taken instead.
+    """
+
+    PROBES = 32
+
+    def choose(self, useful, have, exclude):
+        if have.count() < CONFIGS["RANDOM_FIRST_PIECES"]:
+            for _ in range(self.PROBES):
+                piece = random.randrange(len(useful))
+                if useful[piece] and piece not in exclude:
+                    return piece
+        return super().choose(useful, have, exclude)
+
+
+class SequentialPicker(PiecePicker):
+    """Request pieces in order, for playing a file while it downloads."""
+
+    def choose(self, useful, have, exclude):
+        # Piece 0 is the highest bit, so the first piece is the top set bit
+        value = useful.to_int()
+        while value:
+            piece = len(useful) - value.bit_length()
+            if piece not in exclude:
+                return piece
+            value &= ~(1 << (len(useful) - 1 - piece))
+        return None
+
+
+PICKERS = {
+    "rarest": RarestFirstPicker,
+    "random": RandomFirstPicker,
+    "sequential": SequentialPicker,
+}
+
+
+def create_picker(name, piece_count):
+    if name not in PICKERS:
+        raise ValueError(f"Unknown piece picker: {name}")
+    return PICKERS[name](piece_count)
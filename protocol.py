@@ -0,0 +1,235 @@
+import asyncio
+from collections import namedtuple
+from urllib.parse import parse_qsl, urlsplit
+
+from config import CONFIGS
+from storage import pread
+
+STATUS_MESSAGES = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    413: "Payload Too Large",
+    416: "Range Not Satisfiable",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+    501: "Not Implemented",
+}
+
+# `target` is the raw request target, `path` the same without its query
+# string, whose percent-decoded parameters are in `params`.
+HttpRequest = namedtuple(
+    "HttpRequest", ["method", "target", "path", "params", "headers", "body"]
+)
+
+
+class HttpError(Exception):
+    """A request that can't be served, answered with `status` and closed."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_headers(lines):
+    """Parse "Key: value" header lines into a dict with lower-case keys."""
+    headers = {}
+    for line in lines:
+        if line:
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip()
+    return headers
+
+
+def parse_request_head(head):
+    """Parse a request line and headers, without the blank line ending them.
+
+    Returns the method, the raw target, the path, the query parameters and
+    the headers.
+    """
+    lines = head.split("\r\n")
+    parts = lines[0].split(" ")
+    if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+        raise HttpError(400, "Malformed request line")
+    method, target, _ = parts
+    url = urlsplit(target)
+    params = dict(parse_qsl(url.query, keep_blank_values=True))
+    return method, target, url.path, params, parse_headers(lines[1:])
+
+
+class RequestParser:
+    """Incremental parser for a stream of pipelined HTTP requests.
+
+    Bytes are fed as they arrive, however the stream is split into
+    segments, and complete requests are taken out one at a time with
+    `next_request`. A request head is only scanned once for its end, and
+    the buffer is reused for the whole connection. Heads longer than
+    MAX_REQUEST_HEAD and bodies longer than MAX_REQUEST_BODY raise HttpError.
+    """
+
+    def __init__(self, max_head=None, max_body=None):
+        self.max_head = max_head or CONFIGS["MAX_REQUEST_HEAD"]
+        self.max_body = max_body or CONFIGS["MAX_REQUEST_BODY"]
+        self.buffer = bytearray()
+        # Where to resume looking for the end of the head
+        self.scanned = 0
+        # Parsed head of a request still waiting for its body
+        self.head = None
+        self.body_length = 0
+
+    def feed(self, data):
+        self.buffer += data
+
+    def next_request(self):
+        """Return the next complete HttpRequest, or None if more data is needed."""
+        if self.head is None:
+            end = self.buffer.find(b"\r\n\r\n", self.scanned)
+            if end < 0:
+                if len(self.buffer) > self.max_head:
+                    raise HttpError(431, "Request head too large")
+                # The end marker may straddle the next segment
+                self.scanned = max(0, len(self.buffer) - 3)
+                return None
+            if end > self.max_head:
+                raise HttpError(431, "Request head too large")
+            head = parse_request_head(self.buffer[:end].decode("latin-1"))
+            headers = head[4]
+            if "chunked" in headers.get("transfer-encoding", "").lower():
+                raise HttpError(501, "Chunked request bodies are not supported")
+            length = headers.get("content-length", "0")
+            if not length.isdigit():
+                raise HttpError(400, "Invalid Content-Length")
+            if int(length) > self.max_body:
+                raise HttpError(413, "Request body too large")
+            del self.buffer[: end + 4]
+            self.scanned = 0
+            self.head = head
+            self.body_length = int(length)
+        if len(self.buffer) < self.body_length:
+            return None
+        body = bytes(self.buffer[: self.body_length])
+        del self.buffer[: self.body_length]
+        method, target, path, params, headers = self.head
+        self.head = None
+        return HttpRequest(method, target, path, params, headers, body)
+
+
+def parse_request(data):
+    """Parse one complete request held in `data`."""
+    parser = RequestParser()
+    parser.feed(data)
+    request = parser.next_request()
+    if request is None:
+        raise HttpError(400, "Incomplete request")
+    return request
+
+
+async def read_request_head(reader):
+    """Read an HTTP request line and headers.
+
+    Returns the method, the path without its query string, the query
+    parameters and the headers.
+    """
+    head = await reader.readuntil(b"\r\n\r\n")
+    method, _, path, params, headers = parse_request_head(
+        head[:-4].decode("latin-1")
+    )
+    return method, path, params, headers
+
+
+def response_head(status, length, keep_alive=False, content_type=None):
+    """Build the status line and headers of an HTTP response."""
+    head = f"HTTP/1.1 {status} {STATUS_MESSAGES.get(status, 'OK')}\r\n"
+    if content_type:
+        head += f"Content-Type: {content_type}\r\n"
+    head += (
+        f"Content-Length: {length}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        "\r\n"
+    )
+    return head.encode()
+
+
+async def read_response_head(reader):
+    """Read an HTTP status line and headers.
+
+    Returns the status code and the headers. The body is left in the reader.
+    """
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ", 2)[1])
+    return status, parse_headers(lines[1:])
+
+
+async def read_body(reader, length, write, limiter=None, peer=None):
+    """Stream exactly `length` body bytes from the reader into `write`.
+
+    The body is passed on in chunks, so it is never held in memory as a
+    whole. With a RateLimiter, reading is paced to its limits for `peer`,
+    and the unread data holds the sender back. Raises
+    asyncio.IncompleteReadError if the connection closes early.
+    """
+    chunk_size = CONFIGS["PIECE_CHUNK_SIZE"]
+    if limiter is not None:
+        chunk_size = limiter.chunk_size()
+    remaining = length
+    while remaining > 0:
+        chunk = await reader.read(min(remaining, chunk_size))
+        if not chunk:
+            raise asyncio.IncompleteReadError(b"", remaining)
+        write(chunk)
+        remaining -= len(chunk)
+        if limiter is not None:
+            await limiter.consume(peer, len(chunk))
+
+
+async def send_file(writer, infile, size, offset=0, limiter=None, peer=None):
+    """Write `size` bytes at `offset` of an open binary file to the writer.
+
+    Uses the zero-copy sendfile path when enabled and available; otherwise
+    the file is copied in chunks, waiting on drain() so a slow reader applies
+    backpressure instead of letting the write buffer grow. The file position
+    is never used, so several transfers can share one file. Transfers with
+    an active RateLimiter are always copied, paced to its limits for `peer`.
+    """
+    chunk_size = CONFIGS["PIECE_CHUNK_SIZE"]
+    if limiter is not None and limiter.active():
+        chunk_size = limiter.chunk_size()
+    elif CONFIGS["USE_SENDFILE"]:
+        await writer.drain()
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.sendfile(
+                writer.transport, infile, offset, size, fallback=False
+            )
+            return
+        except asyncio.SendfileNotAvailableError:
+            pass
+    fd = infile.fileno()
+    remaining = size
+    while remaining > 0:
+        chunk = pread(fd, min(remaining, chunk_size), offset)
+        if not chunk:
+            break
+        if limiter is not None:
+            await limiter.consume(peer, len(chunk))
+        writer.write(chunk)
+        offset += len(chunk)
+        remaining -= len(chunk)
+        await writer.drain()
+
+
+async def send_view(writer, view, limiter=None, peer=None):
+    """Write a memoryview to the writer in chunks, without copying it first.
+
+    With a RateLimiter, the chunks are paced to its limits for `peer`.
+    """
+    chunk_size = CONFIGS["PIECE_CHUNK_SIZE"]
+    if limiter is not None:
+        chunk_size = limiter.chunk_size()
+    for start in range(0, len(view), chunk_size):
+        chunk = view[start : start + chunk_size]
+        if limiter is not None:
+            await limiter.consume(peer, len(chunk))
+        writer.write(chunk)
+        await writer.drain()
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import os
+import time
+
+from config import CONFIGS
+
+
+class TokenBucket:
+    """Lets `rate` bytes per second through, `burst` bytes at most at once.
+
+    Callers take tokens for the bytes they move. When the bucket runs dry
+    it goes into debt and each caller waits until its share is paid off,
+    so concurrent transfers are paced one after another at the configured
+    rate. A rate of 0 means no limit.
+    """
+
+    def __init__(self, rate=0):
+        self.rate = 0
+        self.burst = 0
+        self.tokens = 0
+        self.updated = time.monotonic()
+        self.configure(rate)
+
+    def configure(self, rate):
+        """Change the rate, keeping the tokens saved up so far."""
+        self.refill()
+        self.rate = rate
+        # A small burst, so throttled traffic flows evenly instead of in
+        # bursts followed by long pauses
+        self.burst = rate * CONFIGS["RATE_LIMIT_BURST"]
+        self.tokens = min(self.tokens, self.burst)
+
+    def refill(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        if self.rate:
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+        self.updated = now
+
+    def take(self, size, now=None):
+        """Take tokens for `size` bytes; return the seconds to wait first."""
+        if not self.rate:
+            return 0
+        self.refill(now)
+        self.tokens -= size
+        return max(0, -self.tokens / self.rate)
+
+
+class RateLimiter:
+    """Limits one direction of traffic, overall and per remote peer."""
+
+    def __init__(self, rate=0, peer_rate=0):
+        self.total = TokenBucket(rate)
+        self.peer_rate = peer_rate
+        self.peers = {}
+
+    def configure(self, rate=None, peer_rate=None):
+        if rate is not None:
+            self.total.configure(rate)
+        if peer_rate is not None:
+            self.peer_rate = peer_rate
+            for bucket in self.peers.values():
+                bucket.configure(peer_rate)
+
+    def active(self):
+        return bool(self.total.rate or self.peer_rate)
+
+    def chunk_size(self):
+        """Return how many bytes to move between two waits.
+
+        Throttled transfers are cut into RATE_LIMIT_SLICES slices per
+        second of the tightest rate, so they are shaped smoothly.
+        """
+        rates = [rate for rate in (self.total.rate, self.peer_rate) if rate]
+        if not rates:
+            return CONFIGS["PIECE_CHUNK_SIZE"]
+        return max(
+            1,
+            min(
+                CONFIGS["PIECE_CHUNK_SIZE"],
+                int(min(rates) / CONFIGS["RATE_LIMIT_SLICES"]),
+            ),
+        )
+
+    def bucket(self, peer):
+        bucket = self.peers.pop(peer, None)
+        if bucket is None:
+            if len(self.peers) >= CONFIGS["RATE_LIMIT_MAX_PEERS"]:
+                self.forget_idle()
+            if len(self.peers) >= CONFIGS["RATE_LIMIT_MAX_PEERS"]:
+                # Nobody is idle: the least recently used peer goes
+                del self.peers[next(iter(self.peers))]
+            bucket = TokenBucket(self.peer_rate)
+        # Kept in order of use, most recent last
+        self.peers[peer] = bucket
+        return bucket
+
+    def forget_idle(self):
+        # A full bucket behaves like a new one, so it can go
+        now = time.monotonic()
+        for peer, bucket in list(self.peers.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst:
+                del self.peers[peer]
+
+    async def consume(self, peer, size):
+        """Wait until `size` bytes may move to or from `peer`."""
+        if not self.active():
+            return
+        now = time.monotonic()
+        delay = self.total.take(size, now)
+        if self.peer_rate:
+            delay = max(delay, self.bucket(peer).take(size, now))
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class RateLimits:
+    """Upload and download limits of a peer, adjustable while it runs.
+
+    The limits start from the *_RATE settings and can be changed with
+    `configure`, or by writing a JSON object with any of the keys
+    "upload", "peer_upload", "download" and "peer_download" (bytes per
+    second, 0 for no limit) to the file passed to `watch`.
+    """
+
+    def __init__(self):
+        self.upload = RateLimiter(
+            CONFIGS["UPLOAD_RATE"], CONFIGS["PEER_UPLOAD_RATE"]
+        )
+        self.download = RateLimiter(
+            CONFIGS["DOWNLOAD_RATE"], CONFIGS["PEER_DOWNLOAD_RATE"]
+        )
+        self.mtime = None
+
+    def configure(
+        self, upload=None, peer_upload=None, download=None, peer_download=None
+    ):
+        self.upload.configure(upload, peer_upload)
+        self.download.configure(download, peer_download)
+
+    def reload(self, path):
+        """Apply the limits in `path` if it changed since the last reload."""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self.mtime:
+            return False
+        self.mtime = mtime
+        try:
+            with open(path, "r") as infile:
+                data = json.load(infile)
+            limits = {
+                key: int(data[key])
+                for key in ("upload", "peer_upload", "download", "peer_download")
+                if key in data
+            }
+            if any(rate < 0 for rate in limits.values()):
+                raise ValueError("rates can't be negative")
+            self.configure(**limits)
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"Ignoring invalid rate limits in {path}: {e}")
+            return False
+        print(f"Rate limits from {path}: {data}")
+        return True
+
+    async def watch(self, path):
+        """Reload the limits whenever the file at `path` changes."""
+        while True:
+            self.reload(path)
+            await asyncio.sleep(CONFIGS["RATE_LIMIT_RELOAD_INTERVAL"])
@@ -0,0 +1,80 @@
+import asyncio
+import json
+import os
+
+from bitfield import Bitfield
+from config import CONFIGS
+
+
+class ResumeFile:
+    """Remembers which pieces a peer has verified, across restarts.
+
+    The file holds the torrent's info hash, the bitfield of verified pieces
+    and the size and modification time of every shared file when it was
+    saved. Where a piece lives follows from the manifest, so no location map
+    is needed. If the files changed since the last save (e.g. the peer was
+    killed after writing more pieces), the saved pieces are still trusted
+    and the caller only re-hashes the others.
+    """
+
+    def __init__(self, path, manifest, directory):
+        self.path = path
+        self.manifest = manifest
+        self.directory = directory
+        self.save_task = None
+
+    def file_stats(self):
+        stats = []
+        for entry in self.manifest.files:
+            try:
+                stat = os.stat(os.path.join(self.directory, entry.path))
+            except FileNotFoundError:
+                return None
+            stats.append([stat.st_size, stat.st_mtime_ns])
+        return stats
+
+    def load(self):
+        """Return (bitfield, changed) for the saved state.
+
+        `bitfield` is None if there is no resume data for this torrent.
+        `changed` is True if the files were modified since the save, so
+        pieces missing from the bitfield may be on disk by now.
+        """
+        try:
+            with open(self.path, "r") as infile:
+                data = json.load(infile)
+            if data["info_hash"] != self.manifest.info_hash:
+                return None, True
+            bitfield = Bitfield.from_base64(
+                self.manifest.piece_count, data["bitfield"]
+            )
+            return bitfield, data["files"] != self.file_stats()
+        except (OSError, ValueError, KeyError):
+            return None, True
+
+    def save(self, bitfield):
+        data = {
+            "info_hash": self.manifest.info_hash,
+            "bitfield": bitfield.to_base64(),
+            "files": self.file_stats(),
+        }
+        # Write a new file and swap it in, so a crash never leaves half of one
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as outfile:
+            json.dump(data, outfile)
+        os.replace(temp_path, self.path)
+
+    def request_save(self, bitfield):
+        """Save the bitfield shortly, merging saves requested meanwhile."""
+        if self.save_task is None or self.save_task.done():
+            self.save_task = asyncio.create_task(self.save_later(bitfield))
+
+    async def save_later(self, bitfield):
+        await asyncio.sleep(CONFIGS["RESUME_SAVE_DELAY"])
+        self.save(bitfield)
+
+    def close(self, bitfield):
+        """Cancel any pending save and write the final state."""
+        if self.save_task is not None:
+            self.save_task.cancel()
+        self.save(bitfield)
@@ -0,0 +1,236 @@
+import asyncio
+from collections import defaultdict
+
+from config import CONFIGS
+
+
+class PieceCorrupted(Exception):
+    """Raised by `fetch` when a downloaded piece fails hash verification."""
+
+
+class DownloadScheduler:
+    """Downloads the missing pieces of a bitfield from the known peers.
+
+    Whenever a peer has a free request slot, the piece picker chooses what to
+    ask it for, with at most MAX_REQUESTS_PER_PEER requests in flight per
+    peer. A piece is only done once its download succeeds; a failed or timed
+    out request puts the piece back among the wanted ones and backs the peer
+    off exponentially. A piece that arrived corrupted is never requested
+    from the same peer again, so it is fetched from another holder. The
+    peer list is refreshed on a timer, or sooner when
+    no peer can serve any wanted piece. A peer that had nothing for us is
+    not asked again until its bitfield changes or a download ends.
+
+    A peer with a free slot and no new piece to fetch joins a piece other
+    peers are fetching, if `shareable(piece)` says some of its blocks are
+    still open, so one piece can come from several peers at once.
+
+    Once at most ENDGAME_PIECES pieces are missing, the scheduler enters
+    endgame mode: peers with a free slot and nothing else to do are asked
+    for their own copy of pieces already on their way from someone else,
+    up to ENDGAME_SOURCES copies per piece, and the other copies are
+    cancelled as soon as one arrives. A single slow peer then no longer
+    holds up the end of the download.
+
+    `fetch(ip, port, piece, endgame)` downloads one piece, or its share of
+    the blocks, and returns True once the piece is done; with `endgame` set
+    it downloads a separate copy of the piece. `refresh()` updates the peer
+    list and `get_peers()` returns the other peers with their bitfields; a
+    refresh that fails, or raises ValueError for a peer list it can't
+    parse, is retried after STARVED_REFRESH_DELAY.
+    """
+
+    def __init__(
+        self, picker, bitfield, fetch, refresh, get_peers, shareable=None
+    ):
+        self.picker = picker
+        self.bitfield = bitfield
+        self.fetch = fetch
+        self.refresh = refresh
+        self.get_peers = get_peers
+        self.shareable = shareable
+        # Download tasks of each piece, by peer id
+        self.in_flight = {}
+        self.requests_per_peer = defaultdict(int)
+        self.failures = defaultdict(int)
+        self.backoff_until = {}
+        # Pieces each peer sent us corrupted
+        self.corrupt = {}
+        self.endgame = False
+        self.wake = None
+        # Bumped whenever a piece may have become worth asking for again,
+        # i.e. a download ended or endgame started
+        self.changes = 0
+        # (bitfield, changes) of the peers whose last pick found nothing,
+        # so they aren't asked again until one of them moves
+        self.idle = {}
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.wake = asyncio.Event()
+        next_refresh = loop.time()
+        try:
+            while not self.bitfield.complete():
+                if loop.time() >= next_refresh:
+                    try:
+                        await self.refresh()
+                        next_refresh = (
+                            loop.time() + CONFIGS["TRACKER_REFRESH_INTERVAL"]
+                        )
+                    except (
+                        OSError,
+                        asyncio.IncompleteReadError,
+                        ValueError,
+                    ) as e:
+                        # Keep downloading from the peers we know, and ask
+                        # the tracker again soon, also when its answer
+                        # couldn't be parsed
+                        print(f"Peer list refresh failed: {e!r}")
+                        next_refresh = (
+                            loop.time() + CONFIGS["STARVED_REFRESH_DELAY"]
+                        )
+                self.wake.clear()
+                if (
+                    not self.endgame
+                    and self.bitfield.missing() <= CONFIGS["ENDGAME_PIECES"]
+                ):
+                    self.endgame = True
+                    self.changes += 1
+                    print(
+                        f"Endgame: asking several peers for the last {self.bitfield.missing()} pieces"
+                    )
+                self.schedule()
+                if not self.in_flight:
+                    # Starved: nobody we know has what we want
+                    next_refresh = min(
+                        next_refresh,
+                        loop.time() + CONFIGS["STARVED_REFRESH_DELAY"],
+                    )
+                now = loop.time()
+                wake_at = min(
+                    [next_refresh]
+                    + [t for t in self.backoff_until.values() if t > now]
+                )
+                try:
+                    await asyncio.wait_for(self.wake.wait(), wake_at - now)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for copies in list(self.in_flight.values()):
+                for task in list(copies.values()):
+                    task.cancel()
+
+    def schedule(self):
+        """Start requests on every peer with a free slot.
+
+        Peers take one piece each in turn, so requests are spread over all
+        of them rather than piled onto the first peer listed.
+        """
+        now = asyncio.get_running_loop().time()
+        peers = [
+            peer
+            for peer in self.get_peers()
+            if self.backoff_until.get(peer["peer id"], 0) <= now
+        ]
+        started = True
+        while started:
+            started = False
+            for peer in peers:
+                peer_id = peer["peer id"]
+                if (
+                    self.requests_per_peer[peer_id]
+                    >= CONFIGS["MAX_REQUESTS_PER_PEER"]
+                ):
+                    continue
+                idle = self.idle.get(peer_id)
+                if (
+                    idle is not None
+                    and idle[0] is peer["bitfield"]
+                    and idle[1] == self.changes
+                ):
+                    continue
+                piece, copy = self.pick(peer_id, peer["bitfield"])
+                if piece is None:
+                    self.idle[peer_id] = (peer["bitfield"], self.changes)
+                else:
+                    self.requests_per_peer[peer_id] += 1
+                    self.in_flight.setdefault(piece, {})[peer_id] = (
+                        asyncio.create_task(self.download(peer, piece, copy))
+                    )
+                    started = True
+
+    def pick(self, peer_id, bitfield):
+        """Choose the next piece to ask a peer for.
+
+        Returns (piece, copy), where `copy` is True for a separate endgame
+        copy of a piece in flight, or (None, False) if there is nothing.
+        """
+        corrupt = self.corrupt.get(peer_id, set())
+        exclude = self.in_flight
+        if corrupt:
+            exclude = self.in_flight.keys() | corrupt
+        piece = self.picker.pick(bitfield, self.bitfield, exclude)
+        if piece is not None:
+            return piece, False
+        if self.shareable is not None:
+            # Help with the open blocks of a piece others are fetching
+            for piece, copies in self.in_flight.items():
+                if (
+                    peer_id not in copies
+                    and piece not in corrupt
+                    and piece < len(bitfield)
+                    and bitfield[piece]
+                    and self.shareable(piece)
+                ):
+                    return piece, False
+        if not self.endgame:
+            return None, False
+        # Endgame: a piece already requested from other peers, unless this
+        # peer has it in flight too or enough peers are sending it
+        exclude = {
+            piece
+            for piece, copies in self.in_flight.items()
+            if peer_id in copies or len(copies) >= CONFIGS["ENDGAME_SOURCES"]
+        }
+        piece = self.picker.pick(bitfield, self.bitfield, exclude | corrupt)
+        return piece, piece is not None
+
+    async def download(self, peer, piece, endgame=False):
+        peer_id = peer["peer id"]
+        ok = False
+        try:
+            ok = await asyncio.wait_for(
+                self.fetch(peer["ip"], peer["port"], piece, endgame),
+                CONFIGS["REQUEST_TIMEOUT"],
+            )
+        except asyncio.CancelledError:
+            raise
+        except PieceCorrupted:
+            print(f"Piece {piece} from {peer_id} failed verification")
+            self.corrupt.setdefault(peer_id, set()).add(piece)
+        except Exception as e:
+            print(f"Failed to download piece {piece} from {peer_id}: {e!r}")
+        finally:
+            copies = self.in_flight[piece]
+            del copies[peer_id]
+            if not copies:
+                del self.in_flight[piece]
+            self.requests_per_peer[peer_id] -= 1
+            self.changes += 1
+            self.wake.set()
+
+        if ok:
+            # The other copies of the piece are not needed any more
+            for other_id, task in self.in_flight.get(piece, {}).items():
+                print(f"Cancelling the request of piece {piece} from {other_id}")
+                task.cancel()
+            self.failures.pop(peer_id, None)
+            self.backoff_until.pop(peer_id, None)
+        else:
+            self.failures[peer_id] += 1
+            delay = min(
+                CONFIGS["RETRY_BACKOFF"] * 2 ** (self.failures[peer_id] - 1),
+                CONFIGS["MAX_RETRY_BACKOFF"],
+            )
+            now = asyncio.get_running_loop().time()
+            self.backoff_until[peer_id] = now + delay
@@ -0,0 +1,235 @@
+import hashlib
+import mmap
+import os
+import threading
+from contextlib import contextmanager
+
+from config import CONFIGS
+
+
+def pread(fd, size, offset):
+    """Read at an offset without moving the file position, where supported."""
+    if hasattr(os, "pread"):
+        return os.pread(fd, size, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, size)
+
+
+def pwrite(fd, data, offset):
+    if hasattr(os, "pwrite"):
+        return os.pwrite(fd, data, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.write(fd, data)
+
+
+class MappedFile:
+    """A read-only memory map of a shared file, counted by its users."""
+
+    def __init__(self, path):
+        self.path = path
+        self.refs = 0
+        with open(path, "rb") as infile:
+            size = os.fstat(infile.fileno()).st_size
+            # The map keeps its own handle, the file can be closed
+            self.map = (
+                mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+                if size
+                else None
+            )
+
+    def view(self, offset, length):
+        if self.map is None:
+            return memoryview(b"")
+        return memoryview(self.map)[offset : offset + length]
+
+    def close(self):
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                # A transport still holds a slice; the map is freed with it
+                pass
+            self.map = None
+
+
+_mapped_files = {}
+_mapped_files_lock = threading.Lock()
+
+
+def acquire_mapping(path):
+    """Return the shared map of a file, mapping it on first use."""
+    path = os.path.abspath(path)
+    with _mapped_files_lock:
+        mapped = _mapped_files.get(path)
+        if mapped is None:
+            mapped = _mapped_files[path] = MappedFile(path)
+        mapped.refs += 1
+        return mapped
+
+
+def retain_mapping(mapped):
+    with _mapped_files_lock:
+        mapped.refs += 1
+
+
+def release_mapping(mapped):
+    """Drop a reference to a map, unmapping the file after the last one."""
+    with _mapped_files_lock:
+        mapped.refs -= 1
+        if mapped.refs > 0:
+            return
+        del _mapped_files[mapped.path]
+    mapped.close()
+
+
+class Storage:
+    """The files of a manifest, preallocated in a peer's directory.
+
+    Every piece is written straight to its offsets in the target files and
+    served from the same place, so there are no separate piece files and no
+    combine pass. Offsets are passed explicitly (pread/pwrite), so concurrent
+    transfers never share a file position.
+    """
+
+    def __init__(self, manifest, directory):
+        self.manifest = manifest
+        self.directory = directory
+        self.files = []
+        self.existed = []
+        self.mapped = []
+
+    def open(self):
+        paths = []
+        for entry in self.manifest.files:
+            filepath = os.path.join(self.directory, entry.path)
+            os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+            existed = os.path.exists(filepath)
+            fd = os.open(
+                filepath,
+                os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0),
+                0o644,
+            )
+            outfile = os.fdopen(fd, "r+b")
+            size = os.fstat(outfile.fileno()).st_size
+            if size != entry.length:
+                self.preallocate(outfile.fileno(), size, entry.length)
+            self.files.append(outfile)
+            self.existed.append(existed and size == entry.length)
+            paths.append(filepath)
+        if CONFIGS["USE_MMAP"]:
+            # Mapped once for as long as the torrent runs
+            self.mapped = [acquire_mapping(path) for path in paths]
+
+    def preallocate(self, fd, size, length):
+        """Grow or shrink a file to its final length.
+
+        Disk blocks are reserved up front where the platform allows it, so
+        pieces arriving out of order do not fragment the file.
+        """
+        os.ftruncate(fd, length)
+        if length > size and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fd, size, length - size)
+            except OSError:
+                pass  # e.g. not supported by the file system; stays sparse
+
+    def piece_on_disk(self, index):
+        """Return True if every file holding the piece was already on disk."""
+        return all(
+            self.existed[span.file_index]
+            for span in self.manifest.piece_spans(index)
+        )
+
+    def write(self, index, data, begin=0):
+        """Write `data` at offset `begin` inside piece `index`."""
+        data = memoryview(data)
+        end = begin + len(data)
+        for span in self.manifest.piece_spans(index):
+            start = max(begin, span.piece_offset)
+            stop = min(end, span.piece_offset + span.length)
+            if start < stop:
+                fd = self.files[span.file_index].fileno()
+                offset = span.file_offset + start - span.piece_offset
+                chunk = data[start - begin : stop - begin]
+                while chunk:
+                    written = pwrite(fd, chunk, offset)
+                    chunk = chunk[written:]
+                    offset += written
+
+    def read(self, index, begin=0, length=None):
+        """Read `length` bytes at offset `begin` inside piece `index`."""
+        if length is None:
+            length = self.manifest.piece_length(index) - begin
+        data = bytearray()
+        for span in self.manifest.piece_spans(index):
+            start = max(begin, span.piece_offset)
+            stop = min(begin + length, span.piece_offset + span.length)
+            if start < stop:
+                data += pread(
+                    self.files[span.file_index].fileno(),
+                    stop - start,
+                    span.file_offset + start - span.piece_offset,
+                )
+        return bytes(data)
+
+    def verify(self, index):
+        """Return True if piece `index` on disk matches its manifest hash.
+
+        Safe to call from worker threads: reads never move a file position
+        and hashlib releases the GIL while hashing.
+        """
+        hasher = hashlib.new(self.manifest.algorithm)
+        for span in self.manifest.piece_spans(index):
+            hasher.update(
+                pread(
+                    self.files[span.file_index].fileno(),
+                    span.length,
+                    span.file_offset,
+                )
+            )
+        return hasher.digest() == self.manifest.piece_hash(index)
+
+    @contextmanager
+    def piece_views(self, index, begin=0, length=None):
+        """Yield zero-copy views of the parts of a piece in the mapped files.
+
+        Only `length` bytes at `begin` are included when given. The maps
+        stay alive until the views are released, even if the torrent is
+        closed while a transfer is still running.
+        """
+        if length is None:
+            length = self.manifest.piece_length(index) - begin
+        spans = self.manifest.block_spans(index, begin, length)
+        mapped = [self.mapped[span.file_index] for span in spans]
+        for item in mapped:
+            retain_mapping(item)
+        views = [
+            item.view(span.file_offset, span.length)
+            for item, span in zip(mapped, spans)
+        ]
+        try:
+            yield views
+        finally:
+            for view in views:
+                view.release()
+            for item in mapped:
+                release_mapping(item)
+
+    def piece_writer(self, index):
+        """Return a function writing consecutive chunks of a piece."""
+        position = 0
+
+        def write(chunk):
+            nonlocal position
+            self.write(index, chunk, position)
+            position += len(chunk)
+
+        return write
+
+    def close(self):
+        for mapped in self.mapped:
+            release_mapping(mapped)
+        self.mapped = []
+        for outfile in self.files:
+            outfile.close()
+        self.files = []
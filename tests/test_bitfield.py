@@ -0,0 +1,59 @@
+import pytest
+from bitfield import Bitfield
+
+
+def test_string_round_trip():
+    """Test that ASCII bitfields keep their bits and length."""
+    bitfield = Bitfield.from_string("0011001")
+    assert len(bitfield) == 7
+    assert [bitfield[i] for i in range(7)] == [
+        False, False, True, True, False, False, True
+    ]
+    assert str(bitfield) == "0011001"
+    assert bitfield.to_hex() == "32"
+
+
+@pytest.mark.parametrize("encoding", Bitfield.ENCODINGS)
+def test_wire_round_trip(encoding):
+    """Test that every wire encoding decodes back to the same bitfield."""
+    bitfield = Bitfield.from_string("1011" * 2501)
+    text = bitfield.encode(encoding)
+    assert "=" not in text
+    assert Bitfield.decode(text, len(bitfield), encoding) == bitfield
+
+
+def test_decode_rejects_bad_input():
+    """Test that malformed bitfields raise ValueError."""
+    with pytest.raises(ValueError):
+        Bitfield.decode("0120")
+    with pytest.raises(ValueError):
+        Bitfield.decode("ff", None, "hex")
+    with pytest.raises(ValueError):
+        Bitfield.decode("ffff", 6, "hex")
+    with pytest.raises(ValueError):
+        Bitfield.decode("ff", 6, "zip")
+
+
+def test_set_and_count():
+    """Test popcount and per-piece updates."""
+    bitfield = Bitfield(100000)
+    bitfield[0] = True
+    bitfield[99999] = True
+    bitfield[12345] = True
+    bitfield[12345] = False
+    assert bitfield.count() == 2
+    assert bitfield.missing() == 99998
+    assert list(bitfield.iter_set()) == [0, 99999]
+    with pytest.raises(IndexError):
+        bitfield[100000] = True
+
+
+def test_and_andnot():
+    """Test the pieces a peer can give us and the pieces we share."""
+    theirs = Bitfield.from_string("110010")
+    mine = Bitfield.from_string("101001")
+    assert str(theirs.andnot(mine)) == "010010"
+    assert str(theirs & mine) == "100000"
+    assert str(theirs | mine) == "111011"
+    with pytest.raises(ValueError):
+        theirs.andnot(Bitfield.from_string("1"))
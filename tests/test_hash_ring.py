@@ -0,0 +1,34 @@
+from hash_ring import HashRing, split_node
+
+
+def test_nodes_for_starts_at_the_owner_and_lists_every_node_once():
+    """Test that the failover order begins with the owner and covers the ring."""
+    ring = HashRing(["a:1", "b:2", "c:3"], vnodes=16)
+
+    for key in ("torrent1", "torrent2", "torrent3"):
+        nodes = ring.nodes_for(key)
+        assert nodes[0] == ring.owner(key)
+        assert sorted(nodes) == ["a:1", "b:2", "c:3"]
+    assert HashRing().nodes_for("torrent1") == []
+
+
+def test_removing_a_node_only_moves_its_own_keys():
+    """Test that keys of the remaining nodes keep their owner."""
+    ring = HashRing(["a:1", "b:2", "c:3"], vnodes=16)
+    keys = [f"torrent{index}" for index in range(200)]
+    before = {key: ring.owner(key) for key in keys}
+
+    ring.remove("b:2")
+
+    for key in keys:
+        if before[key] != "b:2":
+            assert ring.owner(key) == before[key]
+        else:
+            # The next node clockwise takes over, as peers fail over to it
+            assert ring.owner(key) == HashRing(
+                ["a:1", "b:2", "c:3"], vnodes=16
+            ).nodes_for(key)[1]
+
+
+def test_split_node():
+    assert split_node("localhost:8080") == ("localhost", 8080)
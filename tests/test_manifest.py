@@ -0,0 +1,46 @@
+import pytest
+from manifest import Manifest
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    (tmp_path / "a.bin").write_bytes(b"a" * 10)
+    (tmp_path / "b.bin").write_bytes(b"b" * 7)
+    return Manifest.create("test", ["a.bin", "b.bin"], 4, root=str(tmp_path))
+
+
+def test_piece_layout(manifest):
+    """Test piece counts and pieces spanning a file boundary."""
+    assert manifest.total_size == 17
+    assert manifest.piece_count == 5
+    assert manifest.piece_length(4) == 1
+    assert list(manifest.file_pieces(0)) == [0, 1, 2]
+    assert list(manifest.file_pieces(1)) == [2, 3, 4]
+
+    spans = manifest.piece_spans(2)
+    assert [(s.file_index, s.file_offset, s.piece_offset, s.length) for s in spans] == [
+        (0, 8, 0, 2),
+        (1, 0, 2, 2),
+    ]
+
+
+def test_piece_hashes(manifest):
+    """Test that piece hashes match the data and can be looked up."""
+    assert manifest.piece_hash(2) == manifest.hash_data(b"aabb")
+    assert manifest.find_piece(manifest.hash_data(b"b")) == 4
+    assert manifest.find_piece(manifest.hash_data(b"zzzz")) is None
+
+
+def test_save_and_load(manifest, tmp_path):
+    """Test that a saved manifest loads back identically."""
+    path = tmp_path / "torrent.json"
+    manifest.save(str(path))
+    loaded = Manifest.load(str(path))
+    assert loaded.files == manifest.files
+    assert loaded.hashes == manifest.hashes
+    assert loaded.info_hash == manifest.info_hash
+
+
+def test_wrong_number_of_hashes():
+    with pytest.raises(ValueError):
+        Manifest("test", [("a.bin", 10)], 4, b"\0" * 20)
@@ -0,0 +1,89 @@
+import asyncio
+import io
+
+from peer_connection import ConnectionPool
+from protocol import read_request_head, response_head
+
+
+def test_pipelined_requests_share_one_connection():
+    """Test that pipelined requests reuse one connection and get their own body."""
+    connections = []
+
+    async def serve(reader, writer):
+        connections.append(writer)
+        while True:
+            try:
+                _, _, params, _ = await read_request_head(reader)
+            except asyncio.IncompleteReadError:
+                break
+            body = params["piece"].encode() * 100000
+            writer.write(response_head(200, len(body), True) + body)
+            await writer.drain()
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_server(serve, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        pool = ConnectionPool(max_pipeline=3)
+        connection = pool.get("127.0.0.1", port)
+        outputs = [io.BytesIO() for _ in range(6)]
+        results = await asyncio.gather(
+            *(
+                connection.request(f"/download?piece={i}", outputs[i].write)
+                for i in range(6)
+            )
+        )
+        await pool.close()
+        server.close()
+        return results, outputs
+
+    results, outputs = asyncio.run(run())
+    assert [status for status, _ in results] == [200] * 6
+    for i, output in enumerate(outputs):
+        assert output.getvalue() == str(i).encode() * 100000
+    assert len(connections) == 1
+
+
+def test_cancelled_separate_request_leaves_pooled_requests_alone():
+    """Test that giving up on a separate connection doesn't fail pooled requests."""
+
+    async def serve(reader, writer):
+        try:
+            _, _, params, _ = await read_request_head(reader)
+        except asyncio.IncompleteReadError:
+            writer.close()
+            return
+        if params["piece"] == "slow":
+            # Never answers, like a peer too slow for endgame
+            await reader.read()
+        else:
+            await asyncio.sleep(0.2)
+            body = b"x" * 1000
+            writer.write(response_head(200, len(body), True) + body)
+            await writer.drain()
+            await reader.read()
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_server(serve, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        pool = ConnectionPool(max_pipeline=3)
+        output = io.BytesIO()
+        plain = asyncio.create_task(
+            pool.get("127.0.0.1", port).request("/download?piece=0", output.write)
+        )
+        copy = pool.separate("127.0.0.1", port)
+        endgame = asyncio.create_task(
+            copy.request("/download?piece=slow", io.BytesIO().write)
+        )
+        await asyncio.sleep(0.05)
+        endgame.cancel()
+        await copy.close()
+        status, _ = await asyncio.wait_for(plain, 5)
+        await pool.close()
+        server.close()
+        return status, output.getvalue()
+
+    status, body = asyncio.run(run())
+    assert status == 200
+    assert body == b"x" * 1000
@@ -0,0 +1,44 @@
+import pytest
+from bitfield import Bitfield
+from peer_list import decode_compact, encode_compact
+from peer_registry import PeerRecord
+
+
+def test_compact_round_trip():
+    """Test that a packed delta decodes to the same peers and removals."""
+    peers = [
+        ("123", PeerRecord("127.0.0.1", "60000", Bitfield.from_string("001100"), True, 4)),
+        ("456", PeerRecord("10.0.0.2", 61000, Bitfield.from_string("110010111"), True, 5)),
+        # Not an IPv4 address, can't be packed
+        ("789", PeerRecord("localhost", 62000, Bitfield(6), True, 6)),
+    ]
+    data = encode_compact(6, 30, 3, peers, ["999"])
+
+    version, interval, since, decoded, removed = decode_compact(data)
+    assert (version, interval, since, removed) == (6, 30, 3, ["999"])
+    assert decoded == [
+        {"peer id": "123", "ip": "127.0.0.1", "port": "60000", "bitfield": Bitfield.from_string("001100")},
+        {"peer id": "456", "ip": "10.0.0.2", "port": "61000", "bitfield": Bitfield.from_string("110010111")},
+    ]
+
+
+def test_full_list_and_truncated_data():
+    data = encode_compact(2, 30, None, [], [])
+    assert decode_compact(data) == (2, 30, None, [], [])
+    with pytest.raises(ValueError):
+        decode_compact(encode_compact(2, 30, None, [("1", PeerRecord("1.2.3.4", 1, Bitfield(8), True, 1))])[:-1])
+
+
+def test_unpackable_records_are_left_out():
+    """Test that bad ports and over-long ids don't break the whole list."""
+    peers = [
+        ("1", PeerRecord("127.0.0.1", "abc", Bitfield(6), True, 1)),
+        ("2", PeerRecord("127.0.0.1", "70000", Bitfield(6), True, 2)),
+        ("x" * 256, PeerRecord("127.0.0.1", "60000", Bitfield(6), True, 3)),
+        ("4", PeerRecord("127.0.0.1", "60000", Bitfield(6), True, 4)),
+    ]
+    data = encode_compact(4, 30, 1, peers, ["y" * 256, "5"])
+
+    version, interval, since, decoded, removed = decode_compact(data)
+    assert [peer["peer id"] for peer in decoded] == ["4"]
+    assert removed == ["5"]
@@ -0,0 +1,139 @@
+import threading
+
+import pytest
+from bitfield import Bitfield
+from peer_registry import PeerRegistry
+
+
+@pytest.fixture
+def registry():
+    registry = PeerRegistry()
+    registry.register("123", "127.0.0.1", "60000", Bitfield.from_string("001100"))
+    registry.register("456", "127.0.0.1", "61000", Bitfield.from_string("110010"))
+    return registry
+
+
+def test_holders_index(registry):
+    """Test that the piece index lists exactly the peers holding each piece."""
+    assert registry.holders(0) == {"456"}
+    assert registry.holders(2) == {"123"}
+    assert registry.holders(5) == set()
+
+
+def test_update_bitfield_reindexes(registry):
+    """Test that a bitfield update moves the peer between piece holder sets."""
+    assert registry.update_bitfield("123", Bitfield.from_string("101100"))
+    assert registry.holders(0) == {"123", "456"}
+    assert registry.holders(3) == {"123"}
+    assert registry.get("123").bitfield == Bitfield.from_string("101100")
+
+    assert registry.update_bitfield("123", Bitfield.from_string("000000"))
+    assert registry.holders(0) == {"456"}
+    assert registry.holders(2) == set()
+
+
+def test_update_unknown_peer(registry):
+    """Test that updating an unregistered peer is rejected."""
+    assert not registry.update_bitfield("999", Bitfield.from_string("111111"))
+    assert "999" not in registry
+
+
+def test_snapshot_is_unaffected_by_later_writes(registry):
+    """Test that a snapshot keeps its view while writers publish new ones."""
+    snapshot = registry.snapshot()
+    registry.register("789", "127.0.0.1", "62000", Bitfield.from_string("101001"))
+    registry.update_bitfield("123", Bitfield.from_string("111111"))
+
+    assert set(snapshot.peers) == {"123", "456"}
+    assert snapshot.peers["123"].bitfield == Bitfield.from_string("001100")
+    assert len(registry) == 3
+
+
+def test_concurrent_registration():
+    """Test that concurrent writers do not lose updates."""
+    registry = PeerRegistry()
+
+    def register(start):
+        for i in range(start, start + 200):
+            registry.register(str(i), "127.0.0.1", str(i), Bitfield.from_string("1"))
+
+    threads = [threading.Thread(target=register, args=(n * 200,)) for n in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(registry) == 1000
+    assert len(registry.holders(0)) == 1000
+
+
+def test_changes_since(registry):
+    """Test that a delta lists only the peers changed after a version."""
+    version = registry.version
+    assert registry.changes_since(version) == []
+
+    registry.update_bitfield("123", Bitfield.from_string("111100"))
+    registry.register("789", "127.0.0.1", "62000", Bitfield.from_string("101001"))
+    changes = registry.changes_since(version)
+    assert [peer_id for peer_id, _ in changes] == ["123", "789"]
+    assert changes[0][1].bitfield == Bitfield.from_string("111100")
+
+    # Re-announcing with nothing new does not produce a change
+    registry.register("789", "127.0.0.1", "62000", Bitfield.from_string("101001"))
+    assert registry.version == version + 2
+
+
+def test_changes_since_unknown_version(registry):
+    """Test that versions the registry never handed out require a full list."""
+    assert registry.changes_since(registry.version + 1) is None
+    assert registry.changes_since(-1) is None
+
+
+def test_silent_peers_expire():
+    """Test that peers not seen within the TTL become tombstones, then vanish."""
+    registry = PeerRegistry(ttl=10, tombstone_ttl=20)
+    registry.register("123", "127.0.0.1", "60000", Bitfield.from_string("01"), now=0)
+    registry.register("456", "127.0.0.1", "61000", Bitfield.from_string("11"), now=0)
+    assert registry.touch("456", now=8)
+
+    assert registry.expire(now=10) == ["123"]
+    assert "123" not in registry and "456" in registry
+    assert registry.holders(1) == {"456"}
+    # Peers that saw version 2 learn about the removal from the delta
+    assert [(peer_id, record.online) for peer_id, record in registry.changes_since(2)] == [("123", False)]
+    assert not registry.update_bitfield("123", Bitfield.from_string("11"))
+
+    assert registry.expire(now=18) == ["456"]
+    registry.expire(now=30)
+    assert list(registry.snapshot().peers) == ["456"]
+    # Too old to know what was dropped: fall back to the full list
+    assert registry.changes_since(2) is None
+    assert registry.changes_since(3) == [("456", registry.get("456"))]
+
+
+def test_deltas_older_than_the_history_need_a_full_list():
+    """Test that the changelog only serves deltas from its recent changes."""
+    registry = PeerRegistry(history=3)
+    for port in range(60000, 60005):
+        registry.register(str(port), "127.0.0.1", port, Bitfield.from_string("1"))
+
+    assert registry.changes_since(1) is None
+    assert [peer_id for peer_id, _ in registry.changes_since(2)] == ["60002", "60003", "60004"]
+    # More changes than the caller wants
+    assert registry.changes_since(2, limit=2) is None
+    # The full table is still there
+    assert list(registry.snapshot().peers) == [str(port) for port in range(60000, 60005)]
+
+
+def test_sample_draws_only_live_peers():
+    """Test that expired peers leave the sample right away."""
+    registry = PeerRegistry(ttl=10)
+    for port in range(60000, 60010):
+        registry.register(str(port), "127.0.0.1", port, Bitfield.from_string("1"), now=0)
+    for port in range(60000, 60005):
+        registry.touch(str(port), now=5)
+    registry.expire(now=12)
+
+    sampled = {peer_id for peer_id, _ in registry.sample(20)}
+    assert sampled == {str(port) for port in range(60000, 60005)}
+    assert registry.holders(0) == sampled
@@ -0,0 +1,45 @@
+import pytest
+from piece_cache import LFUCache, LRUCache, create_cache
+
+
+def test_lru_evicts_least_recently_served():
+    """Test that the LRU cache keeps within its byte budget."""
+    cache = LRUCache(10)
+    cache.put(0, b"aaaa")
+    cache.put(1, b"bbbb")
+    assert cache.get(0) == b"aaaa"
+    cache.put(2, b"cccc")
+
+    assert cache.get(1) is None
+    assert cache.get(0) == b"aaaa"
+    assert cache.get(2) == b"cccc"
+    assert cache.size == 8
+    assert (cache.hits, cache.misses, cache.evictions) == (3, 1, 1)
+
+
+def test_lfu_evicts_least_frequently_served():
+    """Test that the LFU cache keeps hot pieces over recent ones."""
+    cache = LFUCache(12)
+    cache.put(0, b"aaaa")
+    cache.put(1, b"bbbb")
+    cache.put(2, b"cccc")
+    for _ in range(3):
+        cache.get(0)
+    cache.get(2)
+    # Evicts 1 (served once), then the newcomer has the lowest count
+    cache.put(3, b"dddd")
+    cache.put(4, b"eeeeeeee")
+
+    assert cache.get(1) is None
+    assert cache.get(3) is None
+    assert cache.get(0) == b"aaaa"
+    assert cache.get(4) == b"eeeeeeee"
+    assert cache.size == 12
+
+
+def test_oversized_pieces_are_not_cached():
+    cache = create_cache("lru", 4)
+    cache.put(0, b"too large")
+    assert len(cache) == 0
+    with pytest.raises(ValueError):
+        create_cache("fifo", 4)
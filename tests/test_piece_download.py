@@ -0,0 +1,58 @@
+import asyncio
+
+from piece_download import PieceDownload
+
+
+def test_blocks_from_several_peers_fill_the_buffer():
+    """Test that peers taking turns on blocks assemble the whole piece."""
+    data = bytes(range(256)) * 4 + b"tail"
+
+    async def peer(download, name, delay, fail_first):
+        while not download.complete():
+            block = download.next_block()
+            if block is None:
+                await download.wait()
+                continue
+            begin, length = download.block_range(block)
+            await asyncio.sleep(delay)
+            write = download.block_writer(block)
+            if fail_first:
+                # Half a block, then the connection drops
+                write(data[begin : begin + length // 2])
+                fail_first = False
+                download.give_back(block)
+                continue
+            for offset in range(begin, begin + length, 100):
+                write(data[offset : min(offset + 100, begin + length)])
+            download.finish(block, name)
+
+    async def run():
+        download = PieceDownload(0, len(data), 256)
+        await asyncio.gather(
+            peer(download, "fast", 0, True), peer(download, "slow", 0.01, False)
+        )
+        return download
+
+    download = asyncio.run(run())
+
+    assert bytes(download.buffer) == data
+    assert download.block_range(4) == (1024, 4)
+    assert set(download.sources.values()) == {"fast", "slow"}
+
+
+def test_waiting_peer_takes_a_block_handed_back():
+    """Test that a block given back wakes peers waiting on the piece."""
+
+    async def run():
+        download = PieceDownload(0, 10, 16)
+        block = download.next_block()
+        waiter = asyncio.create_task(download.wait())
+        await asyncio.sleep(0)
+        download.give_back(block)
+        await asyncio.wait_for(waiter, 1)
+        return download
+
+    download = asyncio.run(run())
+
+    assert download.next_block() == 0
+    assert not download.complete()
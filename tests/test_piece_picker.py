@@ -0,0 +1,65 @@
+import pytest
+from bitfield import Bitfield
+from piece_picker import (
+    RandomFirstPicker,
+    RarestFirstPicker,
+    SequentialPicker,
+    create_picker,
+)
+
+
+@pytest.fixture
+def picker():
+    picker = RarestFirstPicker(6)
+    picker.update_peer("456", Bitfield.from_string("110010"))
+    picker.update_peer("789", Bitfield.from_string("101001"))
+    return picker
+
+
+def test_availability_updates_incrementally(picker):
+    """Test that availability follows bitfield changes and departures."""
+    assert picker.availability == [2, 1, 1, 0, 1, 1]
+    picker.update_peer("456", Bitfield.from_string("111010"))
+    assert picker.availability == [2, 1, 2, 0, 1, 1]
+    picker.remove_peer("789")
+    assert picker.availability == [1, 1, 1, 0, 1, 0]
+
+
+def test_pieces_past_the_end_are_not_counted(picker):
+    """Test that an over-long bitfield doesn't index past the availability."""
+    picker.update_peer("999", Bitfield.from_string("00000011"))
+    picker.update_peer("999", Bitfield.from_string("10000001"))
+    assert picker.availability == [3, 1, 1, 0, 1, 1]
+    picker.remove_peer("999")
+    assert picker.availability == [2, 1, 1, 0, 1, 1]
+
+
+def test_rarest_first(picker):
+    """Test that the least replicated piece is picked first."""
+    have = Bitfield.from_string("001100")
+    # Piece 0 is held by both peers, piece 1 only by 456
+    assert picker.pick(Bitfield.from_string("110000"), have) == 1
+    assert picker.pick(Bitfield.from_string("110000"), have, {1}) == 0
+    assert picker.pick(Bitfield.from_string("001100"), have) is None
+
+
+def test_sequential():
+    """Test that the sequential picker requests the lowest missing piece."""
+    picker = SequentialPicker(6)
+    have = Bitfield.from_string("100000")
+    assert picker.pick(Bitfield.from_string("111111"), have) == 1
+    assert picker.pick(Bitfield.from_string("111111"), have, {1, 2}) == 3
+
+
+def test_random_first_only_picks_candidates():
+    """Test that random-first picks only pieces the peer can give us."""
+    picker = create_picker("random", 6)
+    assert isinstance(picker, RandomFirstPicker)
+    have = Bitfield.from_string("000000")
+    theirs = Bitfield.from_string("010101")
+    assert {picker.pick(theirs, have) for _ in range(50)} <= {1, 3, 5}
+
+
+def test_unknown_picker():
+    with pytest.raises(ValueError):
+        create_picker("fastest", 6)
@@ -0,0 +1,94 @@
+import asyncio
+import io
+
+import pytest
+from protocol import (
+    HttpError,
+    RequestParser,
+    parse_request,
+    read_body,
+    read_response_head,
+)
+
+
+def make_reader(data):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+def test_read_binary_body():
+    """Test that a body with CRLFs and binary bytes is read in full."""
+    body = b"\x00\xff\r\n\r\nline\r\n" * 20000
+
+    async def run():
+        reader = make_reader(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: application/octet-stream\r\n"
+            + f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+        status, headers = await read_response_head(reader)
+        out = io.BytesIO()
+        await read_body(reader, int(headers["content-length"]), out.write)
+        return status, headers, out.getvalue()
+
+    status, headers, received = asyncio.run(run())
+    assert status == 200
+    assert headers["content-type"] == "application/octet-stream"
+    assert received == body
+
+
+def test_read_truncated_body():
+    """Test that a body cut short by the sender is reported, not accepted."""
+
+    async def run():
+        reader = make_reader(b"HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nabc")
+        _, headers = await read_response_head(reader)
+        await read_body(reader, int(headers["content-length"]), io.BytesIO().write)
+
+    with pytest.raises(asyncio.IncompleteReadError) as e:
+        asyncio.run(run())
+    assert e.value.expected == 7
+
+
+def test_request_parser_handles_split_and_pipelined_requests():
+    """Test that requests split at any byte, or sent back to back, parse whole."""
+    bitfield = "1" * 5000
+    data = (
+        f"GET /announce?peer_id=a%20b&bitfield={bitfield}&empty= HTTP/1.1\r\n"
+        "Connection: keep-alive\r\n\r\n"
+        "PUT /seeding?peer_id=x HTTP/1.1\r\nContent-Length: 3\r\n\r\nabc"
+    ).encode()
+    parser = RequestParser()
+    requests = []
+    for start in range(0, len(data), 7):
+        parser.feed(data[start : start + 7])
+        while (request := parser.next_request()) is not None:
+            requests.append(request)
+
+    assert [request.method for request in requests] == ["GET", "PUT"]
+    assert requests[0].path == "/announce"
+    assert requests[0].params == {"peer_id": "a b", "bitfield": bitfield, "empty": ""}
+    assert requests[0].headers["connection"] == "keep-alive"
+    assert requests[1].body == b"abc"
+    assert parser.buffer == bytearray()
+
+
+def test_request_parser_limits():
+    parser = RequestParser(max_head=64, max_body=8)
+    parser.feed(b"GET /" + b"a" * 100)
+    with pytest.raises(HttpError) as error:
+        parser.next_request()
+    assert error.value.status == 431
+
+    parser = RequestParser(max_head=64, max_body=8)
+    parser.feed(b"PUT / HTTP/1.1\r\nContent-Length: 9\r\n\r\n")
+    with pytest.raises(HttpError) as error:
+        parser.next_request()
+    assert error.value.status == 413
+
+    with pytest.raises(HttpError) as error:
+        parse_request(b"garbage\r\n\r\n")
+    assert error.value.status == 400
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import time
+from unittest.mock import AsyncMock, MagicMock
+
+from config import CONFIGS
+from protocol import send_view
+from rate_limit import RateLimiter, RateLimits, TokenBucket
+
+
+def test_bucket_goes_into_debt_and_refills():
+    """Test that takes beyond the tokens saved up are delayed by the rate."""
+    bucket = TokenBucket(1000)
+    bucket.updated = 0
+
+    # 0.1 seconds of refill caps at the 100 byte burst
+    assert bucket.take(100, now=1) == 0
+    assert bucket.take(50, now=1) == 0.05
+    assert bucket.take(50, now=1) == 0.1
+    # The debt is paid off as time passes
+    assert bucket.take(0, now=1.1) == 0
+
+    bucket.configure(0)
+    assert bucket.take(10**9) == 0
+
+
+def test_throttled_upload_is_paced_in_small_slices():
+    """Test that a limited transfer takes size / rate, written in even chunks."""
+    limiter = RateLimiter(rate=100000, peer_rate=20000)
+    writer = MagicMock()
+    writer.drain = AsyncMock()
+
+    async def run():
+        start = time.monotonic()
+        await send_view(writer, memoryview(bytes(4000)), limiter, "peer")
+        return time.monotonic() - start
+
+    elapsed = asyncio.run(run())
+
+    # 4000 bytes at 20000 bytes per second, the other peers' share untouched
+    assert 0.15 <= elapsed < 0.5
+    sizes = [len(call[0][0]) for call in writer.write.call_args_list]
+    assert set(sizes) == {1000}
+    assert limiter.bucket("other").take(0) == 0
+
+
+def test_peer_buckets_are_capped(monkeypatch):
+    """Test that busy peers can't grow the bucket table past its limit."""
+    monkeypatch.setitem(CONFIGS, "RATE_LIMIT_MAX_PEERS", 3)
+    limiter = RateLimiter(peer_rate=1000)
+    for peer in ("a", "b", "c"):
+        # In debt, so none of them is idle
+        limiter.bucket(peer).take(1000)
+    limiter.bucket("a")
+    limiter.bucket("d")
+
+    assert list(limiter.peers) == ["c", "a", "d"]
+
+
+def test_limits_are_reloaded_from_a_file(tmp_path):
+    """Test that the limits file changes the rates and bad files are ignored."""
+    path = tmp_path / "rate_limits.json"
+    limits = RateLimits()
+    assert not limits.reload(str(path))
+
+    path.write_text(json.dumps({"upload": 5000, "peer_download": 1000}))
+    assert limits.reload(str(path))
+    assert limits.upload.total.rate == 5000
+    assert limits.download.peer_rate == 1000
+    assert limits.upload.active() and limits.download.active()
+    # Unchanged since the last reload
+    assert not limits.reload(str(path))
+
+    path.write_text(json.dumps({"upload": -1}))
+    limits.mtime = None
+    assert not limits.reload(str(path))
+    assert limits.upload.total.rate == 5000
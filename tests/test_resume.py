@@ -0,0 +1,30 @@
+import os
+
+from bitfield import Bitfield
+from manifest import Manifest
+from resume import ResumeFile
+
+
+def make_resume(tmp_path):
+    (tmp_path / "a.bin").write_bytes(b"abcdefghij")
+    manifest = Manifest.create("test", ["a.bin"], 4, root=str(tmp_path))
+    return ResumeFile(str(tmp_path / "resume.json"), manifest, str(tmp_path))
+
+
+def test_saved_bitfield_is_loaded(tmp_path):
+    """Test that a saved bitfield is trusted while the files are unchanged."""
+    resume = make_resume(tmp_path)
+    assert resume.load() == (None, True)
+
+    resume.save(Bitfield.from_string("101"))
+    assert resume.load() == (Bitfield.from_string("101"), False)
+
+
+def test_changed_files_keep_saved_pieces(tmp_path):
+    """Test that modified files keep the saved pieces but flag the others."""
+    resume = make_resume(tmp_path)
+    resume.save(Bitfield.from_string("101"))
+    stat = os.stat(tmp_path / "a.bin")
+    os.utime(tmp_path / "a.bin", ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+    assert resume.load() == (Bitfield.from_string("101"), True)
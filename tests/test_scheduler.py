@@ -0,0 +1,265 @@
+import asyncio
+
+import pytest
+from bitfield import Bitfield
+from config import CONFIGS
+from piece_picker import RarestFirstPicker
+from scheduler import DownloadScheduler, PieceCorrupted
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setitem(CONFIGS, "RETRY_BACKOFF", 0.01)
+    monkeypatch.setitem(CONFIGS, "STARVED_REFRESH_DELAY", 0.01)
+    monkeypatch.setitem(CONFIGS, "MAX_REQUESTS_PER_PEER", 2)
+    monkeypatch.setitem(CONFIGS, "ENDGAME_PIECES", 0)
+
+
+def make_peers(picker, bits="111111"):
+    peers = [
+        {"peer id": "456", "ip": "127.0.0.1", "port": "61000",
+         "bitfield": Bitfield.from_string(bits)},
+        {"peer id": "789", "ip": "127.0.0.1", "port": "62000",
+         "bitfield": Bitfield.from_string(bits)},
+    ]
+    for peer in peers:
+        picker.update_peer(peer["peer id"], peer["bitfield"])
+    return peers
+
+
+def test_failed_pieces_are_retried():
+    """Test that a failed download is retried and in-flight requests are capped."""
+    bitfield = Bitfield(6)
+    picker = RarestFirstPicker(6)
+    peers = make_peers(picker)
+    attempts = []
+    in_flight = {"61000": 0, "62000": 0}
+    most_in_flight = []
+
+    async def fetch(ip, port, piece, endgame):
+        attempts.append(piece)
+        in_flight[port] += 1
+        most_in_flight.append(in_flight[port])
+        await asyncio.sleep(0.01)
+        in_flight[port] -= 1
+        if attempts.count(piece) == 1 and piece % 2:
+            raise ConnectionError("reset by peer")
+        bitfield[piece] = True
+        return True
+
+    async def refresh():
+        pass
+
+    asyncio.run(
+        DownloadScheduler(picker, bitfield, fetch, refresh, lambda: peers).run()
+    )
+
+    assert bitfield.complete()
+    assert sorted(attempts) == [0, 1, 1, 2, 3, 3, 4, 5, 5]
+    assert max(most_in_flight) <= 2
+
+
+def test_starved_scheduler_waits_for_refresh():
+    """Test that the tracker is not polled back-to-back when nobody has a piece."""
+    bitfield = Bitfield(1)
+    picker = RarestFirstPicker(1)
+    refreshes = []
+    peers = []
+
+    async def fetch(ip, port, piece, endgame):
+        bitfield[piece] = True
+        return True
+
+    async def refresh():
+        refreshes.append(asyncio.get_running_loop().time())
+        if len(refreshes) == 3:
+            peers.extend(make_peers(picker, "1"))
+
+    asyncio.run(
+        DownloadScheduler(picker, bitfield, fetch, refresh, lambda: peers).run()
+    )
+
+    assert bitfield.complete()
+    assert len(refreshes) == 3
+    assert refreshes[2] - refreshes[0] >= 0.02
+
+
+@pytest.mark.parametrize(
+    "error",
+    [ConnectionRefusedError("tracker down"), ValueError("bad peer list")],
+)
+def test_failed_refresh_is_retried(error):
+    """Test that an unreachable tracker or a bad answer doesn't stop the download."""
+    bitfield = Bitfield(1)
+    picker = RarestFirstPicker(1)
+    refreshes = []
+    peers = []
+
+    async def fetch(ip, port, piece, endgame):
+        bitfield[piece] = True
+        return True
+
+    async def refresh():
+        refreshes.append(asyncio.get_running_loop().time())
+        if len(refreshes) == 1:
+            raise error
+        peers.extend(make_peers(picker, "1"))
+
+    asyncio.run(
+        DownloadScheduler(picker, bitfield, fetch, refresh, lambda: peers).run()
+    )
+
+    assert bitfield.complete()
+    assert len(refreshes) == 2
+    assert refreshes[1] - refreshes[0] >= 0.01
+
+
+def test_corrupted_piece_is_fetched_from_another_peer():
+    """Test that a piece failing verification is not asked from its sender again."""
+    bitfield = Bitfield(1)
+    picker = RarestFirstPicker(1)
+    peers = make_peers(picker, "1")
+    senders = []
+
+    async def fetch(ip, port, piece, endgame):
+        senders.append(port)
+        if len(senders) == 1:
+            raise PieceCorrupted("bad hash")
+        bitfield[piece] = True
+        return True
+
+    async def refresh():
+        pass
+
+    asyncio.run(
+        DownloadScheduler(picker, bitfield, fetch, refresh, lambda: peers).run()
+    )
+
+    assert bitfield.complete()
+    assert len(senders) == 2 and senders[0] != senders[1]
+
+
+def test_endgame_cancels_the_slower_copy(monkeypatch, capsys):
+    """Test that the last piece is asked from every holder and the loser is cancelled."""
+    monkeypatch.setitem(CONFIGS, "ENDGAME_PIECES", 1)
+    bitfield = Bitfield(1)
+    picker = RarestFirstPicker(1)
+    peers = make_peers(picker, "1")
+    started = []
+    copies = []
+    cancelled = []
+
+    async def fetch(ip, port, piece, endgame):
+        started.append(port)
+        copies.append(endgame)
+        try:
+            # One peer stalls, the other answers quickly
+            await asyncio.sleep(10 if port == "61000" else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(port)
+            raise
+        bitfield[piece] = True
+        return True
+
+    async def refresh():
+        pass
+
+    async def run():
+        scheduler = DownloadScheduler(
+            picker, bitfield, fetch, refresh, lambda: peers
+        )
+        await asyncio.wait_for(scheduler.run(), 1)
+        # Let the cancelled copy clean up after itself
+        await asyncio.sleep(0)
+        return scheduler
+
+    scheduler = asyncio.run(run())
+
+    assert bitfield.complete()
+    assert sorted(started) == ["61000", "62000"]
+    # The first holder fetches the piece, the second sends its own copy
+    assert copies == [False, True]
+    assert cancelled == ["61000"]
+    assert scheduler.in_flight == {}
+    # Cancelled by the winning copy, not only by the scheduler finishing
+    assert "Cancelling the request of piece 0 from 456" in capsys.readouterr().out
+
+
+def test_idle_peer_joins_a_shared_piece():
+    """Test that a peer with nothing new to fetch helps with an open piece."""
+    bitfield = Bitfield(1)
+    picker = RarestFirstPicker(1)
+    peers = make_peers(picker, "1")
+    # Blocks of the piece nobody has asked for yet
+    open_blocks = [0, 1, 2, 3]
+    senders = {}
+    helpers = []
+
+    async def fetch(ip, port, piece, endgame):
+        assert not endgame
+        helpers.append(port)
+        while open_blocks:
+            senders[open_blocks.pop(0)] = port
+            await asyncio.sleep(0.01)
+        bitfield[piece] = True
+        return True
+
+    async def refresh():
+        pass
+
+    asyncio.run(
+        DownloadScheduler(
+            picker,
+            bitfield,
+            fetch,
+            refresh,
+            lambda: peers,
+            shareable=lambda piece: bool(open_blocks),
+        ).run()
+    )
+
+    assert bitfield.complete()
+    assert sorted(helpers) == ["61000", "62000"]
+    assert set(senders.values()) == {"61000", "62000"}
+
+
+def test_idle_peer_is_not_asked_again_until_something_changes():
+    """Test that a peer with nothing to give is skipped until its bitfield changes."""
+    bitfield = Bitfield.from_string("10")
+    picker = RarestFirstPicker(2)
+    peers = make_peers(picker, "10")
+    picks = []
+    pick = picker.pick
+
+    def counting_pick(*args):
+        picks.append(args[0])
+        return pick(*args)
+
+    picker.pick = counting_pick
+
+    async def fetch(ip, port, piece, endgame):
+        return True
+
+    async def refresh():
+        pass
+
+    async def run():
+        scheduler = DownloadScheduler(
+            picker, bitfield, fetch, refresh, lambda: peers
+        )
+        scheduler.wake = asyncio.Event()
+        scheduler.schedule()
+        scheduler.schedule()
+        assert len(picks) == 2
+        peers[0]["bitfield"] = Bitfield.from_string("11")
+        picker.update_peer("456", peers[0]["bitfield"])
+        scheduler.schedule()
+        # Only the peer that changed is asked again
+        assert len(picks) > 2
+        assert all(theirs is peers[0]["bitfield"] for theirs in picks[2:])
+        assert 1 in scheduler.in_flight
+        for copies in scheduler.in_flight.values():
+            for task in copies.values():
+                task.cancel()
+
+    asyncio.run(run())
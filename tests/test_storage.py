@@ -0,0 +1,76 @@
+import pytest
+from manifest import Manifest
+import storage as storage_module
+from storage import Storage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    manifest = Manifest("test", [("a.bin", 10), ("sub/b.bin", 7)], 4, b"\0" * 100)
+    storage = Storage(manifest, str(tmp_path))
+    storage.open()
+    yield storage
+    storage.close()
+
+
+def test_files_are_preallocated(storage, tmp_path):
+    """Test that the target files exist at full size before any piece arrives."""
+    assert (tmp_path / "a.bin").stat().st_size == 10
+    assert (tmp_path / "sub" / "b.bin").stat().st_size == 7
+    assert not storage.piece_on_disk(0)
+
+
+def test_pieces_are_written_at_their_offsets(storage, tmp_path):
+    """Test that pieces, including one spanning two files, land in place."""
+    storage.write(4, b"q")
+    storage.write(0, b"abcd")
+    # Piece 2 holds the last 2 bytes of a.bin and the first 2 of b.bin,
+    # written in two chunks as it would arrive from the network
+    write = storage.piece_writer(2)
+    write(b"ij")
+    write(b"kl")
+
+    assert (tmp_path / "a.bin").read_bytes() == b"abcd\0\0\0\0ij"
+    assert (tmp_path / "sub" / "b.bin").read_bytes() == b"kl\0\0\0\0q"
+    assert storage.read(2) == b"ijkl"
+    assert storage.read(2, 1, 2) == b"jk"
+    assert storage.read(4) == b"q"
+
+
+def test_piece_views_share_refcounted_maps(storage, tmp_path):
+    """Test that mapped views see written pieces and outlive a closed torrent."""
+    storage.write(2, b"ijkl")
+    mapped = storage.mapped[0]
+    assert mapped.refs == 1
+
+    with storage.piece_views(2) as views:
+        assert [bytes(view) for view in views] == [b"ij", b"kl"]
+        assert mapped.refs == 2
+        # Stopping the torrent mid-transfer keeps the map until it is done
+        storage.close()
+        assert mapped.map is not None
+        assert bytes(views[0]) == b"ij"
+
+    assert mapped.map is None
+    assert str(tmp_path / "a.bin") not in storage_module._mapped_files
+
+
+def test_piece_views_of_a_block(storage):
+    """Test that a block crossing a file boundary maps to both files."""
+    storage.write(2, b"ijkl")
+
+    with storage.piece_views(2, 1, 2) as views:
+        assert [bytes(view) for view in views] == [b"j", b"k"]
+
+
+def test_verify_checks_piece_hashes(tmp_path):
+    """Test that pieces are checked against the manifest hashes."""
+    data = b"abcdefghij"
+    (tmp_path / "a.bin").write_bytes(data)
+    manifest = Manifest.create("test", ["a.bin"], 4, root=str(tmp_path))
+    storage = Storage(manifest, str(tmp_path))
+    storage.open()
+    storage.write(1, b"XXXX")
+
+    assert [storage.verify(piece) for piece in range(3)] == [True, False, True]
+    storage.close()
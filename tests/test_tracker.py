@@ -1,5 +1,10 @@
+import asyncio
+
 import pytest
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock
+from bitfield import Bitfield
+from config import CONFIGS
+from protocol import HttpError
 from tracker import Tracker
 
 
@@ -133,3 +138,190 @@ def test_handle_get_request_missing_peer_id(mock_conn):
     tracker.send_http_response.assert_called_with(
         mock_conn, 400, {"error": "Bad Request, missing parameters"}
     )
+
+
+def test_handle_peer_async(mock_peer_data):
+    """Test that the asyncio server mode shares the request handlers."""
+    request = (
+        f"GET /announce?peer_id={mock_peer_data['id']}&peer_ip_address={mock_peer_data['ip_address']}"
+        f"&peer_port={mock_peer_data['port']}&bitfield={mock_peer_data['bitfield']} HTTP/1.1\r\n"
+        "Host: 127.0.0.1:8888\r\n"
+        "Connection: close\r\n"
+        "\r\n"
+    )
+
+    tracker = Tracker()
+    tracker.register_peer("peer456", "192.168.1.2", "6882", Bitfield.from_string("11111111"))
+
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(request.encode())
+        reader.feed_eof()
+        writer = MagicMock()
+        writer.drain = AsyncMock()
+        await tracker.handle_peer_async(reader, writer)
+        return writer
+
+    writer = asyncio.run(run())
+
+    response = writer.write.call_args[0][0].decode()
+    assert response.startswith("HTTP/1.1 200 OK\r\n")
+    assert "peer id: peer456, ip: 192.168.1.2, port: 6882" in response
+    # The requester is not sent back to itself
+    assert "peer id: peer123" not in response
+    writer.close.assert_called_once()
+
+
+def test_handle_peer_async_keep_alive(mock_peer_data):
+    """Test that a keep-alive connection serves several requests."""
+    query = (
+        f"peer_id={mock_peer_data['id']}&peer_ip_address={mock_peer_data['ip_address']}"
+        f"&peer_port={mock_peer_data['port']}&bitfield={mock_peer_data['bitfield']}"
+    )
+
+    async def run():
+        reader = asyncio.StreamReader()
+        writer = MagicMock()
+        writer.drain = AsyncMock()
+
+        async def send(path, connection):
+            sent = writer.write.call_count
+            reader.feed_data(
+                f"{path}?{query} HTTP/1.1\r\nConnection: {connection}\r\n\r\n".encode()
+            )
+            # Wait for the answer before sending the next request
+            while writer.write.call_count == sent:
+                await asyncio.sleep(0)
+
+        handler = asyncio.create_task(Tracker().handle_peer_async(reader, writer))
+        await send("GET /announce", "keep-alive")
+        await send("PUT /seeding", "close")
+        await handler
+        return writer
+
+    writer = asyncio.run(run())
+
+    responses = [call[0][0].decode() for call in writer.write.call_args_list]
+    assert len(responses) == 2
+    assert "Connection: keep-alive\r\n" in responses[0]
+    assert "Connection: close\r\n" in responses[1]
+    writer.close.assert_called_once()
+
+
+def test_peer_list_is_capped_and_favours_useful_peers():
+    """Test that numwant bounds the list and peers with missing pieces come first."""
+    tracker = Tracker()
+    for index in range(20):
+        tracker.register_peer(str(index), "127.0.0.1", 60000 + index, Bitfield.from_string("10"))
+    tracker.register_peer("seed", "127.0.0.1", 61000, Bitfield.from_string("11"))
+
+    text = tracker.peer_list_text(numwant=5, requester="0", have=Bitfield.from_string("10"))
+
+    lines = [line for line in text.splitlines() if line.startswith("peer id:")]
+    assert len(lines) == 5
+    assert lines[0].startswith("peer id: seed,")
+    assert lines[0].endswith(", bitfield: 11, pieces: 2")
+    assert not any(line.startswith("peer id: 0,") for line in lines)
+
+
+def test_torrents_keep_separate_peer_lists(mock_conn):
+    """Test that peers are listed only to peers of the same info hash."""
+    tracker = Tracker()
+    tracker.send_http_response = MagicMock()
+    first, second = "a" * 40, "b" * 40
+
+    for info_hash, peer_id in ((first, "1"), (second, "2"), (first, "3")):
+        tracker.handle_get_request(
+            mock_conn,
+            f"GET /announce?info_hash={info_hash}&peer_id={peer_id}&peer_ip_address=127.0.0.1"
+            f"&peer_port=6881&bitfield=01 HTTP/1.1\r\n\r\n",
+        )
+
+    status, text = tracker.send_http_response.call_args[0][1:]
+    assert status == 200
+    assert "peer id: 1," in text
+    assert "peer id: 2," not in text
+    assert "1" not in tracker.peers
+
+    tracker.handle_get_request(
+        mock_conn,
+        "GET /announce?info_hash=nothex&peer_id=4&peer_ip_address=127.0.0.1"
+        "&peer_port=6881&bitfield=01 HTTP/1.1\r\n\r\n",
+    )
+    assert tracker.send_http_response.call_args[0][1] == 400
+
+
+@pytest.mark.parametrize("port", ["abc", "0", "70000"])
+def test_invalid_peer_port_is_rejected(mock_conn, port):
+    """Test that a peer can't register a port the compact list can't pack."""
+    tracker = Tracker()
+    tracker.send_http_response = MagicMock()
+
+    tracker.handle_get_request(
+        mock_conn,
+        f"GET /announce?peer_id=1&peer_ip_address=127.0.0.1&peer_port={port}"
+        "&bitfield=01 HTTP/1.1\r\n\r\n",
+    )
+
+    tracker.send_http_response.assert_called_with(
+        mock_conn, 400, {"error": "Bad Request, invalid peer_port"}
+    )
+    assert "1" not in tracker.peers
+
+
+def test_torrent_limit(monkeypatch):
+    """Test that a node tracks at most MAX_TORRENTS torrents."""
+    monkeypatch.setitem(CONFIGS, "MAX_TORRENTS", 2)
+    tracker = Tracker()
+    tracker.torrent("a" * 40)
+    with pytest.raises(HttpError) as error:
+        tracker.torrent("b" * 40)
+    assert error.value.status == 503
+    assert len(tracker.torrents) == 2
+
+
+def test_only_announces_add_torrents(mock_conn):
+    """Test that requests other than announces can't create a torrent."""
+    tracker = Tracker()
+    tracker.send_http_response = MagicMock()
+    query = (
+        f"info_hash={'c' * 40}&peer_id=1&peer_ip_address=127.0.0.1"
+        "&peer_port=6881&bitfield=01"
+    )
+
+    tracker.handle_get_request(mock_conn, f"GET /peer?{query} HTTP/1.1\r\n\r\n")
+    assert tracker.send_http_response.call_args[0][1] == 400
+    tracker.handle_put_request(mock_conn, f"PUT /seeding?{query} HTTP/1.1\r\n\r\n")
+    assert tracker.send_http_response.call_args[0][1] == 400
+    assert "c" * 40 not in tracker.torrents
+
+    tracker.handle_get_request(mock_conn, f"GET /announce?{query} HTTP/1.1\r\n\r\n")
+    assert tracker.send_http_response.call_args[0][1] == 200
+    assert "1" in tracker.torrents["c" * 40]
+
+
+def test_empty_torrents_are_dropped(tmp_path, monkeypatch):
+    """Test that a torrent and its state go once its last peer is purged."""
+    monkeypatch.setitem(CONFIGS, "TRACKER_STATE_DIR", str(tmp_path))
+    monkeypatch.setitem(CONFIGS, "PEER_TTL", 0)
+    monkeypatch.setitem(CONFIGS, "TOMBSTONE_TTL", 0)
+    info_hash = "d" * 40
+    junk = tmp_path / "torrents" / ("e" * 40)
+    junk.mkdir(parents=True)
+    tracker = Tracker()
+    tracker.open_store()
+    # Left empty on disk, it isn't loaded again
+    assert "e" * 40 not in tracker.torrents
+    assert not junk.exists()
+
+    tracker.announce_peer(
+        info_hash, "1", "127.0.0.1", 6881, Bitfield.from_string("01")
+    )
+    directory = tmp_path / "torrents" / info_hash
+    assert directory.exists()
+    tracker.expire_peers()
+
+    assert info_hash not in tracker.torrents
+    assert not directory.exists()
+    assert "" in tracker.torrents
+    tracker.close_stores()
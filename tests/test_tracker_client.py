@@ -0,0 +1,107 @@
+import asyncio
+import socket
+
+from config import CONFIGS
+from tracker import Tracker
+from tracker_client import TrackerSession
+
+
+def test_session_fails_over_to_the_next_node():
+    """Test that a session whose tracker node is down asks the next one."""
+    # A port nothing listens on
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        dead_port = sock.getsockname()[1]
+    failed_over = []
+
+    async def run():
+        server = await asyncio.start_server(
+            Tracker().handle_peer_async, "127.0.0.1", 0
+        )
+        port = server.sockets[0].getsockname()[1]
+        session = TrackerSession(
+            "127.0.0.1", dead_port, fallbacks=[("127.0.0.1", port)]
+        )
+        session.on_fail_over = lambda: failed_over.append(session.port)
+        response = await session.request(
+            "GET",
+            lambda: "/announce?peer_id=1&peer_ip_address=127.0.0.1&peer_port=6881&bitfield=01",
+        )
+        session.close()
+        server.close()
+        await server.wait_closed()
+        return port, response
+
+    port, (status, body) = asyncio.run(run())
+
+    assert status == 200
+    assert body.startswith("version: 1")
+    assert failed_over == [port]
+
+
+def test_session_returns_to_the_first_node(monkeypatch):
+    """Test that a failed-over session goes back to its node once it is up."""
+    monkeypatch.setitem(CONFIGS, "TRACKER_FAILBACK_INTERVAL", 0)
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        owner_port = sock.getsockname()[1]
+    path = "/announce?peer_id=1&peer_ip_address=127.0.0.1&peer_port=6881&bitfield=01"
+    switches = []
+
+    async def run():
+        fallback = await asyncio.start_server(
+            Tracker().handle_peer_async, "127.0.0.1", 0
+        )
+        port = fallback.sockets[0].getsockname()[1]
+        session = TrackerSession(
+            "127.0.0.1", owner_port, fallbacks=[("127.0.0.1", port)]
+        )
+        session.on_fail_over = lambda: switches.append(session.port)
+        await session.request("GET", path)
+        # The owner comes back
+        owner = await asyncio.start_server(
+            Tracker().handle_peer_async, "127.0.0.1", owner_port
+        )
+        status, _ = await session.request("GET", path)
+        session.close()
+        for server in (fallback, owner):
+            server.close()
+            await server.wait_closed()
+        return port, status, session.node
+
+    port, status, node = asyncio.run(run())
+
+    assert status == 200
+    assert switches == [port, owner_port]
+    assert node == 0
+
+
+def test_session_fails_over_from_a_silent_node(monkeypatch):
+    """Test that a node accepting requests but never answering times out."""
+    monkeypatch.setitem(CONFIGS, "REQUEST_TIMEOUT", 0.2)
+    path = "/announce?peer_id=1&peer_ip_address=127.0.0.1&peer_port=6881&bitfield=01"
+
+    async def silent(reader, writer):
+        await reader.read()
+
+    async def run():
+        stuck = await asyncio.start_server(silent, "127.0.0.1", 0)
+        server = await asyncio.start_server(
+            Tracker().handle_peer_async, "127.0.0.1", 0
+        )
+        session = TrackerSession(
+            "127.0.0.1",
+            stuck.sockets[0].getsockname()[1],
+            fallbacks=[("127.0.0.1", server.sockets[0].getsockname()[1])],
+        )
+        status, _ = await asyncio.wait_for(session.request("GET", path), 5)
+        node = session.node
+        session.close()
+        for each in (stuck, server):
+            each.close()
+        return status, node
+
+    status, node = asyncio.run(run())
+
+    assert status == 200
+    assert node == 1
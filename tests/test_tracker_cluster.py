@@ -0,0 +1,80 @@
+import multiprocessing
+import threading
+import time
+
+from bitfield import Bitfield
+from config import CONFIGS
+from tracker import Tracker
+from tracker_cluster import ReplicaSet, ReplicationHub
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_replicas_follow_the_primary():
+    """Test that writes through any replica reach every replica with one version."""
+    tracker = Tracker()
+    primary = tracker.peers
+    primary.register("123", "127.0.0.1", 60000, Bitfield.from_string("01"), now=0)
+    hub = ReplicationHub(tracker)
+    replica_sets = []
+    for _ in range(2):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        hub.add_worker(parent_conn)
+        replica_set = ReplicaSet(child_conn)
+        threading.Thread(target=replica_set.follow, daemon=True).start()
+        replica_sets.append(replica_set)
+    replicas = [replica_set.replica("") for replica_set in replica_sets]
+    serving = threading.Thread(target=hub.serve, daemon=True)
+    serving.start()
+
+    replicas[0].register("456", "127.0.0.1", 61000, Bitfield.from_string("11"))
+    wait_for(lambda: all("456" in replica for replica in replicas))
+    assert replicas[1].update_bitfield("456", Bitfield.from_string("10"))
+    wait_for(lambda: all(replica.version == 3 for replica in replicas))
+
+    assert replicas[0].holders(0) == {"456"}
+    assert replicas[1].changes_since(1) == primary.changes_since(1)
+    # Expiry happens on the primary only
+    assert replicas[0].expire() == []
+    primary.expire(now=1000)
+    wait_for(lambda: "123" not in replicas[1])
+
+    # A torrent first seen by one worker shows up in every worker
+    info_hash = "ab" * 20
+    replica_sets[1].replica(info_hash).register(
+        "789", "127.0.0.1", 62000, Bitfield.from_string("10")
+    )
+    wait_for(lambda: "789" in replica_sets[0].replica(info_hash))
+    assert "789" in tracker.torrent(info_hash)
+    assert "789" not in replicas[0]
+
+
+def test_workers_drop_torrents_with_the_primary(monkeypatch):
+    """Test that a torrent dropped by the primary is dropped by the workers."""
+    monkeypatch.setitem(CONFIGS, "PEER_TTL", 0)
+    monkeypatch.setitem(CONFIGS, "TOMBSTONE_TTL", 0)
+    tracker = Tracker()
+    hub = ReplicationHub(tracker)
+    parent_conn, child_conn = multiprocessing.Pipe()
+    hub.add_worker(parent_conn)
+    replica_set = ReplicaSet(child_conn)
+    worker = Tracker(registry_factory=replica_set.replica)
+    replica_set.lookup = worker.torrent
+    replica_set.on_drop = worker.drop_torrent
+    threading.Thread(target=replica_set.follow, daemon=True).start()
+    info_hash = "ab" * 20
+
+    tracker.announce_peer(
+        info_hash, "123", "127.0.0.1", 60000, Bitfield.from_string("01")
+    )
+    wait_for(lambda: "123" in worker.torrents.get(info_hash, ()))
+    tracker.expire_peers()
+
+    wait_for(lambda: info_hash not in worker.torrents)
+    assert info_hash not in replica_set.replicas
+    assert info_hash not in tracker.torrents
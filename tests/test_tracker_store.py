@@ -0,0 +1,72 @@
+import json
+
+from bitfield import Bitfield
+from config import CONFIGS
+from peer_registry import PeerRegistry
+from tracker_store import LogFiles, RegistryStore
+
+
+def reopen(directory):
+    registry = PeerRegistry()
+    store = RegistryStore(str(directory), registry)
+    store.open()
+    return registry, store
+
+
+def test_registry_is_recovered_from_the_log(tmp_path):
+    """Test that changes logged before a crash are replayed on restart."""
+    registry, store = reopen(tmp_path)
+    registry.register("123", "127.0.0.1", 60000, Bitfield.from_string("110"))
+    registry.register("456", "127.0.0.1", 61000, Bitfield.from_string("001"))
+    registry.update_bitfield("123", Bitfield.from_string("111"))
+    # No close: the log is all that is left
+
+    recovered, store = reopen(tmp_path)
+    assert recovered.version == 3
+    assert list(recovered.snapshot().peers) == ["456", "123"]
+    assert recovered.get("123").bitfield == Bitfield.from_string("111")
+    assert recovered.holders(2) == {"123", "456"}
+    assert [peer_id for peer_id, _ in recovered.changes_since(2)] == ["123"]
+    store.close()
+
+
+def test_snapshot_bounds_the_log(tmp_path, monkeypatch):
+    """Test that a full log is folded into a snapshot."""
+    monkeypatch.setitem(CONFIGS, "WAL_MAX_ENTRIES", 2)
+    registry, store = reopen(tmp_path)
+    for port in range(60000, 60005):
+        registry.register(str(port), "127.0.0.1", port, Bitfield(3))
+    # Let the background snapshot finish
+    store.compact()
+    store.close()
+
+    with open(tmp_path / "snapshot.json") as infile:
+        assert json.load(infile)["version"] == 5
+    # The log is only created again by the next change
+    assert not (tmp_path / "tracker.wal").exists()
+
+    recovered, store = reopen(tmp_path)
+    assert len(recovered) == 5 and recovered.version == 5
+    store.close()
+
+
+def test_log_files_stay_under_the_limit(tmp_path):
+    """Test that stores sharing LogFiles keep few files open."""
+    log_files = LogFiles(2)
+    stores = []
+    for index in range(4):
+        registry = PeerRegistry()
+        store = RegistryStore(str(tmp_path / str(index)), registry, log_files)
+        store.open()
+        registry.register("123", "127.0.0.1", 60000, Bitfield(3))
+        stores.append((registry, store))
+        assert len(log_files.files) <= 2
+    # A closed log is opened again for the next change
+    stores[0][0].update_bitfield("123", Bitfield.from_string("111"))
+    for _, store in stores:
+        store.close()
+    assert not log_files.files
+
+    recovered, store = reopen(tmp_path / "0")
+    assert recovered.get("123").bitfield == Bitfield.from_string("111")
+    store.close()
@@ -1,3 +1,6 @@
+import asyncio
+import os
+import shutil
 import socket
 import threading
 from collections import defaultdict
@@ -5,16 +8,210 @@ import sys
 import json
 import time
 
+from bitfield import Bitfield
 from config import CONFIGS
+from peer_list import encode_compact
+from peer_registry import PeerRegistry
+from protocol import HttpError, RequestParser, parse_request
+from tracker_store import LogFiles, RegistryStore
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+# Torrent of the requests that don't send an info_hash
+DEFAULT_TORRENT = ""
+
+
+def valid_info_hash(info_hash):
+    """Return True for a hex SHA-1 digest, as Manifest.info_hash gives."""
+    return len(info_hash) == 40 and all(
+        c in "0123456789abcdef" for c in info_hash
+    )
+
+
+def valid_port(port):
+    """Return True for a TCP port number a peer can listen on."""
+    return port.isdigit() and 1 <= int(port) <= 65535
+
+
+def wants_keep_alive(request):
+    """Return True if the request asks to keep the connection open."""
+    return request.headers.get("connection", "").lower() == "keep-alive"
+
+
+class SocketConnection:
+    """A peer's socket together with whether it stays open between requests."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.keep_alive = False
+
+    def recv(self, size):
+        return self.sock.recv(size)
+
+    def recv_into(self, buffer):
+        return self.sock.recv_into(buffer)
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+
+    def close(self):
+        self.sock.close()
+
+
+class StreamConnection:
+    """Wrap an asyncio StreamWriter so the request handlers can use it like a socket."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.keep_alive = False
+
+    def sendall(self, data):
+        self.writer.write(data)
+
+    def close(self):
+        self.writer.close()
 
 
 class Tracker:
-    def __init__(self):
+    def __init__(self, registry_factory=None):
         self.host = CONFIGS["TRACKER_HOST"]
         self.port = CONFIGS["TRACKER_PORT"]
-        self.peers = {}
+        # Called with an info hash to create that torrent's registry,
+        # instead of a plain PeerRegistry
+        self.registry_factory = registry_factory
+        # Called with (info hash, registry) for every new torrent
+        self.on_new_torrent = None
+        # Called with the info hash of every dropped torrent
+        self.on_drop_torrent = None
+        # Registry of every torrent, by info hash
+        self.torrents = {}
+        self.torrents_lock = threading.Lock()
+        # Store of every torrent, once open_store has been called
+        self.stores = None
+        # Logs of those stores, only a few of them open at a time
+        self.log_files = LogFiles(CONFIGS["WAL_OPEN_FILES"])
+        self.server_socket = None
+        self.peers = self.torrent(DEFAULT_TORRENT)
+
+    def torrent(self, info_hash, create=True):
+        """Return the registry of a torrent, creating it on first use.
+
+        Without `create`, an unknown torrent raises HttpError 400 instead.
+        """
+        registry = self.torrents.get(info_hash)
+        if registry is not None:
+            return registry
+        with self.torrents_lock:
+            registry = self.torrents.get(info_hash)
+            if registry is not None:
+                return registry
+            if not create:
+                raise HttpError(400, "Unknown torrent, announce it first")
+            if len(self.torrents) >= CONFIGS["MAX_TORRENTS"]:
+                raise HttpError(503, "Too many torrents")
+            if self.registry_factory is not None:
+                registry = self.registry_factory(info_hash)
+            else:
+                registry = PeerRegistry(
+                    CONFIGS["PEER_TTL"], CONFIGS["TOMBSTONE_TTL"]
+                )
+            if self.stores is not None:
+                self.open_torrent_store(info_hash, registry)
+            self.torrents[info_hash] = registry
+            if self.on_new_torrent is not None:
+                self.on_new_torrent(info_hash, registry)
+            return registry
+
+    def request_info_hash(self, params):
+        """Return the info_hash parameter, checked and in lower case."""
+        info_hash = params.get("info_hash", DEFAULT_TORRENT).lower()
+        if info_hash != DEFAULT_TORRENT and not valid_info_hash(info_hash):
+            raise HttpError(400, "Bad Request, invalid info_hash")
+        return info_hash
+
+    def request_torrent(self, params):
+        """Return the registry of the torrent named by the info_hash parameter.
+
+        Only announces add torrents, see `announce_peer`.
+        """
+        return self.torrent(self.request_info_hash(params), create=False)
+
+    def announce_peer(self, info_hash, id, ip, port, bitfield):
+        """Register a peer with its torrent, creating the torrent if needed.
+
+        Returns the torrent's registry.
+        """
+        while True:
+            registry = self.torrent(info_hash)
+            self.register_peer(id, ip, port, bitfield, registry)
+            if self.torrents.get(info_hash) is registry:
+                return registry
+            # Dropped as empty just before the peer joined it
 
-        # Init TCP socket
+    def drop_torrent(self, info_hash):
+        """Forget a torrent with no peers or tombstones left.
+
+        Its state on disk goes too, so MAX_TORRENTS only counts torrents
+        with a swarm. Returns True if the torrent was dropped.
+        """
+        if info_hash == DEFAULT_TORRENT:
+            return False
+        with self.torrents_lock:
+            registry = self.torrents.get(info_hash)
+            if registry is None:
+                return False
+            # Peers joining meanwhile wait, and then see it's gone
+            with registry.locked_snapshot() as snapshot:
+                if snapshot.peers:
+                    return False
+                del self.torrents[info_hash]
+            store = (self.stores or {}).pop(info_hash, None)
+            if store is not None:
+                store.close()
+                shutil.rmtree(store.directory, ignore_errors=True)
+            # Under the lock, so listeners hear of the drop before the
+            # torrent can come back
+            if self.on_drop_torrent is not None:
+                self.on_drop_torrent(info_hash)
+        return True
+
+    def store_directory(self, info_hash):
+        if info_hash == DEFAULT_TORRENT:
+            return CONFIGS["TRACKER_STATE_DIR"]
+        return os.path.join(CONFIGS["TRACKER_STATE_DIR"], "torrents", info_hash)
+
+    def open_store(self):
+        """Recover every torrent's registry from disk and persist their changes."""
+        self.stores = {}
+        for info_hash, registry in list(self.torrents.items()):
+            self.open_torrent_store(info_hash, registry)
+        directory = os.path.join(CONFIGS["TRACKER_STATE_DIR"], "torrents")
+        if os.path.isdir(directory):
+            for info_hash in sorted(os.listdir(directory)):
+                if valid_info_hash(info_hash):
+                    # Left behind empty, e.g. by a crash before it was
+                    # dropped
+                    self.torrent(info_hash)
+                    self.drop_torrent(info_hash)
+
+    def open_torrent_store(self, info_hash, registry):
+        store = RegistryStore(
+            self.store_directory(info_hash), registry, self.log_files
+        )
+        store.open()
+        self.stores[info_hash] = store
+
+    def close_stores(self):
+        for store in (self.stores or {}).values():
+            store.close()
+        self.log_files.close_all()
+
+    def listen(self):
+        """Bind the blocking TCP socket used by the threaded server."""
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.bind((self.host, self.port))
         self.server_socket.listen(CONFIGS["MAX_CONNECTIONS"])
@@ -45,63 +242,232 @@ class Tracker:
         status_messages = {
             200: "OK",
             400: "Bad request",
+            413: "Payload Too Large",
+            431: "Request Header Fields Too Large",
             500: "Internal Server Error",
+            501: "Not Implemented",
+            503: "Service Unavailable",
         }
         status_message = status_messages.get(status_code, "OK")
+        keep_alive = (
+            isinstance(conn, (SocketConnection, StreamConnection))
+            and conn.keep_alive
+        )
 
-        # Determine if the response should be JSON or plain text
+        # Determine if the response should be JSON, binary or plain text
         if isinstance(content, dict):
             # JSON response
-            response_body = json.dumps(content)
+            response_body = json.dumps(content).encode()
             content_type = "application/json"
+        elif isinstance(content, bytes):
+            # Compact peer list
+            response_body = content
+            content_type = "application/octet-stream"
         else:
             # Plain text response
-            response_body = content
+            response_body = content.encode()
             content_type = "text/plain"
 
         response = (
             f"HTTP/1.1 {status_code} {status_message}\r\n"
             f"Content-Type: {content_type}\r\n"
             f"Content-Length: {len(response_body)}\r\n"
-            "Connection: close\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
             "\r\n"
-            f"{response_body}"
         )
-        conn.sendall(response.encode())
+        conn.sendall(response.encode() + response_body)
         print(
             f"Time send response: {time.ctime(time.time())}, {round(time.time() * 1000)}"
         )
 
-    def register_peer(self, id, ip, port, bitfield):
+    def register_peer(self, id, ip, port, bitfield, registry=None):
         if id:
-            self.peers[id] = {
-                "ip": ip,
-                "port": port,
-                "bitfield": bitfield,
-                "online": True,
-            }
+            if registry is None:
+                registry = self.peers
+            registry.register(id, ip, port, bitfield)
             print(
                 f"Registered peer: {id} at {ip}:{port} with bitfield {bitfield}."
             )
 
+    def decode_bitfield(self, params):
+        """Decode the bitfield query parameter into a Bitfield.
+
+        Peers send either an ASCII "010110" string, or a packed bitfield in
+        hex or base64 along with its number of pieces.
+        """
+        pieces = params.get("pieces")
+        return Bitfield.decode(
+            params["bitfield"],
+            int(pieces) if pieces else None,
+            params.get("encoding", "ascii"),
+        )
+
+    def numwant(self, params):
+        """Return how many peers to send, capped by MAX_NUMWANT."""
+        numwant = params.get("numwant", "")
+        if not numwant.isdigit():
+            return CONFIGS["DEFAULT_NUMWANT"]
+        return min(int(numwant), CONFIGS["MAX_NUMWANT"])
+
+    def select_peers(
+        self, since=None, numwant=None, requester=None, have=None, registry=None
+    ):
+        """Choose the peers to send back.
+
+        When the peer sends the registry version it last saw, only the peers
+        that changed after it are listed. Otherwise, or when that delta is
+        unknown or longer than `numwant`, a random sample of at most
+        `numwant` peers is sent, favouring peers that have pieces missing
+        from the requester's bitfield `have`. The requester itself is never
+        listed. `registry` is the torrent's registry, the default torrent's
+        if not given.
+
+        Returns (version, since, peers, removed): `since` is None for a full
+        list, `peers` holds (peer id, record) pairs and `removed` the ids of
+        peers expired since then.
+        """
+        if numwant is None:
+            numwant = CONFIGS["DEFAULT_NUMWANT"]
+        if registry is None:
+            registry = self.peers
+        # Read before the peers, so a change made meanwhile is listed again
+        # in the next delta rather than missed
+        version = registry.version
+        changes = None
+        if since is not None:
+            changes = registry.changes_since(since, numwant)
+        if changes is None:
+            changes = registry.sample(numwant, requester, have)
+            since = None
+        peers = []
+        removed = []
+        for id, peer in changes:
+            if id == requester:
+                continue
+            if peer.online:
+                peers.append((id, peer))
+            elif since is not None:
+                # Tell the peer to forget an expired peer it may still list
+                removed.append(id)
+        return version, since, peers, removed
+
+    def peer_list_text(
+        self,
+        since=None,
+        encoding="ascii",
+        numwant=None,
+        requester=None,
+        have=None,
+        registry=None,
+    ):
+        """Format the peer list as one line per peer.
+
+        Bitfields are sent back in the encoding the peer used, with their
+        number of pieces, as hex and base64 don't carry it.
+        """
+        version, since, peers, removed = self.select_peers(
+            since, numwant, requester, have, registry
+        )
+        lines = [
+            f"version: {version}",
+            f"interval: {CONFIGS['ANNOUNCE_INTERVAL']}",
+        ]
+        if since is not None:
+            lines.append(f"delta: {since}")
+        lines.extend(
+            f"peer id: {id}, ip: {peer.ip}, port: {peer.port}, bitfield: {peer.bitfield.encode(encoding)}, pieces: {len(peer.bitfield)}"
+            for id, peer in peers
+        )
+        lines.extend(f"removed: {id}" for id in removed)
+        return "\n".join(lines)
+
+    def peer_list_response(self, params, since, requester, have, registry=None):
+        """Return the peer list in the format the peer asked for.
+
+        Peers sending `compact=1` get the packed binary list of peer_list.py,
+        everyone else the text lines.
+        """
+        numwant = self.numwant(params)
+        if params.get("compact") == "1":
+            version, since, peers, removed = self.select_peers(
+                since, numwant, requester, have, registry
+            )
+            return encode_compact(
+                version, CONFIGS["ANNOUNCE_INTERVAL"], since, peers, removed
+            )
+        return self.peer_list_text(
+            since,
+            params.get("encoding", "ascii"),
+            numwant,
+            requester,
+            have,
+            registry,
+        )
+
     def handle_peer(self, conn, addr):
-        """Handle individual peer connections."""
+        """Handle individual peer connections.
+
+        A peer that sends "Connection: keep-alive" can keep sending requests
+        on the same connection until it closes it or stays idle too long.
+        """
+        conn = SocketConnection(conn)
+        conn.sock.settimeout(CONFIGS["KEEP_ALIVE_TIMEOUT"])
+        parser = RequestParser()
+        # Received bytes land in the same buffer for the whole connection
+        buffer = bytearray(CONFIGS["BUFFER_SIZE"])
+        view = memoryview(buffer)
         try:
-            request = conn.recv(CONFIGS["BUFFER_SIZE"]).decode()
-            print(f"--------------------------------------------------")
-            print(f"--------------------------------------------------")
-            print(f"Request: {request}")
-            print(
-                f"Time receive request: {time.ctime(time.time())}, {round(time.time() * 1000)}"
+            while True:
+                request = parser.next_request()
+                if request is None:
+                    size = conn.recv_into(buffer)
+                    if not size:
+                        break
+                    parser.feed(view[:size])
+                    continue
+                conn.keep_alive = wants_keep_alive(request)
+                self.handle_request(conn, request)
+                if not conn.keep_alive:
+                    break
+        except socket.timeout:
+            pass
+        except HttpError as e:
+            conn.keep_alive = False
+            self.send_http_response(conn, e.status, {"error": str(e)})
+        except Exception as e:
+            print(f"Error handling peer: {e}")
+            self.send_http_response(
+                conn, 500, {"error": "Internal Server Error"}
             )
-            if request.startswith("GET"):
-                self.handle_get_request(conn, request)
-            elif request.startswith("PUT"):
-                self.handle_put_request(conn, request)
-            else:
-                self.send_http_response(
-                    conn, 400, {"error": "Unsupported request"}
-                )
+        finally:
+            conn.close()
+
+    async def handle_peer_async(self, reader, writer):
+        """Handle individual peer connections on the event loop."""
+        conn = StreamConnection(writer)
+        parser = RequestParser()
+        try:
+            while True:
+                request = parser.next_request()
+                if request is None:
+                    data = await asyncio.wait_for(
+                        reader.read(CONFIGS["BUFFER_SIZE"]),
+                        CONFIGS["KEEP_ALIVE_TIMEOUT"],
+                    )
+                    if not data:
+                        break
+                    parser.feed(data)
+                    continue
+                conn.keep_alive = wants_keep_alive(request)
+                self.handle_request(conn, request)
+                await writer.drain()
+                if not conn.keep_alive:
+                    break
+        except asyncio.TimeoutError:
+            pass
+        except HttpError as e:
+            conn.keep_alive = False
+            self.send_http_response(conn, e.status, {"error": str(e)})
         except Exception as e:
             print(f"Error handling peer: {e}")
             self.send_http_response(
@@ -110,27 +476,48 @@ class Tracker:
         finally:
             conn.close()
 
+    def handle_request(self, conn, request):
+        """Route a parsed request (or raw request text) to the matching handler."""
+        if isinstance(request, str):
+            request = parse_request(request.encode())
+        print(f"--------------------------------------------------")
+        print(f"--------------------------------------------------")
+        print(f"Request: {request.method} {request.target}")
+        print(
+            f"Time receive request: {time.ctime(time.time())}, {round(time.time() * 1000)}"
+        )
+        if request.method == "GET":
+            self.handle_get_request(conn, request)
+        elif request.method == "PUT":
+            self.handle_put_request(conn, request)
+        else:
+            self.send_http_response(
+                conn, 400, {"error": "Unsupported request"}
+            )
+
     def handle_get_request(self, conn, request):
         """Process incoming requests from peers."""
         try:
-            # Split request to parse GET parameters
-            request_line = request.splitlines()[0]
-            method, path, _ = request_line.split()
+            # Raw request text is parsed here, e.g. when called directly
+            if isinstance(request, str):
+                request = parse_request(request.encode())
+            method, path = request.method, request.path
 
             # Ensure it's an HTTP GET request
             if method != "GET":
                 self.send_http_response(conn, 400, {"error": "Bad Request"})
                 return
 
-            # Extract query parameters from the path
-            query = path.split("?")[1]
-            params = dict(item.split("=") for item in query.split("&"))
+            # Query parameters, percent-decoded
+            params = request.params
 
             # Retrieve necessary parameters
             peer_id = params.get("peer_id")
             peer_ip = params.get("peer_ip_address")
             peer_port = params.get("peer_port")
             bitfield = params.get("bitfield")
+            since = params.get("since")
+            since = int(since) if since and since.isdigit() else None
 
             print(
                 f"Request from peer id = {peer_id} at {peer_ip}:{peer_port}, bitfield = {bitfield}:"
@@ -143,17 +530,42 @@ class Tracker:
                 )
                 return
 
+            if not valid_port(peer_port):
+                self.send_http_response(
+                    conn, 400, {"error": "Bad Request, invalid peer_port"}
+                )
+                return
+
+            try:
+                bitfield = self.decode_bitfield(params)
+            except ValueError:
+                self.send_http_response(
+                    conn, 400, {"error": "Bad Request, invalid bitfield"}
+                )
+                return
+
             if "announce" in path:
                 # Register the peer with extracted data
-                self.register_peer(peer_id, peer_ip, peer_port, bitfield)
+                registry = self.announce_peer(
+                    self.request_info_hash(params),
+                    peer_id,
+                    peer_ip,
+                    peer_port,
+                    bitfield,
+                )
+            else:
+                registry = self.request_torrent(params)
+                registry.touch(peer_id)
 
-            peer_list_text = "\n".join(
-                f"peer id: {id}, ip: {details['ip']}, port: {details['port']}, bitfield: {details['bitfield']}"
-                for id, details in self.peers.items()
+            peer_list = self.peer_list_response(
+                params, since, peer_id, bitfield, registry
             )
-            print(peer_list_text)
-            self.send_http_response(conn, 200, peer_list_text)
+            if isinstance(peer_list, str):
+                print(peer_list)
+            self.send_http_response(conn, 200, peer_list)
 
+        except HttpError as e:
+            self.send_http_response(conn, e.status, {"error": str(e)})
         except Exception as e:
             print(f"Error handling GET request: {e}")
             self.send_http_response(
@@ -162,24 +574,26 @@ class Tracker:
 
     def handle_put_request(self, conn, request):
         try:
-            # Split request to parse PUT parameters
-            request_line = request.splitlines()[0]
-            method, path, _ = request_line.split()
+            # Raw request text is parsed here, e.g. when called directly
+            if isinstance(request, str):
+                request = parse_request(request.encode())
+            method, path = request.method, request.path
 
             # Ensure it's an HTTP PUT request
             if method != "PUT":
                 self.send_http_response(conn, 400, {"error": "Bad Request"})
                 return
 
-            # Extract query parameters from the path
-            query = path.split("?")[1]
-            params = dict(item.split("=") for item in query.split("&"))
+            # Query parameters, percent-decoded
+            params = request.params
 
             # Retrieve necessary parameters
             peer_id = params.get("peer_id")
             peer_ip = params.get("peer_ip_address")
             peer_port = params.get("peer_port")
             bitfield = params.get("bitfield")
+            since = params.get("since")
+            since = int(since) if since and since.isdigit() else None
 
             print(
                 f"Request from peer id = {peer_id} at {peer_ip}:{peer_port}, bitfield = {bitfield}:"
@@ -192,11 +606,24 @@ class Tracker:
                 )
                 return
 
+            if not valid_port(peer_port):
+                self.send_http_response(
+                    conn, 400, {"error": "Bad Request, invalid peer_port"}
+                )
+                return
+
+            try:
+                bitfield = self.decode_bitfield(params)
+            except ValueError:
+                self.send_http_response(
+                    conn, 400, {"error": "Bad Request, invalid bitfield"}
+                )
+                return
+
+            registry = self.request_torrent(params)
             if "seeding" in path:
-                # Check if the peer is already registered
-                if peer_id in self.peers:
-                    # Update the peer's bitfield
-                    self.peers[peer_id]["bitfield"] = bitfield
+                # Update the peer's bitfield if it is already registered
+                if registry.update_bitfield(peer_id, bitfield):
                     print(f"Updated bitfield for peer {peer_id} to {bitfield}")
                 else:
                     # Peer is not found
@@ -207,20 +634,45 @@ class Tracker:
                     )
                     return
 
-            peer_list_text = "\n".join(
-                f"peer id: {id}, ip: {details['ip']}, port: {details['port']}, bitfield: {details['bitfield']}"
-                for id, details in self.peers.items()
+            peer_list = self.peer_list_response(
+                params, since, peer_id, bitfield, registry
             )
-            self.send_http_response(conn, 200, peer_list_text)
+            self.send_http_response(conn, 200, peer_list)
+        except HttpError as e:
+            self.send_http_response(conn, e.status, {"error": str(e)})
         except Exception as e:
             print(f"Error handling PUT request: {e}")
             self.send_http_response(
                 conn, 500, {"error": "Internal Server Error"}
             )
 
+    def expire_peers(self):
+        for info_hash, registry in list(self.torrents.items()):
+            for peer_id in registry.expire():
+                torrent = f" of torrent {info_hash}" if info_hash else ""
+                print(
+                    f"Peer {peer_id}{torrent} expired, not seen for {CONFIGS['PEER_TTL']} seconds"
+                )
+            if not len(registry) and self.drop_torrent(info_hash):
+                print(f"Dropped torrent {info_hash}, it has no peers left")
+
+    def sweep_expired_peers(self):
+        """Expire silent peers periodically, in a background thread."""
+        while True:
+            time.sleep(CONFIGS["EXPIRY_SWEEP_INTERVAL"])
+            self.expire_peers()
+
+    async def sweep_expired_peers_async(self):
+        while True:
+            await asyncio.sleep(CONFIGS["EXPIRY_SWEEP_INTERVAL"])
+            self.expire_peers()
+
     def run(self):
         """Start the tracker to listen for incoming peer connections."""
         try:
+            self.open_store()
+            threading.Thread(target=self.sweep_expired_peers, daemon=True).start()
+            self.listen()
             self.server_socket.settimeout(1)
             while True:
                 try:
@@ -238,11 +690,83 @@ class Tracker:
         except Exception as e:
             print(f"Error running tracker: {e}")
         finally:
-            self.server_socket.close()
+            if self.server_socket:
+                self.server_socket.close()
+            self.close_stores()
             print("Tracker closed.")
             sys.exit(0)
 
+    def raise_open_file_limit(self):
+        """Lift the soft file descriptor limit so many peers can stay connected."""
+        if resource is None:
+            return
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or hard > soft:
+            try:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            except (ValueError, OSError) as e:
+                print(f"Could not raise open file limit: {e}")
+
+    async def serve(self, reuse_port=False, sweep=True):
+        """Serve every peer connection from a single asyncio event loop.
+
+        With `reuse_port`, several processes can listen on the same port.
+        """
+        server = await asyncio.start_server(
+            self.handle_peer_async,
+            host=self.host,
+            port=self.port,
+            backlog=CONFIGS["ASYNC_BACKLOG"],
+            reuse_address=True,
+            reuse_port=reuse_port or None,
+        )
+        print(f"Tracker is listening on {self.host}:{self.port} (asyncio)")
+        sweeper = None
+        if sweep:
+            sweeper = asyncio.create_task(self.sweep_expired_peers_async())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if sweeper:
+                sweeper.cancel()
+
+    def run_async(self, reuse_port=False, primary=True):
+        """Start the tracker in asyncio mode instead of one thread per peer.
+
+        Workers of a multi-process tracker are not `primary`: the parent
+        process keeps the registry on disk and expires peers.
+        """
+        self.raise_open_file_limit()
+        try:
+            if primary:
+                self.open_store()
+            asyncio.run(self.serve(reuse_port, sweep=primary))
+        except KeyboardInterrupt:
+            print("Shuting down the tracker...")
+        except Exception as e:
+            print(f"Error running tracker: {e}")
+        finally:
+            self.close_stores()
+            print("Tracker closed.")
+
 
 if __name__ == "__main__":
+    if "--port" in sys.argv:
+        # Another node of the tracker ring, e.g. on the same host
+        port = int(sys.argv[sys.argv.index("--port") + 1])
+        CONFIGS["TRACKER_PORT"] = port
+        CONFIGS["TRACKER_STATE_DIR"] = f"{CONFIGS['TRACKER_STATE_DIR']}_{port}"
+    workers = CONFIGS["TRACKER_WORKERS"]
+    if "--workers" in sys.argv:
+        workers = int(sys.argv[sys.argv.index("--workers") + 1])
+    if workers > 1:
+        from tracker_cluster import run_cluster
+
+        run_cluster(workers, CONFIGS["TRACKER_PORT"])
+        sys.exit(0)
     tracker = Tracker()
-    tracker.run()
+    if "--async" in sys.argv or CONFIGS["TRACKER_MODE"] == "async":
+        tracker.run_async()
+    else:
+        tracker.run()
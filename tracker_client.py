@@ -0,0 +1,149 @@
+import asyncio
+import time
+
+from config import CONFIGS
+from protocol import read_body, read_response_head
+
+
+class TrackerSession:
+    """Long-lived keep-alive connection from a peer to the tracker.
+
+    Requests are sent one at a time over the same connection, which is
+    reopened if the tracker closed it in between. Bitfield updates sent with
+    `report` are coalesced: while one update is in flight or waiting to be
+    sent, later updates ride along with it instead of sending their own.
+
+    When the tracker can't be reached, or doesn't answer within
+    REQUEST_TIMEOUT seconds, the session fails over to the next
+    of the `fallbacks` nodes. Once TRACKER_FAILBACK_INTERVAL seconds have
+    passed, the next request tries the first node again, so peers come
+    back together on it when it recovers.
+    """
+
+    def __init__(self, host, port, fallbacks=()):
+        # The node to ask first, then the ones to fail over to, in order
+        self.nodes = [(host, port), *fallbacks]
+        self.node = 0
+        self.host = host
+        self.port = port
+        # Called after switching nodes, as the new node knows nothing of us
+        self.on_fail_over = None
+        self.failed_at = None
+        self.reader = None
+        self.writer = None
+        self.lock = asyncio.Lock()
+        self.report_task = None
+        self.report_pending = False
+
+    def is_open(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def request(self, method, path):
+        """Send one request and return its status code and body.
+
+        The body is decoded to text, except for binary (octet-stream)
+        responses, which are returned as bytes. `path` may also be a
+        function returning the path, which is called again after failing
+        over so the request can change with the node.
+        """
+        async with self.lock:
+            if (
+                self.node
+                and time.monotonic() - self.failed_at
+                >= CONFIGS["TRACKER_FAILBACK_INTERVAL"]
+            ):
+                host, port = self.nodes[0]
+                print(f"Trying tracker {host}:{port} again")
+                self.use_node(0)
+            for attempt in range(len(self.nodes)):
+                target = path() if callable(path) else path
+                try:
+                    return await self.request_node(method, target)
+                except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                    if attempt == len(self.nodes) - 1:
+                        raise
+                    self.fail_over(e)
+
+    async def request_node(self, method, path):
+        for attempt in range(2):
+            reused = self.is_open()
+            if not reused:
+                self.reader, self.writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port),
+                    CONFIGS["REQUEST_TIMEOUT"],
+                )
+            try:
+                return await asyncio.wait_for(
+                    self.exchange(method, path), CONFIGS["REQUEST_TIMEOUT"]
+                )
+            except asyncio.TimeoutError:
+                # The rest of a late response would garble the next one
+                self.close()
+                raise
+            except (asyncio.IncompleteReadError, ConnectionError):
+                self.close()
+                # Only retry if the tracker closed an idle connection
+                if not reused or attempt:
+                    raise
+
+    def fail_over(self, error):
+        """Move on to the next tracker node."""
+        print(f"Tracker {self.host}:{self.port} failed: {error!r}")
+        self.failed_at = time.monotonic()
+        self.use_node((self.node + 1) % len(self.nodes))
+        print(f"Failing over to tracker {self.host}:{self.port}")
+
+    def use_node(self, node):
+        self.close()
+        self.node = node
+        self.host, self.port = self.nodes[node]
+        if self.on_fail_over is not None:
+            self.on_fail_over()
+
+    async def exchange(self, method, path):
+        request = (
+            f"{method} {path} HTTP/1.1\r\n"
+            f"Host: {self.host}:{self.port}\r\n"
+            "Connection: keep-alive\r\n"
+            "\r\n"
+        )
+        self.writer.write(request.encode())
+        await self.writer.drain()
+        status, headers = await read_response_head(self.reader)
+        body = bytearray()
+        await read_body(
+            self.reader, int(headers.get("content-length", 0)), body.extend
+        )
+        if headers.get("connection", "").lower() != "keep-alive":
+            self.close()
+        if headers.get("content-type") == "application/octet-stream":
+            # Compact peer lists stay binary
+            return status, bytes(body)
+        return status, body.decode()
+
+    async def report(self, build_path):
+        """Send a PUT for the path returned by `build_path`, coalescing updates.
+
+        `build_path` is called right before sending, so the request carries
+        the latest state. Returns the response of the PUT that carried this
+        update.
+        """
+        self.report_pending = True
+        if self.report_task is None or self.report_task.done():
+            self.report_task = asyncio.create_task(self.send_reports(build_path))
+        return await asyncio.shield(self.report_task)
+
+    async def send_reports(self, build_path):
+        response = None
+        while self.report_pending:
+            # Give updates that complete around the same time a moment to
+            # join this request
+            await asyncio.sleep(CONFIGS["REPORT_DELAY"])
+            self.report_pending = False
+            response = await self.request("PUT", build_path)
+        return response
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
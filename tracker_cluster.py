@@ -0,0 +1,258 @@
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+from multiprocessing.connection import wait
+
+from config import CONFIGS
+from peer_registry import PeerRegistry
+from protocol import HttpError
+from tracker import Tracker
+
+
+class ReplicaRegistry(PeerRegistry):
+    """Read-only copy of a torrent's primary registry, kept in a worker process.
+
+    Reads are served from the local copy like any PeerRegistry. Writes are
+    sent to the primary in the parent process, which orders them, gives
+    them their versions and sends the resulting records back to every
+    worker, so all replicas go through the same versions and any of them
+    can serve a delta from a version another one handed out.
+    """
+
+    def __init__(self, replicas, info_hash):
+        super().__init__()
+        self.replicas = replicas
+        self.info_hash = info_hash
+
+    def send(self, *message):
+        self.replicas.send((message[0], self.info_hash) + message[1:])
+
+    def register(self, peer_id, ip, port, bitfield, now=None):
+        self.send("register", peer_id, ip, port, bitfield)
+
+    def update_bitfield(self, peer_id, bitfield, now=None):
+        if peer_id not in self:
+            return False
+        self.send("update_bitfield", peer_id, bitfield)
+        return True
+
+    def touch(self, peer_id, now=None):
+        if peer_id not in self:
+            return False
+        self.send("touch", peer_id)
+        return True
+
+    def expire(self, now=None):
+        # The primary expires peers and sends out the tombstones
+        return []
+
+
+class ReplicaSet:
+    """The replica of every torrent in a worker, all fed by one pipe."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.replicas = {}
+        self.lock = threading.Lock()
+        # Returns the replica of a torrent the primary sent changes of,
+        # creating it if needed
+        self.lookup = self.replica
+        # Called with the info hash of every torrent the primary dropped
+        self.on_drop = None
+
+    def send(self, message):
+        with self.send_lock:
+            self.conn.send(message)
+
+    def replica(self, info_hash):
+        """Return the replica of a torrent, creating it on first use."""
+        with self.lock:
+            replica = self.replicas.get(info_hash)
+            if replica is None:
+                replica = ReplicaRegistry(self, info_hash)
+                self.replicas[info_hash] = replica
+            return replica
+
+    def follow(self):
+        """Apply the changes sent by the primary, until it goes away."""
+        while True:
+            try:
+                message = self.conn.recv()
+            except EOFError:
+                return
+            if message[0] == "drop":
+                if self.on_drop is not None:
+                    self.on_drop(message[1])
+                with self.lock:
+                    self.replicas.pop(message[1], None)
+                continue
+            try:
+                replica = self.lookup(message[1])
+            except HttpError as e:
+                print(f"Dropped {message[0]} of torrent {message[1]}: {e}")
+                continue
+            if message[0] == "record":
+                replica.apply(message[2], message[3])
+            elif message[0] == "purge":
+                replica.purge(message[2], message[3])
+            elif message[0] == "restore":
+                replica.restore(message[2], message[3], message[4])
+
+
+class ReplicationHub:
+    """Applies the writes of all workers to the tracker's primary registries.
+
+    Every change a primary publishes is sent to every worker, under the
+    registry lock, so workers receive each torrent's changes in version
+    order. Dropped torrents are dropped by the workers too.
+    """
+
+    def __init__(self, tracker):
+        self.tracker = tracker
+        self.lock = threading.Lock()
+        self.conns = []
+        for info_hash, registry in list(tracker.torrents.items()):
+            self.watch(info_hash, registry)
+        tracker.on_new_torrent = self.watch
+        tracker.on_drop_torrent = self.unwatch
+
+    def watch(self, info_hash, registry):
+        """Send the changes of a torrent's primary registry to the workers."""
+        # Whoever listened before us, e.g. the torrent's write-ahead log
+        forward = registry.on_change
+
+        def publish(peer_id, record):
+            if forward is not None:
+                forward(peer_id, record)
+            self.broadcast(("record", info_hash, peer_id, record))
+
+        def publish_purge(peer_ids, floor):
+            self.broadcast(("purge", info_hash, peer_ids, floor))
+
+        registry.on_change = publish
+        registry.on_purge = publish_purge
+
+    def unwatch(self, info_hash):
+        self.broadcast(("drop", info_hash))
+
+    def add_worker(self, conn):
+        with self.lock:
+            self.conns.append(conn)
+        for info_hash, registry in list(self.tracker.torrents.items()):
+            # Changes are broadcast under the registry lock, so none can
+            # reach the worker between the snapshot and its restore. Older
+            # ones sent before are part of the snapshot.
+            with registry.locked_snapshot() as snapshot:
+                with self.lock:
+                    conn.send(
+                        (
+                            "restore",
+                            info_hash,
+                            snapshot.version,
+                            snapshot.peers,
+                            snapshot.floor,
+                        )
+                    )
+
+    def broadcast(self, message):
+        with self.lock:
+            for conn in list(self.conns):
+                try:
+                    conn.send(message)
+                except (BrokenPipeError, EOFError, OSError):
+                    self.conns.remove(conn)
+
+    def serve(self):
+        """Apply worker writes until every worker has gone away."""
+        conns = list(self.conns)
+        while conns:
+            for conn in wait(conns):
+                try:
+                    message = conn.recv()
+                except EOFError:
+                    conns.remove(conn)
+                    continue
+                try:
+                    if message[0] == "register":
+                        self.tracker.announce_peer(*message[1:])
+                        continue
+                    registry = self.tracker.torrent(message[1], create=False)
+                except HttpError as e:
+                    print(f"Dropped {message[0]} of torrent {message[1]}: {e}")
+                    continue
+                if message[0] == "update_bitfield":
+                    registry.update_bitfield(*message[2:])
+                elif message[0] == "touch":
+                    registry.touch(*message[2:])
+
+
+def follow_primary(replicas):
+    replicas.follow()
+    # The primary is gone, stop serving registries nobody updates
+    os._exit(0)
+
+
+def run_worker(conn, index, port):
+    replicas = ReplicaSet(conn)
+    threading.Thread(target=follow_primary, args=(replicas,), daemon=True).start()
+    tracker = Tracker(registry_factory=replicas.replica)
+    # Torrents others announced are known here too, and dropped with the
+    # primary's, whose replicas are empty by then like it was
+    replicas.lookup = tracker.torrent
+    replicas.on_drop = tracker.drop_torrent
+    tracker.port = port
+    print(f"Tracker worker {index} started")
+    tracker.run_async(reuse_port=True, primary=False)
+
+
+def run_cluster(count, port=None):
+    """Serve the tracker port from `count` worker processes.
+
+    The workers share the listening port through SO_REUSEPORT, so the
+    kernel spreads connections across them, and each parses and answers
+    requests in its own interpreter. The parent process holds the primary
+    registries with their write-ahead logs and expiry sweeper.
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise RuntimeError("SO_REUSEPORT is not supported on this platform")
+    # Stop the workers too when the tracker is killed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    tracker = Tracker()
+    if port is not None:
+        tracker.port = port
+    tracker.open_store()
+    hub = ReplicationHub(tracker)
+    # Fresh interpreters, so workers don't inherit each other's pipes
+    context = multiprocessing.get_context("spawn")
+    workers = []
+    for index in range(count):
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(
+            target=run_worker,
+            args=(child_conn, index, tracker.port),
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        hub.add_worker(parent_conn)
+        workers.append(process)
+    threading.Thread(target=tracker.sweep_expired_peers, daemon=True).start()
+    print(f"Tracker is running {count} workers on {tracker.host}:{tracker.port}")
+    try:
+        hub.serve()
+    except KeyboardInterrupt:
+        print("Shuting down the tracker...")
+    finally:
+        for process in workers:
+            process.terminate()
+            process.join()
+        tracker.close_stores()
+        print("Tracker closed.")
+
+
+if __name__ == "__main__":
+    run_cluster(CONFIGS["TRACKER_WORKERS"])
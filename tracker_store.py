@@ -0,0 +1,222 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from bitfield import Bitfield
+from config import CONFIGS
+from peer_registry import PeerRecord
+
+
+def encode_record(peer_id, record):
+    return [
+        peer_id,
+        record.ip,
+        record.port,
+        record.bitfield.to_base64(),
+        len(record.bitfield),
+        record.online,
+        record.version,
+    ]
+
+
+def decode_record(item):
+    peer_id, ip, port, bitfield, length, online, version = item
+    return peer_id, PeerRecord(
+        ip, port, Bitfield.from_base64(length, bitfield), online, version
+    )
+
+
+class LogFiles:
+    """Append-only log files, at most `limit` of them open at once.
+
+    A tracker keeps one log per torrent, and a file descriptor for each
+    could run out long before the torrents do. Files are opened on their
+    first write and the least recently written one is closed to make room.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.files = OrderedDict()
+        self._lock = threading.Lock()
+
+    def write(self, path, data):
+        with self._lock:
+            outfile = self.files.pop(path, None)
+            if outfile is None:
+                if len(self.files) >= self.limit:
+                    _, oldest = self.files.popitem(last=False)
+                    oldest.close()
+                outfile = open(path, "a")
+            self.files[path] = outfile
+            outfile.write(data)
+            outfile.flush()
+
+    def close(self, path):
+        with self._lock:
+            outfile = self.files.pop(path, None)
+            if outfile is not None:
+                outfile.close()
+
+    def close_all(self):
+        with self._lock:
+            for outfile in self.files.values():
+                outfile.close()
+            self.files.clear()
+
+
+class RegistryStore:
+    """Persists a PeerRegistry with a write-ahead log and snapshots.
+
+    Every registry change is appended to the log as the full new record of
+    the peer, tagged with its registry version, so replaying an entry twice
+    is harmless. Once the log holds WAL_MAX_ENTRIES entries or is older than
+    SNAPSHOT_INTERVAL seconds, a snapshot of the whole registry is written in
+    a background thread and the log is started afresh. Recovery loads the
+    latest snapshot and replays at most a couple of logs on top of it, so
+    its cost is bounded by the snapshot size plus WAL_MAX_ENTRIES.
+
+    Versions survive a restart, so peers can keep asking for deltas since
+    the last version they saw instead of all re-fetching the full list.
+    The log is written through `log_files`, which may be shared by the
+    stores of many torrents.
+    """
+
+    def __init__(self, directory, registry, log_files=None):
+        self.directory = directory
+        self.registry = registry
+        self.log_files = log_files if log_files is not None else LogFiles(1)
+        self.snapshot_path = os.path.join(directory, "snapshot.json")
+        self.wal_path = os.path.join(directory, "tracker.wal")
+        # The log being compacted into a snapshot, if any
+        self.old_wal_path = self.wal_path + ".old"
+        self._lock = threading.Lock()
+        # Held for a whole compaction, so two never overlap
+        self._compact_lock = threading.Lock()
+        self.logging = False
+        self.wal_entries = 0
+        self.wal_started = time.monotonic()
+        self.compacting = False
+
+    def open(self):
+        """Recover the registry from disk and start logging its changes."""
+        os.makedirs(self.directory, exist_ok=True)
+        start = time.monotonic()
+        version, peers, floor = self.recover()
+        self.registry.restore(version, peers, floor)
+        print(
+            f"Recovered {len(peers)} peers at version {version} in {time.monotonic() - start:.3f} seconds"
+        )
+        # Fold whatever was replayed into a fresh snapshot, so the logs can go
+        self.write_snapshot(self.registry.snapshot())
+        for path in (self.old_wal_path, self.wal_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.logging = True
+        self.registry.on_change = self.append
+
+    def recover(self):
+        version = 0
+        floor = 0
+        peers = {}
+        try:
+            with open(self.snapshot_path, "r") as infile:
+                data = json.load(infile)
+            version = data["version"]
+            floor = data.get("floor", 0)
+            for item in data["peers"]:
+                peer_id, record = decode_record(item)
+                peers[peer_id] = record
+        except FileNotFoundError:
+            pass
+        for path in (self.old_wal_path, self.wal_path):
+            version = self.replay(path, version, peers)
+        return version, peers, floor
+
+    def replay(self, path, version, peers):
+        """Apply the log entries newer than `version` to `peers`."""
+        try:
+            infile = open(path, "r")
+        except FileNotFoundError:
+            return version
+        with infile:
+            for line in infile:
+                try:
+                    peer_id, record = decode_record(json.loads(line))
+                except ValueError:
+                    # A torn last line from a crash mid-write
+                    break
+                if record.version <= version:
+                    continue
+                peers.pop(peer_id, None)
+                peers[peer_id] = record
+                version = record.version
+        return version
+
+    def append(self, peer_id, record):
+        """Log one change; called by the registry under its lock."""
+        with self._lock:
+            if not self.logging:
+                return
+            self.log_files.write(
+                self.wal_path, json.dumps(encode_record(peer_id, record)) + "\n"
+            )
+            self.wal_entries += 1
+            due = (
+                self.wal_entries >= CONFIGS["WAL_MAX_ENTRIES"]
+                or time.monotonic() - self.wal_started
+                >= CONFIGS["SNAPSHOT_INTERVAL"]
+            )
+            if not due or self.compacting:
+                return
+            self.compacting = True
+        threading.Thread(target=self.compact, daemon=True).start()
+
+    def compact(self):
+        """Write a snapshot of the registry and drop the log it covers."""
+        with self._compact_lock:
+            with self._lock:
+                if not self.logging:
+                    return
+                self.compacting = True
+                # Changes from here on go to a new log
+                self.log_files.close(self.wal_path)
+                if os.path.exists(self.wal_path):
+                    os.replace(self.wal_path, self.old_wal_path)
+                self.wal_entries = 0
+                self.wal_started = time.monotonic()
+            # Taken after switching logs, and outside our lock since the
+            # registry calls `append` under its own: it covers the whole old
+            # log, and the changes it shares with the new one are skipped on
+            # replay
+            snapshot = self.registry.snapshot()
+            try:
+                self.write_snapshot(snapshot)
+                if os.path.exists(self.old_wal_path):
+                    os.remove(self.old_wal_path)
+            finally:
+                with self._lock:
+                    self.compacting = False
+
+    def write_snapshot(self, snapshot):
+        data = {
+            "version": snapshot.version,
+            "floor": snapshot.floor,
+            "peers": [
+                encode_record(peer_id, record)
+                for peer_id, record in snapshot.peers.items()
+            ],
+        }
+        temp_path = self.snapshot_path + ".tmp"
+        with open(temp_path, "w") as outfile:
+            json.dump(data, outfile)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(temp_path, self.snapshot_path)
+
+    def close(self):
+        with self._compact_lock, self._lock:
+            self.registry.on_change = None
+            self.logging = False
+            self.log_files.close(self.wal_path)